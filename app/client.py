@@ -0,0 +1,455 @@
+"""
+Command-line client for bulk uploads and downloads.
+
+Usage:
+    python -m app.client --server https://host:8443 --user alice upload ./photos ./notes.txt
+    python -m app.client --server https://host:8443 --user alice download ./mirror --match "*.pdf"
+
+One logged-in session is shared by every transfer, over a pool of
+keep-alive connections, so a sync pays for one TLS handshake per
+connection and one password check in total. Files the server already
+has (same size and SHA-256) are skipped, failed transfers are retried
+with backoff, and interrupted downloads resume from where they stopped.
+The password is read from --password, the UPLOAD_PASSWORD environment
+variable, or a prompt.
+"""
+import argparse
+import base64
+import fnmatch
+import getpass
+import hashlib
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Statuses worth another attempt: overload, rate limiting and gateway errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Files checked against the server per lookup request
+LOOKUP_BATCH_SIZE = 1000
+
+
+class ClientError(Exception):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class Progress:
+    """Thread-safe transfer counters, reported to stderr while transfers run."""
+
+    def __init__(self, total_files: int, total_bytes: int, interval: float = 1.0, quiet: bool = False):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.quiet = quiet
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self.bytes += count
+
+    def finish_file(self, outcome: str):
+        with self._lock:
+            if outcome == "done":
+                self.done += 1
+            elif outcome == "skipped":
+                self.skipped += 1
+            else:
+                self.failed += 1
+
+    def throughput(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def line(self) -> str:
+        finished = self.done + self.skipped + self.failed
+        return (f"{finished}/{self.total_files} files ({self.skipped} skipped, {self.failed} failed), "
+                f"{format_size(self.bytes)} of {format_size(self.total_bytes)}, {format_size(self.throughput())}/s")
+
+    def _report(self):
+        ending = "\r" if sys.stderr.isatty() else "\n"
+        while not self._stop.wait(self.interval):
+            print(self.line(), end=ending, file=sys.stderr, flush=True)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        if not self.quiet:
+            self._thread = threading.Thread(target=self._report, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        elapsed = time.perf_counter() - self.started
+        print(f"{self.line()} in {elapsed:.1f}s", file=sys.stderr)
+
+
+class MultipartFile:
+    """
+    A multipart/form-data body streamed from disk.
+    It has a length, so requests sends a Content-Length (which the server
+    checks against quotas before accepting the body) without reading the
+    whole file into memory.
+    """
+
+    def __init__(self, path: str, fields: Dict[str, str], on_read: Callable[[int], None],
+                 sha256: Optional[str] = None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.on_read = on_read
+
+        preamble = b""
+        for name, value in fields.items():
+            preamble += (f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                         f"{value}\r\n").encode()
+        filename = os.path.basename(path).replace('"', "_")
+        # The server checks the file against its digest and rejects it if it was corrupted in transit
+        digest = f"Content-Digest: sha-256=:{base64.b64encode(bytes.fromhex(sha256)).decode()}:\r\n" if sha256 else ""
+        preamble += (f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+                     f"Content-Type: application/octet-stream\r\n{digest}\r\n").encode("utf-8")
+        self._parts = [preamble, None, f"\r\n--{self.boundary}--\r\n".encode()]
+        self._file = open(path, "rb")
+        self._length = len(preamble) + os.fstat(self._file.fileno()).st_size + len(self._parts[2])
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        data = b""
+        while self._parts and (size < 0 or len(data) < size):
+            part = self._parts[0]
+            want = -1 if size < 0 else size - len(data)
+            if part is None:
+                chunk = self._file.read(want)
+                if not chunk:
+                    self._parts.pop(0)
+                    continue
+                self.on_read(len(chunk))
+                data += chunk
+            else:
+                chunk = part if want < 0 else part[:want]
+                data += chunk
+                rest = part[len(chunk):]
+                if rest:
+                    self._parts[0] = rest
+                else:
+                    self._parts.pop(0)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class UploadClient:
+    """A logged-in session against the upload server, shared by concurrent transfers."""
+
+    def __init__(self, server: str, username: str, password: str, concurrency: int = 4,
+                 retries: int = 5, timeout: float = 60, verify: bool = True):
+        self.server = server.rstrip("/")
+        self.username = username
+        self.password = password
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._login_lock = threading.Lock()
+
+    def login(self):
+        response = self.session.post(
+            f"{self.server}/login",
+            data={"username": self.username, "password": self.password},
+            allow_redirects=False,
+            timeout=self.timeout
+        )
+        session_id = response.cookies.get("session_id")
+        if response.status_code != 303 or not session_id:
+            raise ClientError(f"Login failed for user '{self.username}'")
+        # Set again without the Secure flag, so plain-HTTP test servers work too
+        self.session.cookies.clear()
+        self.session.cookies.set("session_id", session_id)
+
+    def _relogin(self, stale_session: Optional[str]):
+        with self._login_lock:
+            # Another thread may have logged in again already
+            if self.session.cookies.get("session_id") == stale_session:
+                self.login()
+
+    def request(self, method: str, path: str, make_kwargs: Callable[[], Dict] = dict, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying connection errors and overload responses with backoff.
+        make_kwargs builds per-attempt arguments (e.g. a fresh request body).
+        """
+        for attempt in range(self.retries + 1):
+            session_id = self.session.cookies.get("session_id")
+            attempt_kwargs = make_kwargs()
+            try:
+                response = self.session.request(method, f"{self.server}{path}", allow_redirects=False,
+                                                timeout=self.timeout, **kwargs, **attempt_kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise ClientError(f"{method} {path} failed: {e}")
+                delay = min(2 ** attempt, 30)
+            else:
+                if response.status_code in (303, 307) and response.headers.get("location", "").startswith("/?next="):
+                    # The session expired
+                    self._relogin(session_id)
+                    delay = 0
+                elif response.status_code in RETRY_STATUSES and attempt < self.retries:
+                    retry_after = response.headers.get("retry-after", "")
+                    delay = float(retry_after) if retry_after.isdigit() else min(2 ** attempt, 30)
+                else:
+                    return response
+            finally:
+                body = attempt_kwargs.get("data")
+                if hasattr(body, "close"):
+                    body.close()
+            time.sleep(delay)
+
+        return response
+
+    def lookup(self, checksums: List[Tuple[str, int]]) -> set:
+        """Get the (sha256, size) pairs the server already has."""
+        existing = set()
+        for i in range(0, len(checksums), LOOKUP_BATCH_SIZE):
+            batch = checksums[i:i + LOOKUP_BATCH_SIZE]
+            response = self.request("POST", "/api/files/lookup",
+                                    json={"files": [{"sha256": sha256, "size": size} for sha256, size in batch]})
+            if response.status_code != 200:
+                raise ClientError(f"Lookup failed: {response.status_code} {response.text[:200]}")
+            existing.update((item["sha256"], item["size"]) for item in response.json()["files"])
+        return existing
+
+    def list_files(self) -> List[Dict]:
+        files = []
+        page = 1
+        while True:
+            response = self.request("GET", "/api/files", params={"page": page, "per_page": 1000})
+            if response.status_code != 200:
+                raise ClientError(f"Listing files failed: {response.status_code} {response.text[:200]}")
+            body = response.json()
+            files.extend(body["files"])
+            if page >= body["pages"]:
+                return files
+            page += 1
+
+    def upload(self, path: str, progress: Progress, ttl: Optional[str] = None, sha256: Optional[str] = None) -> Dict:
+        fields = {"ttl": ttl} if ttl else {}
+        sent = [0]
+
+        def on_read(count):
+            sent[0] += count
+            progress.add_bytes(count)
+
+        def make_body():
+            # A retry starts the file over, so take back what the failed attempt counted
+            progress.add_bytes(-sent[0])
+            sent[0] = 0
+            body = MultipartFile(path, fields, on_read, sha256)
+            return {"data": body, "headers": {"Content-Type": body.content_type}}
+
+        response = self.request("POST", "/upload", make_kwargs=make_body)
+        if response.status_code != 200:
+            raise ClientError(f"{response.status_code} {response.text[:200]}")
+        return response.json()
+
+    def download(self, file: Dict, dest_dir: str, progress: Progress) -> str:
+        """Download a file into dest_dir, resuming a previous partial download (.part)."""
+        target = os.path.join(dest_dir, file["name"])
+        part = f"{target}.part"
+
+        for attempt in range(self.retries + 1):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {"Accept-Encoding": "identity"}
+            if 0 < offset < file["size"]:
+                headers["Range"] = f"bytes={offset}-"
+            elif offset:
+                offset = 0
+
+            try:
+                response = self.request("GET", f"/files/{quote(file['name'])}",
+                                        headers=headers, stream=True)
+                if response.status_code not in (200, 206):
+                    raise ClientError(f"{response.status_code} {response.text[:200]}")
+                with response, open(part, "ab" if response.status_code == 206 else "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        progress.add_bytes(len(chunk))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                # Keep what arrived; the next attempt asks for the rest
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+                continue
+
+            if file.get("sha256") and file_sha256(part) != file["sha256"]:
+                os.remove(part)
+                if attempt == self.retries:
+                    raise ClientError("Checksum mismatch")
+                continue
+            os.replace(part, target)
+            return target
+
+        raise ClientError("Download did not complete")
+
+
+def collect_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            raise ClientError(f"No such file or directory: {path}")
+    return files
+
+
+def run_upload(client: UploadClient, args) -> int:
+    paths = collect_files(args.paths)
+    sizes = {path: os.path.getsize(path) for path in paths}
+
+    existing = set()
+    checksums = {}
+    if not args.no_skip:
+        print(f"Hashing {len(paths)} files...", file=sys.stderr)
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            checksums = dict(zip(paths, pool.map(file_sha256, paths)))
+        existing = client.lookup(sorted({(checksums[path], sizes[path]) for path in paths}))
+
+    failed = []
+    with Progress(len(paths), sum(sizes.values()), quiet=args.quiet) as progress:
+        pending = []
+        for path in paths:
+            if (checksums.get(path), sizes[path]) in existing:
+                progress.total_bytes -= sizes[path]
+                progress.finish_file("skipped")
+            else:
+                pending.append(path)
+
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            futures = {pool.submit(client.upload, path, progress, args.ttl, checksums.get(path)): path for path in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    progress.finish_file("done")
+                except (ClientError, OSError) as e:
+                    failed.append(futures[future])
+                    progress.finish_file("failed")
+                    print(f"Upload failed: {futures[future]}: {e}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+def run_download(client: UploadClient, args) -> int:
+    os.makedirs(args.dest, exist_ok=True)
+    files = [file for file in client.list_files() if fnmatch.fnmatch(file["name"], args.match)]
+
+    failed = []
+    with Progress(len(files), sum(file["size"] for file in files), quiet=args.quiet) as progress:
+        pending = []
+        for file in files:
+            target = os.path.join(args.dest, file["name"])
+            if os.path.exists(target) and os.path.getsize(target) == file["size"] \
+                    and (not file.get("sha256") or file_sha256(target) == file["sha256"]):
+                progress.total_bytes -= file["size"]
+                progress.finish_file("skipped")
+            else:
+                pending.append(file)
+
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            futures = {pool.submit(client.download, file, args.dest, progress): file for file in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    progress.finish_file("done")
+                except (ClientError, OSError, requests.RequestException) as e:
+                    failed.append(futures[future]["name"])
+                    progress.finish_file("failed")
+                    print(f"Download failed: {futures[future]['name']}: {e}", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk upload and download client")
+    parser.add_argument("--server", default=os.environ.get("UPLOAD_SERVER", "https://localhost:8443"))
+    parser.add_argument("--user", default=os.environ.get("UPLOAD_USER"), required="UPLOAD_USER" not in os.environ)
+    parser.add_argument("--password", default=os.environ.get("UPLOAD_PASSWORD"))
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent transfers")
+    parser.add_argument("--retries", type=int, default=5, help="Attempts after the first for each request")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the server")
+    parser.add_argument("--insecure", action="store_true", help="Do not verify the server's TLS certificate")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upload = commands.add_parser("upload", help="Upload files and directories")
+    upload.add_argument("paths", nargs="+")
+    upload.add_argument("--ttl", help="Delete the uploads after this many seconds (requires retention)")
+    upload.add_argument("--no-skip", action="store_true", help="Upload files the server already has")
+
+    download = commands.add_parser("download", help="Download files into a directory")
+    download.add_argument("dest")
+    download.add_argument("--match", default="*", help="Only files whose name matches this pattern")
+
+    args = parser.parse_args(argv)
+    password = args.password or getpass.getpass(f"Password for {args.user}: ")
+
+    if args.insecure:
+        requests.packages.urllib3.disable_warnings()
+    client = UploadClient(args.server, args.user, password, concurrency=args.concurrency,
+                          retries=args.retries, timeout=args.timeout, verify=not args.insecure)
+    try:
+        client.login()
+        if args.command == "upload":
+            return run_upload(client, args)
+        return run_download(client, args)
+    except ClientError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
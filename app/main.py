@@ -1,30 +1,50 @@
+import asyncio
 import os
+import signal
 import time
 import uuid
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional, Dict
 
-import uvicorn
 from fastapi import FastAPI, File, UploadFile, Request, Response, HTTPException, Depends, BackgroundTasks, Form, Query
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-import shutil
-import requests
+from markupsafe import Markup
 
-from app.utils.config import get_config
+from app.utils.config import get_config, get_settings, on_config_reload, reload_config, watch_config
 from app.utils.auth import (
     authenticate_user, get_current_user, create_session, set_session_cookie, 
     clear_session_cookie, writer_required, reader_required, admin_required,
-    get_current_user_from_session, get_api_user
+    get_current_user_from_session, get_api_user, metrics_access_required
 )
-from app.utils.logging_utils import setup_logger
-from app.utils.file_utils import is_file_allowed, get_file_path
-from app.utils.download_utils import get_file_list, get_file_info
+from app.utils.logging_utils import setup_logger, set_log_level, audit_event
+from app.utils.file_utils import is_file_allowed, is_content_allowed, get_file_path, get_incoming_path, clean_incoming_dir, get_relative_path, resolve_file_path, try_lock
+from app.utils.download_utils import get_file_list, get_file_info, get_mime_type, parse_range_header, RangeFileResponse, RemoteFileResponse, content_disposition
+from app.utils.share_links import get_share_config, create_share_link, verify_share_link, count_share_download
+from app.utils.archive_utils import get_archive_format, list_archive, find_member, iter_member, get_member_media_type
 from app.utils.ip_utils import is_ip_allowed, get_ip_info
 from app.utils.rate_limit import RateLimiter
+from app.utils.upload_scheduler import UploadScheduler
+from app.utils.download_scheduler import DownloadScheduler
+from app.utils.draining import get_drain_state, get_drain_config
+from app.utils.metadata import get_metadata_store, QuotaExceededError
+from app.utils.storage import get_storage
+from app.utils.integrity import UploadDigest, parse_expected_digests, digest_headers
+from app.utils.durability import publish_upload, get_group_committer
+from app.utils.quota import check_quota, get_remaining_quota, get_quota_bytes, get_quota_info
+from app.utils.retention import RetentionEngine, compute_expiry, get_ttl_expiry
+from app.utils.layout_migration import create_migrator
+from app.utils.content_sniff import SNIFF_BYTES, sniff_mime_type
+from app.utils.jobs import get_job_queue, create_worker_pool, enqueue_post_upload
+from app.utils.bulk_ops import BulkOperationRequest, create_bulk_operations
+from app.utils.events import get_broadcaster, get_events_config, notify_file_added, notify_files_removed, UploadProgress
+from app.utils.compression import CompressionMiddleware, create_compression_middleware_options
+from app.utils.static_assets import PrecompressedStaticFiles, build_static_assets, get_assets_version, static_url
+from app.utils.page_cache import FragmentCache, get_static_context, get_disk_info, compute_etag, etag_matches
+from app.utils.profiling import ProfilingMiddleware, TimedTemplates, phase, create_profiling_middleware_options, get_capture_store
+from app.utils import metrics
 
 # Initialize FastAPI
 app = FastAPI(title="Docker File Upload App")
@@ -41,6 +61,65 @@ rate_limiter = RateLimiter(
     window_minutes=config["rate_limit"]["window_minutes"]
 )
 
+# Initialize upload admission control
+concurrency_config = config["upload"].get("concurrency", {})
+upload_scheduler = UploadScheduler(
+    max_active=concurrency_config.get("max_active", 4),
+    max_per_user=concurrency_config.get("max_per_user", 2),
+    max_queue=concurrency_config.get("max_queue", 32),
+    queue_timeout_seconds=concurrency_config.get("queue_timeout_seconds", 30),
+    retry_after_seconds=concurrency_config.get("retry_after_seconds", 5)
+)
+
+# Initialize download bandwidth scheduling
+bandwidth_config = config["download"].get("bandwidth", {})
+download_scheduler = DownloadScheduler(
+    global_mb_per_second=bandwidth_config.get("global_mb_per_second", 0),
+    per_user_mb_per_second=bandwidth_config.get("per_user_mb_per_second", 0),
+    burst_seconds=bandwidth_config.get("burst_seconds", 0.5),
+    chunk_kb=bandwidth_config.get("chunk_kb", 256),
+    priority_max_kb=bandwidth_config.get("priority_max_kb", 1024),
+    preview_max_mb=bandwidth_config.get("preview_max_mb", 20)
+)
+
+# Initialize retention enforcement
+retention_config = config.get("retention", {})
+retention_engine = RetentionEngine(
+    get_metadata_store(),
+    config["upload"]["directory"],
+    interval_seconds=retention_config.get("interval_seconds", 300),
+    batch_size=retention_config.get("batch_size", 100),
+    batch_pause_seconds=retention_config.get("batch_pause_seconds", 1.0),
+    max_total_mb=retention_config.get("max_total_mb", 0),
+    dry_run=retention_config.get("dry_run", False)
+)
+retention_task = None
+
+# Local upload directory, plus the object store in object and tiered storage modes
+storage = get_storage()
+storage_task = None
+
+# Live updates for the dashboard and download page
+broadcaster = get_broadcaster()
+
+# Bulk deletes and moves (admin only)
+bulk_operations = create_bulk_operations(get_metadata_store(), storage)
+
+# Background migration from the flat layout to the configured sharded layout
+layout_migrator = create_migrator()
+migration_task = None
+migration_lock = None
+
+# Held by the worker process that reconciled the file index at startup
+reconcile_lock = None
+
+# Post-upload processing (checksums, content sniffing, previews)
+job_pool = create_worker_pool()
+job_task = None
+
+# Chunk size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 # Create required directories
 upload_dir = Path(config["upload"]["directory"])
 upload_dir.mkdir(exist_ok=True, parents=True)
@@ -49,62 +128,259 @@ logs_dir = Path("logs")
 logs_dir.mkdir(exist_ok=True, parents=True)
 
 # Set up templates
-templates = Jinja2Templates(directory="app/templates")
+templates = TimedTemplates(directory="app/templates")
+# The pagination controls use these builtins
+templates.env.globals.update(max=max, min=min)
+templates.env.globals["static_url"] = static_url
+
+# Rendered file tables for the download page, keyed by listing version
+file_table_cache = FragmentCache(max_entries=config.get("cache", {}).get("fragment_max_entries", 256))
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# Mount static files, served from fingerprinted and precompressed copies once built
+static_config = config.get("static", {})
+STATIC_SOURCE_DIR = "app/static"
+STATIC_BUILD_DIR = static_config.get("build_dir", "build/static")
+app.mount("/static", PrecompressedStaticFiles(STATIC_SOURCE_DIR, STATIC_BUILD_DIR), name="static")
 
 # Security setup
 security = HTTPBasic()
 
-# Middleware setup
-@app.middleware("http")
-async def check_ip_middleware(request: Request, call_next):
-    """Middleware to check IP address restrictions."""
-    client_ip = request.client.host
+@app.on_event("startup")
+async def build_static():
+    """Fingerprint and precompress the static assets."""
+    try:
+        build_static_assets(STATIC_SOURCE_DIR, STATIC_BUILD_DIR, precompress=static_config.get("precompress", True))
+    except OSError as e:
+        # Pages still work with the unversioned assets
+        logger.error(f"Error building static assets: {str(e)}")
+
+def apply_reloaded_config(settings):
+    """Carry settings that live in long-lived objects over to a reloaded configuration."""
+    set_log_level(settings.logging.level)
+    rate_limiter.max_uploads = settings.rate_limit.max_uploads
+    rate_limiter.window_seconds = settings.rate_limit.window_minutes * 60
+    bandwidth = settings.download.bandwidth
+    if (bandwidth.global_mb_per_second * 1024 * 1024, bandwidth.per_user_mb_per_second * 1024 * 1024) != (
+            download_scheduler.global_rate, download_scheduler.per_user_rate):
+        download_scheduler.set_limits(bandwidth.global_mb_per_second, bandwidth.per_user_mb_per_second)
+    retention_engine.apply_reloaded_config(settings)
+
+on_config_reload(apply_reloaded_config)
+
+@app.on_event("startup")
+async def start_config_reload():
+    """Reload the configuration on SIGHUP and when its files change."""
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(asyncio.to_thread(reload_config)))
+    except (ValueError, RuntimeError, NotImplementedError, AttributeError):
+        # Not running in the main thread, or no SIGHUP on this platform
+        pass
     
-    # Skip IP check for the error page
-    if request.url.path == "/error":
-        return await call_next(request)
+    interval = config["reload"]["watch_interval_seconds"]
+    if interval > 0:
+        asyncio.create_task(watch_config(interval))
+
+@app.on_event("startup")
+async def clean_incoming_uploads():
+    """Delete partial uploads left behind by a process that was killed mid-upload."""
+    clean_incoming_dir(get_drain_config().get("orphan_age_seconds", 3600))
+
+def reconcile_metadata_sync():
+    """Rebuild the file index and usage totals from the upload directory. Blocking."""
+    get_metadata_store().reconcile(upload_dir)
+    retention_engine.refresh_expiry()
+
+@app.on_event("startup")
+async def reconcile_metadata():
+    """Rebuild the file index and usage totals from the upload directory once at startup."""
+    global reconcile_lock
     
-    # Check if IP is allowed
-    if not is_ip_allowed(client_ip):
-        logger.warning(f"Access denied from IP: {client_ip}")
-        return RedirectResponse(
-            url="/error?message=Your%20IP%20address%20is%20not%20allowed%20to%20access%20this%20service.",
-            status_code=303
-        )
+    # Only one worker process walks the upload directory; the lock is held for the life
+    # of the process, so workers replacing others later don't walk it again
+    reconcile_lock = try_lock(f"{get_metadata_store().db_path}.reconcile.lock")
+    if reconcile_lock:
+        await asyncio.to_thread(reconcile_metadata_sync)
+
+@app.on_event("startup")
+async def start_metrics():
+    """Start the event loop lag monitor and, with several workers, metric snapshot publishing."""
+    asyncio.create_task(metrics.monitor_event_loop())
+    if metrics.registry.multiprocess_dir:
+        asyncio.create_task(metrics.flush_snapshots(config["metrics"].get("flush_interval_seconds", 5)))
+
+@app.on_event("startup")
+async def start_retention():
+    """Start enforcing retention policies in the background."""
+    global retention_task
+    
+    if retention_config.get("enabled", False):
+        retention_task = asyncio.create_task(retention_engine.run_forever())
+
+@app.on_event("shutdown")
+async def stop_retention():
+    """Stop the retention background task."""
+    if retention_task:
+        retention_task.cancel()
+
+@app.on_event("startup")
+async def start_storage_maintenance():
+    """Move files to the object store and evict local copies in the background."""
+    global storage_task
+    
+    if storage.remote is not None:
+        storage_task = asyncio.create_task(storage.run_forever())
+
+@app.on_event("shutdown")
+async def stop_storage_maintenance():
+    """Stop the storage maintenance task."""
+    if storage_task:
+        storage_task.cancel()
+
+@app.on_event("startup")
+async def start_live_events():
+    """Deliver live events on this worker's event loop."""
+    broadcaster.start()
+
+@app.on_event("shutdown")
+async def stop_live_events():
+    """End the live event streams of this worker."""
+    broadcaster.stop()
+
+@app.on_event("startup")
+async def recover_bulk_operations():
+    """Mark bulk operations left unfinished by a dead worker as interrupted."""
+    await asyncio.to_thread(bulk_operations.recover)
+
+@app.on_event("shutdown")
+async def stop_bulk_operations():
+    """Interrupt the bulk operations running in this worker."""
+    bulk_operations.stop()
+
+@app.on_event("startup")
+async def start_layout_migration():
+    """Move flat uploads into the sharded layout in the background, if enabled."""
+    global migration_task, migration_lock
+    
+    if layout_migrator.layout == "flat" or not config["upload"].get("layout_migration", {}).get("enabled", False):
+        return
+    
+    # Only one worker process migrates; the lock is held for the life of the process
+    migration_lock = try_lock(f"{get_metadata_store().db_path}.migration.lock")
+    if migration_lock:
+        migration_task = asyncio.create_task(layout_migrator.run())
+
+@app.on_event("shutdown")
+async def stop_layout_migration():
+    """Stop the layout migration; it resumes where it left off on the next start."""
+    if migration_task:
+        migration_task.cancel()
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Start processing queued post-upload jobs, including any left over from before a restart."""
+    global job_task
+    
+    if config.get("jobs", {}).get("enabled", True):
+        job_task = asyncio.create_task(job_pool.run())
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Stop the job workers; unfinished jobs run again after the next start."""
+    if job_task:
+        job_task.cancel()
+
+# Middleware setup. These are plain ASGI middleware, so response messages
+# (e.g. zero-copy file sends) pass through them untouched.
+class MetricsMiddleware:
+    """Middleware recording request latency per route, up to the response headers."""
+    
+    def __init__(self, app):
+        self.app = app
     
-    return await call_next(request)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start = time.perf_counter()
+        # Mounted apps rewrite the path in the scope while routing
+        path = scope["path"]
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Set by the router once it has matched the request
+                route = scope.get("route")
+                if route is not None:
+                    route_path = route.path
+                elif path.startswith("/static"):
+                    route_path = "/static"
+                else:
+                    route_path = "unmatched"
+                
+                metrics.HTTP_REQUEST_DURATION.observe(
+                    time.perf_counter() - start,
+                    (scope["method"], route_path, str(message["status"]))
+                )
+            await send(message)
+        
+        await self.app(scope, receive, send_wrapper)
+
+app.add_middleware(MetricsMiddleware)
+
+class IPCheckMiddleware:
+    """Middleware to check IP address restrictions."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        # Skip IP check for the error page
+        if scope["type"] != "http" or scope["path"] == "/error":
+            await self.app(scope, receive, send)
+            return
+        
+        # Check if IP is allowed
+        client_ip = Request(scope).client.host
+        with phase("ip_check"):
+            ip_allowed = is_ip_allowed(client_ip)
+        if not ip_allowed:
+            logger.warning(f"Access denied from IP: {client_ip}")
+            response = RedirectResponse(
+                url="/error?message=Your%20IP%20address%20is%20not%20allowed%20to%20access%20this%20service.",
+                status_code=303
+            )
+            await response(scope, receive, send)
+            return
+        
+        await self.app(scope, receive, send)
+
+app.add_middleware(IPCheckMiddleware)
 
 # Helper function for common template context
 def get_base_context(request: Request, user_data: Optional[Dict] = None):
-    """Get base context data for all templates."""
+    """
+    Get base context data for all templates.
+    Config-derived values are precomputed; disk usage and IP info are cached.
+    """
     client_ip = request.client.host
     
     # Get disk usage information
-    total, used, free = shutil.disk_usage(upload_dir)
-    disk_info = {
-        "total": f"{total // (2**30)} GB",
-        "used": f"{used // (2**30)} GB",
-        "free": f"{free // (2**30)} GB",
-        "percent_used": round((used / total) * 100, 2)
-    }
+    with phase("disk"):
+        disk_info = get_disk_info(upload_dir)
     
     # Get IP info
-    ip_info = get_ip_info(client_ip)
+    with phase("ip_info"):
+        ip_info = get_ip_info(client_ip)
     
-    context = {
+    context = dict(get_static_context())
+    context.update({
         "request": request,
         "user": user_data,
-        "max_size": config["upload"]["max_size"],
         "client_ip": client_ip,
         "ip_info": ip_info,
-        "disk_info": disk_info,
-        "blacklist": config["upload"]["blacklist_extensions"],
-        "whitelist": config["upload"]["whitelist_extensions"],
-        "app_version": "2.0.0"
-    }
+        "disk_info": disk_info
+    })
     
     return context
 
@@ -180,6 +456,8 @@ async def dashboard(request: Request, user_data: Dict = Depends(get_current_user
     """User dashboard page."""
     context = get_base_context(request, user_data)
     context["title"] = "Dashboard"
+    context["quota"] = get_quota_info(user_data.get("username", ""))
+    context["live_events"] = get_events_config().get("enabled", True)
 
     from datetime import datetime
     context["now"] = datetime.now()
@@ -197,19 +475,34 @@ async def get_upload_page(request: Request, user_data: Dict = Depends(writer_req
 @app.post("/upload")
 async def upload_file(
     request: Request,
-    file: UploadFile = File(...),
     user_data: Dict = Depends(writer_required)
 ):
     """Handle file uploads from the web interface."""
     client_ip = request.client.host
+    username = user_data.get("username", "unknown")
+    
+    # Uploads started now might not finish before the restart
+    drain_state = get_drain_state()
+    drain_state.check_accepting_uploads()
     
     # Check rate limit
     if config["rate_limit"]["enabled"] and not rate_limiter.is_allowed(client_ip):
         logger.warning(f"Rate limit exceeded for IP: {client_ip}")
         raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
     
-    # Process the file
-    result = await process_upload(file, client_ip, user_data.get("username", "unknown"))
+    # Check the storage quota before accepting the request body
+    check_quota(username, int(request.headers.get("content-length") or 0))
+    
+    # Wait for an upload slot before accepting the request body
+    async with upload_scheduler.slot(username):
+        drain_state.upload_started()
+        try:
+            with UploadProgress(request, username) as progress:
+                async with progress.request.form() as form:
+                    file = get_form_file(form)
+                    result = await process_upload(file, client_ip, username, ttl=form.get("ttl"))
+        finally:
+            drain_state.upload_finished()
     
     return result
 
@@ -221,41 +514,240 @@ async def download_page(
     per_page: Optional[int] = Query(None)
 ):
     """File download page with file listing."""
-    # Get file list
-    file_list = get_file_list(page, per_page)
-    
+    listing_version = get_metadata_store().get_listing_version()
+    # The page depends on the configuration too (page size, limits), so it is part of the keys
+    config_version = get_settings().fingerprint
     context = get_base_context(request, user_data)
+    
+    # Repeat visits to an unchanged page are answered with 304 Not Modified
+    etag = compute_etag(
+        listing_version, config_version, page, per_page, user_data.get("username"), user_data.get("role"),
+        context["client_ip"], context["ip_info"], context["disk_info"], context["app_version"], get_assets_version()
+    )
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    # The file table only changes with the listing and the configuration, so it is rendered once per version
+    fragment_key = (listing_version, config_version, page, per_page, user_data.get("role"))
+    file_table = file_table_cache.get(fragment_key)
+    if file_table is None:
+        with phase("file_list"):
+            file_list = get_file_list(page, per_page)
+        
+        with phase("template"):
+            file_table = templates.get_template("_file_table.html").render(
+                user=user_data,
+                files=file_list["files"],
+                pagination={
+                    "page": file_list["page"],
+                    "pages": file_list["pages"],
+                    "total": file_list["total"],
+                    "per_page": file_list["per_page"]
+                }
+            )
+        file_table_cache.set(fragment_key, file_table)
+    
     context["title"] = "Download Files"
-    context["files"] = file_list["files"]
-    context["pagination"] = {
-        "page": file_list["page"],
-        "pages": file_list["pages"],
-        "total": file_list["total"],
-        "per_page": file_list["per_page"]
-    }
+    context["page"] = page
+    context["per_page"] = per_page or config["download"].get("page_size", 20)
+    context["live_events"] = get_events_config().get("enabled", True)
+    context["file_table"] = Markup(file_table)
     
-    return templates.TemplateResponse("download.html", context)
+    return templates.TemplateResponse("download.html", context, headers=cache_headers)
 
 @app.get("/files/{filename}")
 async def download_file(
     filename: str,
     request: Request,
+    preview: bool = False,
     user_data: Dict = Depends(reader_required)
 ):
     """Download a specific file."""
-    file_path = Path(config["upload"]["directory"]) / filename
+    with phase("disk"):
+        record = get_metadata_store().get_file(filename)
+        file_path = resolve_file_path(filename, record)
     
-    # Check if file exists
-    if not file_path.exists() or not file_path.is_file():
+    # Check if file exists, locally or in the object store
+    if file_path is None and not storage.is_remote_only(record):
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Log the download
-    logger.info(f"File downloaded: {filename} by user '{user_data.get('username')}' from IP: {request.client.host}")
+    stat_result = await asyncio.to_thread(os.stat, file_path) if file_path is not None else None
+    total_size = stat_result.st_size if stat_result is not None else record["size"]
+    byte_range = parse_range_header(request.headers.get("range"), total_size)
+    
+    # Log the download (once, not for every range of a resumed one)
+    if byte_range is None or byte_range[0] == 0:
+        logger.info(f"File downloaded: {filename} by user '{user_data.get('username')}' from IP: {request.client.host}")
+        audit_event("download", user=user_data.get("username"), ip=request.client.host, file=filename)
+    
+    size = byte_range[1] - byte_range[0] + 1 if byte_range else total_size
+    stream = download_scheduler.create_stream(user_data.get("username"), filename, size, preview)
+    headers = {"X-Content-Type-Options": "nosniff", **digest_headers(record.get("sha256") if record else None)}
+    if file_path is None:
+        return remote_file_response(filename, record, byte_range, stream, headers)
+    
+    if storage.remote is not None:
+        await asyncio.to_thread(storage.touch, filename)
+    return RangeFileResponse(
+        file_path,
+        stat_result=stat_result,
+        byte_range=byte_range,
+        stream=stream,
+        filename=filename,
+        # Use the type detected at upload; otherwise let the server guess it from the name
+        media_type=record.get("content_type") if record else None,
+        headers=headers
+    )
+
+def remote_file_response(filename: str, record: Dict, byte_range, stream, headers: Dict) -> RemoteFileResponse:
+    """Stream a file that is only in the object store, and copy it back to local disk for the next reads."""
+    storage.schedule_fill(filename, record)
+    return RemoteFileResponse(
+        download_scheduler.throttle(storage.iter_remote(filename, byte_range, record["size"]), stream),
+        size=record["size"],
+        modified=record["uploaded_at"],
+        filename=filename,
+        byte_range=byte_range,
+        media_type=record.get("content_type"),
+        headers=headers
+    )
+
+@app.post("/api/files/{filename}/share")
+async def share_file(
+    filename: str,
+    request: Request,
+    expires_minutes: Optional[int] = Form(None),
+    ip: Optional[str] = Form(None),
+    max_downloads: Optional[int] = Form(None),
+    user_data: Dict = Depends(writer_required)
+):
+    """Create a signed, expiring download link for a file (writers may share their own files)."""
+    if not get_share_config().get("enabled", True):
+        raise HTTPException(status_code=404, detail="Share links are disabled")
+    
+    record = get_metadata_store().get_file(filename)
+    if resolve_file_path(filename, record) is None and not storage.is_remote_only(record):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    username = user_data.get("username")
+    if user_data.get("role") != "admin" and (record is None or record["owner"] != username):
+        raise HTTPException(status_code=403, detail="You can only share your own files")
+    
+    link = create_share_link(filename, expires_minutes, ip, max_downloads)
+    link["url"] = str(request.base_url).rstrip("/") + link["url"]
+    
+    logger.info(f"Share link created for {filename} by user '{username}', expires at {datetime.fromtimestamp(link['expires_at'])}")
+    audit_event("share", user=username, ip=request.client.host, file=filename,
+                expires_at=link["expires_at"], restricted_ip=link["ip"], max_downloads=link["max_downloads"])
+    
+    return link
+
+@app.get("/share/{filename}")
+async def download_shared_file(filename: str, request: Request):
+    """Download a file through a signed share link, without a session."""
+    if not get_share_config().get("enabled", True):
+        raise HTTPException(status_code=404, detail="Share links are disabled")
+    
+    client_ip = request.client.host
+    link = verify_share_link(filename, request.query_params, client_ip)
+    
+    record = get_metadata_store().get_file(filename)
+    file_path = resolve_file_path(filename, record)
+    if file_path is None and not storage.is_remote_only(record):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    stat_result = await asyncio.to_thread(os.stat, file_path) if file_path is not None else None
+    total_size = stat_result.st_size if stat_result is not None else record["size"]
+    if link["max_downloads"] or link["ip"]:
+        # Each download must reach the app to be checked, so shared caches may not keep it
+        cache_control = "private, no-store"
+    else:
+        cache_control = f"public, max-age={max(0, link['expires'] - int(time.time()))}"
+    
+    # Ranges of a limited link would each count as a download, so those links serve whole files
+    byte_range = None
+    if not link["max_downloads"]:
+        byte_range = parse_range_header(request.headers.get("range"), total_size)
+    if byte_range is None or byte_range[0] == 0:
+        count_share_download(link)
+        logger.info(f"File downloaded through share link: {filename} from IP: {client_ip}")
+        audit_event("download", user=None, ip=client_ip, file=filename, share_expires=link["expires"])
+    
+    size = byte_range[1] - byte_range[0] + 1 if byte_range else total_size
+    # Share link downloads are scheduled per client address
+    stream = download_scheduler.create_stream(f"share:{client_ip}", filename, size)
+    headers = {"X-Content-Type-Options": "nosniff", "Cache-Control": cache_control,
+               **digest_headers(record.get("sha256") if record else None)}
+    if file_path is None:
+        return remote_file_response(filename, record, byte_range, stream, headers)
     
-    return FileResponse(
-        path=file_path,
+    if storage.remote is not None:
+        await asyncio.to_thread(storage.touch, filename)
+    return RangeFileResponse(
+        file_path,
+        stat_result=stat_result,
+        byte_range=byte_range,
+        stream=stream,
         filename=filename,
-        media_type=None  # Let the server guess the content type
+        media_type=record.get("content_type") if record else None,
+        headers=headers
+    )
+
+@app.get("/files/{filename}/members/{member_name:path}")
+async def download_archive_member(
+    filename: str,
+    member_name: str,
+    request: Request,
+    user_data: Dict = Depends(reader_required)
+):
+    """Download a single member of a ZIP or tar archive without extracting the rest."""
+    with phase("disk"):
+        record = get_metadata_store().get_file(filename)
+        # Archives are read with random access, so they are copied out of the object store first
+        file_path = await asyncio.to_thread(storage.ensure_local, filename, record)
+    
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    archive_format = get_archive_format(filename, record.get("content_type") if record else None)
+    if not archive_format:
+        raise HTTPException(status_code=400, detail="This file is not a browsable archive")
+    
+    with phase("disk"):
+        member = await asyncio.to_thread(find_member, file_path, archive_format, member_name)
+    if member is None:
+        raise HTTPException(status_code=404, detail="Archive member not found")
+    if member["encrypted"]:
+        raise HTTPException(status_code=400, detail="Encrypted archive members cannot be extracted")
+    
+    headers = {
+        "Content-Disposition": content_disposition(os.path.basename(member_name)),
+        "X-Content-Type-Options": "nosniff",
+    }
+    status_code = 200
+    byte_range = None
+    if member["seekable"]:
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = parse_range_header(request.headers.get("range"), member["size"])
+    
+    if byte_range is not None:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{member['size']}"
+        headers["Content-Length"] = str(byte_range[1] - byte_range[0] + 1)
+    else:
+        headers["Content-Length"] = str(member["size"])
+    
+    logger.info(f"Archive member downloaded: {filename}:{member_name} by user '{user_data.get('username')}' from IP: {request.client.host}")
+    audit_event("download", user=user_data.get("username"), ip=request.client.host, file=filename, member=member_name)
+    
+    size = byte_range[1] - byte_range[0] + 1 if byte_range else member["size"]
+    stream = download_scheduler.create_stream(user_data.get("username"), f"{filename}:{member_name}", size)
+    return StreamingResponse(
+        download_scheduler.throttle(iter_member(file_path, archive_format, member_name, byte_range), stream),
+        status_code=status_code,
+        media_type=get_member_media_type(member_name),
+        headers=headers
     )
 
 @app.get("/preview/{filename}")
@@ -265,7 +757,8 @@ async def preview_file(
     user_data: Dict = Depends(reader_required)
 ):
     """Preview a file if it's previewable."""
-    file_info = get_file_info(filename)
+    with phase("disk"):
+        file_info = get_file_info(filename)
     
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
@@ -277,8 +770,27 @@ async def preview_file(
     context["title"] = f"Preview: {filename}"
     context["file"] = file_info
     
+    # Archives are previewed as a list of their members
+    archive_format = get_archive_format(filename, file_info["mime_type"])
+    if archive_format:
+        with phase("disk"):
+            file_path = await asyncio.to_thread(storage.ensure_local, filename)
+            if file_path is None:
+                raise HTTPException(status_code=404, detail="File not found")
+            context["archive"] = await asyncio.to_thread(list_archive, file_path, archive_format)
+        return templates.TemplateResponse("preview.html", context)
+    
     # Add text content for text files
+    preview = None
     if file_info["mime_type"] and file_info["mime_type"].startswith("text/"):
+        # Use the preview prepared after upload, if it is ready
+        preview = get_job_queue().get_result(filename, "preview")
+    if preview is not None:
+        context["text_content"] = preview["text"]
+        if preview["truncated"]:
+            context["truncated"] = True
+            context["text_content"] += f"\n\n[...File truncated, showing first {preview['max_lines']} lines...]"
+    elif file_info["mime_type"] and file_info["mime_type"].startswith("text/"):
         try:
             # Check file size before attempting to read
             max_size_kb = config["download"].get("text_preview_max_size_kb", 1024)
@@ -286,8 +798,9 @@ async def preview_file(
                 context["text_content"] = f"File too large to preview. Maximum size is {max_size_kb} KB."
                 context["truncated"] = True
             else:
-                file_path = Path(config["upload"]["directory"]) / filename
-                with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                with phase("disk"):
+                    file_path = file_info["path"] or await asyncio.to_thread(storage.ensure_local, filename)
+                with phase("disk"), open(file_path, "r", encoding="utf-8", errors="replace") as f:
                     max_lines = config["download"].get("text_preview_max_lines", 500)
                     lines = []
                     for i, line in enumerate(f):
@@ -307,26 +820,42 @@ async def preview_file(
 @app.post("/api/upload")
 async def api_upload_file(
     request: Request,
-    file: UploadFile = File(...),
     user_data: Dict = Depends(get_api_user)  # Use the API-specific auth function
 ):
     """API endpoint for programmatic uploads."""
     client_ip = request.client.host
+    username = user_data.get("username", "unknown")
+    
+    # Uploads started now might not finish before the restart
+    drain_state = get_drain_state()
+    drain_state.check_accepting_uploads()
     
     # Check rate limit
     if config["rate_limit"]["enabled"] and not rate_limiter.is_allowed(client_ip):
         logger.warning(f"API rate limit exceeded for IP: {client_ip}")
         raise HTTPException(status_code=429, detail="Rate limit exceeded. Please try again later.")
     
-    # Process the file
-    result = await process_upload(file, client_ip, user_data.get("username", "unknown"))
+    # Check the storage quota before accepting the request body
+    check_quota(username, int(request.headers.get("content-length") or 0))
+    
+    # Wait for an upload slot before accepting the request body
+    async with upload_scheduler.slot(username):
+        drain_state.upload_started()
+        try:
+            with UploadProgress(request, username) as progress:
+                async with progress.request.form() as form:
+                    file = get_form_file(form)
+                    result = await process_upload(file, client_ip, username, ttl=form.get("ttl"))
+        finally:
+            drain_state.upload_finished()
     
     # Return JSON response for API
     return {
         "success": True,
         "filename": result["filename"],
         "size": result["size"],
-        "path": result["path"]
+        "path": result["path"],
+        "sha256": result["sha256"]
     }
 
 @app.get("/error")
@@ -341,77 +870,423 @@ async def error_page(request: Request, message: str = "An error occurred"):
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
+    """Health check endpoint; answers 503 while the server drains for a restart."""
+    drain_state = get_drain_state()
+    if drain_state.draining:
+        return JSONResponse(status_code=503, content={
+            "status": "draining",
+            "version": "2.0.0",
+            **drain_state.status(),
+            "active_downloads": len(download_scheduler.streams),
+        })
     return {"status": "healthy", "version": "2.0.0"}
 
-async def process_upload(file: UploadFile, client_ip: str, username: str):
-    """Process and save an uploaded file."""
+@app.get("/metrics", dependencies=[Depends(metrics_access_required)])
+async def metrics_endpoint():
+    """Prometheus metrics for all worker processes (admins and configured scrapers only)."""
+    # Rendering reads the snapshots of every worker from disk
+    text = await asyncio.to_thread(metrics.registry.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/api/uploads/status")
+async def upload_status(user_data: Dict = Depends(admin_required)):
+    """Upload concurrency, queue and group commit statistics (admin only)."""
+    return {**upload_scheduler.stats(), "durability": get_group_committer().stats()}
+
+@app.get("/api/events")
+async def live_events(request: Request, user_data: Dict = Depends(get_current_user)):
+    """
+    Server-Sent Events stream of uploads, deletes and progress for the
+    dashboard and download page. Browsers reconnect on their own and send
+    Last-Event-ID, so events missed in between are delivered afterwards.
+    """
+    events_config = get_events_config()
+    if not events_config.get("enabled", True):
+        raise HTTPException(status_code=404, detail="Live events are disabled")
+    
+    return StreamingResponse(
+        broadcaster.stream(
+            user_data.get("username"), user_data.get("role"), request.headers.get("last-event-id"),
+            heartbeat_seconds=events_config.get("heartbeat_seconds", 15),
+            retry_ms=events_config.get("retry_ms", 3000)
+        ),
+        media_type="text/event-stream",
+        # Proxies must pass events on as they come instead of buffering them
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/events/status")
+async def live_events_status(user_data: Dict = Depends(admin_required)):
+    """Connected pages and event counters of this worker (admin only)."""
+    return broadcaster.stats()
+
+@app.get("/api/downloads/status")
+async def download_status(user_data: Dict = Depends(admin_required)):
+    """Active downloads with their rates, and bandwidth limits (admin only)."""
+    return download_scheduler.stats()
+
+@app.get("/api/layout/migration")
+async def layout_migration_status(user_data: Dict = Depends(admin_required)):
+    """Progress of the upload directory layout migration (admin only)."""
+    return layout_migrator.stats()
+
+@app.get("/api/storage/status")
+async def storage_status(user_data: Dict = Depends(admin_required)):
+    """Storage mode, local cache usage and object store transfers (admin only)."""
+    return await asyncio.to_thread(storage.stats)
+
+@app.post("/api/bulk")
+async def start_bulk_operation(body: BulkOperationRequest, user_data: Dict = Depends(admin_required)):
+    """
+    Delete or move many files selected by name, glob, age, uploader or size (admin only).
+    Runs in the background and answers 202 with the operation to poll; a dry run only counts.
+    """
+    result = await bulk_operations.start(body, user_data.get("username"))
+    if body.dry_run:
+        return result
+    return JSONResponse(status_code=202, content=result)
+
+@app.get("/api/bulk")
+async def list_bulk_operations(user_data: Dict = Depends(admin_required)):
+    """Recent bulk operations with their progress, newest first (admin only)."""
+    return {"operations": await asyncio.to_thread(get_metadata_store().list_operations)}
+
+@app.get("/api/bulk/{operation_id}")
+async def get_bulk_operation(operation_id: str, user_data: Dict = Depends(admin_required)):
+    """Progress of a bulk operation (admin only)."""
+    operation = await asyncio.to_thread(get_metadata_store().get_operation, operation_id)
+    if operation is None:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return operation
+
+@app.post("/api/bulk/{operation_id}/cancel")
+async def cancel_bulk_operation(operation_id: str, user_data: Dict = Depends(admin_required)):
+    """Stop a bulk operation after its current batch (admin only)."""
+    if not await bulk_operations.cancel(operation_id):
+        raise HTTPException(status_code=409, detail="Operation not found or already finished")
+    logger.info(f"Bulk operation {operation_id} cancelled by user '{user_data.get('username')}'")
+    return await asyncio.to_thread(get_metadata_store().get_operation, operation_id)
+
+@app.get("/api/retention/status")
+async def retention_status(user_data: Dict = Depends(admin_required)):
+    """Retention enforcement metrics (admin only)."""
+    return retention_engine.stats()
+
+@app.post("/api/retention/run")
+async def run_retention(
+    dry_run: bool = Query(True),
+    user_data: Dict = Depends(admin_required)
+):
+    """Run retention enforcement now (admin only). Defaults to a dry run."""
+    # Only the worker enforcing retention deletes, so two workers never work through the same files
+    if not dry_run and not retention_engine.is_leader():
+        raise HTTPException(status_code=409, detail="Retention is enforced by another worker process, try again")
+    logger.info(f"Retention run requested by user '{user_data.get('username')}' (dry run: {dry_run})")
+    return await retention_engine.run_once(dry_run=dry_run)
+
+@app.get("/api/profiles")
+async def list_profiles(user_data: Dict = Depends(admin_required)):
+    """Slow-request captures, newest first (admin only)."""
+    return await asyncio.to_thread(get_capture_store().list)
+
+@app.get("/api/profiles/{capture_id}")
+async def download_profile(capture_id: str, user_data: Dict = Depends(admin_required)):
+    """Download a slow-request capture (admin only)."""
+    capture_path = get_capture_store().get_path(capture_id)
+    if capture_path is None:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    
+    return FileResponse(capture_path, filename=f"profile-{capture_id}.json", media_type="application/json")
+
+@app.get("/api/files")
+async def list_files_api(
+    page: int = Query(1, ge=1),
+    per_page: int = Query(100, ge=1, le=1000),
+    user_data: Dict = Depends(reader_required)
+):
+    """List files with their size and checksum, newest first (for API clients)."""
+    store = get_metadata_store()
+    total = store.count_files()
+    files = [
+        {
+            "name": record["name"],
+            "size": record["size"],
+            "uploaded_at": record["uploaded_at"],
+            "sha256": record["sha256"],
+            "content_type": record["content_type"],
+        }
+        for record in store.list_files((page - 1) * per_page, per_page)
+    ]
+    return {"files": files, "total": total, "page": page, "pages": (total + per_page - 1) // per_page}
+
+@app.post("/api/files/lookup")
+async def lookup_files(request: Request, user_data: Dict = Depends(writer_required)):
+    """
+    Find files already on the server by content.
+    Takes {"files": [{"sha256": ..., "size": ...}, ...]} and returns the matches;
+    writers only see their own files. Files added outside the app get their checksum in the background.
+    """
+    try:
+        body = await request.json()
+        checksums = [(str(item["sha256"]).lower(), int(item["size"])) for item in body["files"]]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Expected {\"files\": [{\"sha256\": ..., \"size\": ...}]}")
+    if len(checksums) > 1000:
+        raise HTTPException(status_code=400, detail="At most 1000 files can be looked up at once")
+    
+    owner = None if user_data.get("role") == "admin" else user_data.get("username")
+    matches = await asyncio.to_thread(get_metadata_store().find_by_checksum, checksums, owner)
+    return {"files": [{"name": m["name"], "sha256": m["sha256"], "size": m["size"]} for m in matches]}
+
+@app.get("/api/files/{filename}/jobs")
+async def file_jobs(filename: str, user_data: Dict = Depends(reader_required)):
+    """Post-upload processing jobs of a file with their status and results."""
+    if get_metadata_store().get_file(filename) is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    return {"file": filename, "jobs": get_job_queue().get_jobs(filename)}
+
+@app.get("/api/jobs/status")
+async def jobs_status(user_data: Dict = Depends(admin_required)):
+    """Job worker pool and queue statistics (admin only)."""
+    return job_pool.stats()
+
+def get_form_file(form) -> UploadFile:
+    """Get the uploaded file from a parsed multipart form."""
+    file = form.get("file")
+    
+    if file is None or isinstance(file, str):
+        raise HTTPException(status_code=400, detail="No file was uploaded")
+    
+    return file
+
+def check_content_type(head: bytes, filename: str, client_ip: str, sniffing: Dict) -> Optional[str]:
+    """Detect a file's type from its first bytes, rejecting blocked content if configured."""
+    if not sniffing.get("enabled", True):
+        return None
+    
+    content_type = sniff_mime_type(head)
+    if sniffing.get("reject_blocked", True) and not is_content_allowed(content_type):
+        logger.warning(f"Rejected file with blocked content type {content_type}: {filename} from IP: {client_ip}")
+        raise HTTPException(status_code=400, detail="File type not allowed")
+    
+    return content_type
+
+async def commit_upload(incoming_path: Path, file_path: Path, original_filename: str, username: str, client_ip: str,
+                        size: int, ttl_expires_at: Optional[float], content_type: Optional[str], sha256: str):
+    """
+    Move a finished upload into place and record it: charge it to the
+    uploader's storage usage, schedule its expiry, show it on the open
+    pages and queue its previews.
+    """
+    try:
+        # Flushed to disk first, as upload.durability asks
+        await publish_upload(incoming_path, file_path)
+    except BaseException:
+        incoming_path.unlink(missing_ok=True)
+        raise
+    
+    # The quota is enforced here, in the same transaction as the charge: the
+    # checks before the upload can't see other uploads still in progress.
+    uploaded_at = time.time()
+    try:
+        await asyncio.to_thread(
+            get_metadata_store().add_file,
+            file_path.name, username, size,
+            uploaded_at=uploaded_at,
+            ttl_expires_at=ttl_expires_at,
+            expires_at=compute_expiry(file_path.name, username, uploaded_at, ttl_expires_at),
+            path=get_relative_path(file_path),
+            content_type=content_type,
+            remote=storage.writes_through,
+            sha256=sha256,
+            quota=get_quota_bytes(username)
+        )
+    except QuotaExceededError as e:
+        logger.warning(f"Rejected file exceeding the storage quota: {original_filename} by user '{username}' ({str(e)})")
+        await asyncio.to_thread(storage.delete, file_path.name, get_relative_path(file_path))
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+    
+    # Show the new file on the pages that are open
+    await asyncio.to_thread(notify_file_added, {
+        "name": file_path.name, "owner": username, "size": size,
+        "uploaded_at": uploaded_at, "content_type": content_type
+    })
+    
+    # Previews happen in the background; the checksum was computed on the way in
+    await asyncio.to_thread(
+        enqueue_post_upload, file_path.name,
+        previewable_text=(content_type or get_mime_type(file_path.name)).startswith("text/"), checksum=False
+    )
+
+def log_commit_failure(task: asyncio.Task):
+    """Log a failed upload commit, which nobody may be left waiting for if the request was cancelled."""
+    error = None if task.cancelled() else task.exception()
+    if error is not None and not isinstance(error, HTTPException):
+        logger.error(f"Error committing upload: {str(error)}")
+
+async def process_upload(file: UploadFile, client_ip: str, username: str, ttl: Optional[str] = None):
+    """
+    Process and save an uploaded file.
+    Digests sent as headers of the file part (Content-Digest, Repr-Digest,
+    Digest, Content-MD5) are checked against the file. The request's own
+    digest headers describe the whole multipart body, so they are ignored.
+    """
     # Check file extension
     if not is_file_allowed(file.filename):
         logger.warning(f"Rejected file with blocked extension: {file.filename} from IP: {client_ip}")
         raise HTTPException(status_code=400, detail="File type not allowed")
     
-    # Check file size
-    file_size_mb = 0
-    content = await file.read()
-    file_size_mb = len(content) / (1024 * 1024)
+    # Validate the requested time-to-live, if any
+    try:
+        ttl_expires_at = get_ttl_expiry(ttl)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid TTL: {str(e)}")
+    
+    # Check file size up front when the multipart parser already knows it
+    max_bytes = config["upload"]["max_size"] * 1024 * 1024
+    size_error = HTTPException(status_code=400, detail=f"File size exceeds the maximum allowed size of {config['upload']['max_size']}MB")
     
-    if file_size_mb > config["upload"]["max_size"]:
-        logger.warning(f"Rejected file exceeding size limit: {file.filename} ({file_size_mb}MB) from IP: {client_ip}")
-        raise HTTPException(status_code=400, detail=f"File size exceeds the maximum allowed size of {config['upload']['max_size']}MB")
+    # The storage quota may be tighter than the per-file limit
+    remaining_quota = get_remaining_quota(username)
+    if remaining_quota is not None and remaining_quota < max_bytes:
+        max_bytes = remaining_quota
+        size_error = HTTPException(status_code=413, detail="Storage quota exceeded")
+    
+    if file.size is not None and file.size > max_bytes:
+        logger.warning(f"Rejected file exceeding size limit: {file.filename} ({file.size / (1024 * 1024):.2f}MB) from IP: {client_ip}")
+        raise size_error
+    
+    expected_digests = parse_expected_digests(file.headers or {})
     
     # Create file path using the configured naming format
     file_path = get_file_path(file.filename, username)
     
-    # Write file
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Stream the file to disk in chunks instead of holding it in memory,
+    # detecting its type from the first bytes on the way. It is written to
+    # the incoming directory and only moved into place once complete.
+    # In object storage mode it is streamed to the object store as well.
+    incoming_path = get_incoming_path()
+    digest = UploadDigest(expected_digests)
+    remote_writer = storage.open_writer(file_path.name)
+    sniffing = config["upload"].get("content_sniffing", {})
+    write_started = time.perf_counter()
+    written = 0
+    head = b""
+    content_type = None
+    try:
+        with open(incoming_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    logger.warning(f"Rejected file exceeding size limit: {file.filename} from IP: {client_ip}")
+                    raise size_error
+                if head is not None:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if len(head) >= SNIFF_BYTES:
+                        content_type = check_content_type(head, file.filename, client_ip, sniffing)
+                        head = None
+                f.write(chunk)
+                digest.update(chunk)
+                if remote_writer is not None:
+                    await remote_writer.write(chunk)
+            if head:
+                # Files smaller than the sniffing window
+                content_type = check_content_type(head, file.filename, client_ip, sniffing)
+        try:
+            digest.verify()
+        except HTTPException:
+            logger.warning(f"Rejected file failing its digest check: {file.filename} from IP: {client_ip}")
+            raise
+        if remote_writer is not None:
+            await asyncio.to_thread(remote_writer.complete)
+            remote_writer = None
+    except BaseException:
+        # Never leave a partial file behind
+        incoming_path.unlink(missing_ok=True)
+        if remote_writer is not None:
+            await asyncio.to_thread(remote_writer.abort)
+        raise
+    
+    file_size_mb = written / (1024 * 1024)
+    
+    write_seconds = time.perf_counter() - write_started
+    metrics.UPLOADS.inc()
+    metrics.UPLOAD_BYTES.inc(written)
+    metrics.UPLOAD_SIZE.observe(written)
+    if write_seconds > 0:
+        metrics.UPLOAD_THROUGHPUT.observe(written / write_seconds)
+    
+    # Publishing and recording the file are one unit: once the file may be
+    # in place, a cancelled request (e.g. the client went away) must not
+    # leave it unindexed, so the commit runs on to the end regardless
+    commit = asyncio.ensure_future(commit_upload(
+        incoming_path, file_path, file.filename, username, client_ip,
+        written, ttl_expires_at, content_type, digest.sha256
+    ))
+    commit.add_done_callback(log_commit_failure)
+    await asyncio.shield(commit)
     
     # Log the upload
     logger.info(f"File uploaded successfully: {file_path} ({file_size_mb:.2f}MB) by user '{username}' from IP: {client_ip}")
+    audit_event("upload", user=username, ip=client_ip, file=file_path.name, original=file.filename, size=written)
     
     return {
         "filename": os.path.basename(file_path),
         "size": f"{file_size_mb:.2f}MB",
-        "path": str(file_path)
+        "path": str(file_path),
+        "sha256": digest.sha256
     }
 
 if __name__ == "__main__":
-    # Run the app
-    if config["server"]["ssl"]["enabled"]:
-        # Start with SSL
-        uvicorn.run(
-            "app.main:app",
-            host=config["server"]["host"],
-            port=config["server"]["ssl"]["port"],
-            ssl_keyfile=config["server"]["ssl"]["key_path"],
-            ssl_certfile=config["server"]["ssl"]["cert_path"]
-        )
-    else:
-        # Start without SSL
-        uvicorn.run(
-            "app.main:app",
-            host=config["server"]["host"],
-            port=config["server"]["port"]
-        )
+    # Run the app, draining in-flight transfers on SIGTERM
+    from app.server import main
+    main()
 
-@app.middleware("http")
-async def check_authentication_middleware(request: Request, call_next):
+class AuthenticationMiddleware:
     """Middleware to check if user is authenticated."""
+    
     # Skip authentication for login, error, static and health check pages
-    public_paths = ["/", "/login", "/error", "/static", "/health"]
-    if any(request.url.path.startswith(path) for path in public_paths):
-        return await call_next(request)
+    # (share links carry their own signature, and /metrics accepts scraper tokens)
+    public_paths = ("/", "/login", "/error", "/static", "/health", "/metrics", "/share")
     
-    # Check if user is authenticated
-    user_data = get_current_user_from_session(request)
-    if not user_data:
-        return RedirectResponse(
-            url=f"/?next={request.url.path}", 
-            status_code=303
-        )
+    def __init__(self, app):
+        self.app = app
     
-    return await call_next(request)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.public_paths):
+            await self.app(scope, receive, send)
+            return
+        
+        # Check if user is authenticated
+        user_data = get_current_user_from_session(Request(scope))
+        if not user_data:
+            response = RedirectResponse(
+                url=f"/?next={scope['path']}", 
+                status_code=303
+            )
+            await response(scope, receive, send)
+            return
+        
+        await self.app(scope, receive, send)
+
+app.add_middleware(AuthenticationMiddleware)
+
+def remove_file(filename: str, file_path: Optional[Path], record: Optional[Dict]):
+    """Delete a file from disk, the object store and the file index. Blocking."""
+    if file_path is not None:
+        os.remove(file_path)
+    storage.delete(filename, record.get("path") if record else None)
+    get_metadata_store().remove_file(filename)
+    get_job_queue().forget_file(filename)
+    notify_files_removed([{
+        "name": filename,
+        "owner": record.get("owner") if record else None,
+        "size": record.get("size", 0) if record else 0
+    }], "deleted")
 
 @app.delete("/files/{filename}")
 async def delete_file(
@@ -420,17 +1295,29 @@ async def delete_file(
     user_data: Dict = Depends(admin_required)
 ):
     """Delete a specific file (admin only)."""
-    file_path = Path(config["upload"]["directory"]) / filename
+    record = get_metadata_store().get_file(filename)
+    file_path = resolve_file_path(filename, record)
     
     # Check if file exists
-    if not file_path.exists() or not file_path.is_file():
+    if file_path is None and not storage.is_remote_only(record):
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Delete the file
+    # Delete the file, and its copy in the object store
     try:
-        os.remove(file_path)
+        await asyncio.to_thread(remove_file, filename, file_path, record)
         logger.info(f"File deleted: {filename} by user '{user_data.get('username')}' from IP: {request.client.host}")
+        audit_event("delete", user=user_data.get("username"), ip=request.client.host, file=filename)
         return {"success": True, "message": f"File {filename} deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting file {filename}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
+
+# Compress responses on their way out, after every other middleware has run
+compression_options = create_compression_middleware_options()
+if compression_options:
+    app.add_middleware(CompressionMiddleware, **compression_options)
+
+# Request profiling wraps every other middleware, so it is registered last
+profiling_options = create_profiling_middleware_options()
+if profiling_options:
+    app.add_middleware(ProfilingMiddleware, **profiling_options)
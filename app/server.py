@@ -0,0 +1,112 @@
+"""
+Server entry points with graceful draining.
+
+    python -m app.server                  # single uvicorn process
+    gunicorn app.main:app                 # workers from gunicorn.conf.py
+
+On SIGTERM the server reports "draining" from /health and turns new
+uploads away, keeps listening for server.drain.pre_stop_seconds so load
+balancers notice, then stops accepting connections and lets transfers in
+progress finish for up to server.drain.timeout_seconds. Ctrl+C (SIGINT)
+skips the wait.
+
+With gunicorn, `kill -HUP <master pid>` restarts the workers one
+generation at a time: new workers start with the reloaded configuration
+while the old ones drain.
+"""
+import asyncio
+import signal
+import sys
+
+import uvicorn
+
+from app.utils.config import get_config, reload_config
+from app.utils.draining import get_drain_config, get_drain_state
+from app.utils.logging_utils import get_logger
+
+try:
+    from gunicorn.arbiter import Arbiter
+    from uvicorn.workers import UvicornWorker
+except ImportError:
+    # gunicorn is not installed
+    UvicornWorker = None
+
+logger = get_logger(__name__)
+config = get_config()
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains before shutting down on the first SIGTERM."""
+
+    def handle_exit(self, sig, frame):
+        drain_state = get_drain_state()
+        if sig != signal.SIGTERM or self.should_exit:
+            super().handle_exit(sig, frame)
+            return
+        if drain_state.draining:
+            # gunicorn repeats SIGTERM to workers it is retiring
+            return
+
+        drain_state.begin()
+        pre_stop = get_drain_config().get("pre_stop_seconds", 0)
+        if pre_stop > 0:
+            logger.info(f"Draining: still accepting connections for {pre_stop}s")
+            asyncio.get_event_loop().call_later(pre_stop, super().handle_exit, sig, frame)
+        else:
+            super().handle_exit(sig, frame)
+
+
+def get_uvicorn_options():
+    """uvicorn settings from the configuration."""
+    options = {
+        "host": config["server"]["host"],
+        "port": config["server"]["port"],
+        # In-flight requests get this long to finish once the server stops accepting connections
+        "timeout_graceful_shutdown": get_drain_config().get("timeout_seconds", 60),
+    }
+    ssl_config = config["server"]["ssl"]
+    if ssl_config["enabled"]:
+        options.update(
+            port=ssl_config["port"],
+            ssl_keyfile=ssl_config["key_path"],
+            ssl_certfile=ssl_config["cert_path"],
+        )
+    return options
+
+
+if UvicornWorker is not None:
+    class DrainingUvicornWorker(UvicornWorker):
+        """gunicorn worker running a DrainingServer; gunicorn sends it SIGTERM when it retires the worker."""
+
+        server = None
+
+        def init_process(self):
+            # The master loaded the configuration before forking; a worker
+            # started by a HUP reload must read the file as it is now
+            reload_config()
+            self.config.timeout_graceful_shutdown = get_drain_config().get("timeout_seconds", 60)
+            super().init_process()
+
+        async def _serve(self):
+            self.config.app = self.wsgi
+            self.server = DrainingServer(config=self.config)
+            self._install_sigquit_handler()
+            await self.server.serve(sockets=self.sockets)
+            if not self.server.started:
+                sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+        def handle_exit(self, sig, frame):
+            # gunicorn's quick shutdown (SIGQUIT): stop at once, without draining
+            super().handle_exit(sig, frame)
+            if self.server is not None:
+                self.server.should_exit = True
+                self.server.force_exit = True
+
+
+def main():
+    server = DrainingServer(uvicorn.Config("app.main:app", **get_uvicorn_options()))
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+// Live updates pushed by the server as Server-Sent Events (/api/events).
+// Pages pass a handler per event type; the browser reconnects on its own
+// and the server then sends the events missed in between.
+function connectLiveEvents(handlers) {
+    if (!window.EventSource) {
+        return null;
+    }
+
+    const source = new EventSource('/api/events');
+
+    Object.keys(handlers).forEach(type => {
+        source.addEventListener(type, function(event) {
+            handlers[type](JSON.parse(event.data));
+        });
+    });
+
+    // The missed events are gone, so the page can't be patched up any more
+    if (!handlers.reset) {
+        source.addEventListener('reset', function() {
+            window.location.reload();
+        });
+    }
+
+    return source;
+}
+
+// Same format as the server's file sizes
+function formatBytes(bytes) {
+    if (bytes < 1024) {
+        return bytes + ' bytes';
+    }
+    const units = ['KB', 'MB', 'GB'];
+    let size = bytes / 1024;
+    let unit = 0;
+    while (size >= 1024 && unit < units.length - 1) {
+        size /= 1024;
+        unit++;
+    }
+    return size.toFixed(1) + ' ' + units[unit];
+}
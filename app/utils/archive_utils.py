@@ -0,0 +1,212 @@
+import mimetypes
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Chunk size used when streaming members out of an archive
+MEMBER_CHUNK_SIZE = 64 * 1024
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# Member listings by (path, mtime, size), so a changed file is listed again
+_listing_cache = OrderedDict()
+_listing_lock = threading.Lock()
+
+
+def get_archive_config() -> Dict:
+    return config.get("archives", {})
+
+
+def get_archive_format(filename: str, content_type: Optional[str] = None) -> Optional[str]:
+    """Get "zip" or "tar" for archives that can be browsed, None for anything else."""
+    if not get_archive_config().get("enabled", True):
+        return None
+
+    name = filename.lower()
+    if name.endswith(".zip") or content_type == "application/zip":
+        return "zip"
+    if name.endswith(TAR_SUFFIXES) or content_type == "application/x-tar":
+        return "tar"
+    return None
+
+
+def _zip_entry(info: zipfile.ZipInfo) -> Dict:
+    return {
+        "name": info.filename,
+        "size": info.file_size,
+        "compressed_size": info.compress_size,
+        "modified": datetime(*info.date_time).strftime("%Y-%m-%d %H:%M:%S"),
+        "seekable": info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1,
+        "encrypted": bool(info.flag_bits & 0x1),
+    }
+
+
+def _tar_entry(info: tarfile.TarInfo, seekable: bool) -> Dict:
+    return {
+        "name": info.name,
+        "size": info.size,
+        "compressed_size": None,
+        "modified": datetime.fromtimestamp(info.mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        "seekable": seekable,
+        "encrypted": False,
+    }
+
+
+def _list_zip(path: str, max_members: int) -> Dict:
+    # Only the central directory at the end of the file is read
+    with zipfile.ZipFile(path) as archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+    members = [_zip_entry(info) for info in infos[:max_members]]
+    return {"members": members, "total": len(infos), "truncated": len(infos) > max_members}
+
+
+def _is_uncompressed_tar(path: str) -> bool:
+    """Check for the ustar magic of an uncompressed tar file; members of those can be read at any offset."""
+    with open(path, "rb") as f:
+        return f.read(262)[257:262] == b"ustar"
+
+
+def _list_tar(path: str, max_members: int) -> Dict:
+    # Walks the member headers; data of uncompressed archives is skipped with seeks
+    members = []
+    total = 0
+    seekable = _is_uncompressed_tar(path)
+    with tarfile.open(path, "r:*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            total += 1
+            if len(members) < max_members:
+                members.append(_tar_entry(info, seekable))
+            # Keep memory bounded for archives with many members
+            archive.members = []
+    return {"members": members, "total": total, "truncated": total > max_members}
+
+
+def _find_zip_member(path: str, member_name: str) -> Optional[Dict]:
+    with zipfile.ZipFile(path) as archive:
+        try:
+            info = archive.getinfo(member_name)
+        except KeyError:
+            return None
+    return None if info.is_dir() else _zip_entry(info)
+
+
+def _find_tar_member(path: str, member_name: str) -> Optional[Dict]:
+    seekable = _is_uncompressed_tar(path)
+    with tarfile.open(path, "r:*") as archive:
+        for info in archive:
+            if info.name == member_name and info.isfile():
+                return _tar_entry(info, seekable)
+            archive.members = []
+    return None
+
+
+def list_archive(path: str, archive_format: str) -> Dict:
+    """
+    List the regular file members of an archive.
+    Listings are cached per file path, modification time and size.
+    Raises HTTPException(400) for damaged or unreadable archives.
+    """
+    stats = os.stat(path)
+    key = (path, stats.st_mtime_ns, stats.st_size)
+    with _listing_lock:
+        if key in _listing_cache:
+            _listing_cache.move_to_end(key)
+            return _listing_cache[key]
+
+    archive_config = get_archive_config()
+    max_members = archive_config.get("max_members", 10000)
+    try:
+        if archive_format == "zip":
+            listing = _list_zip(path, max_members)
+        else:
+            listing = _list_tar(path, max_members)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        logger.warning(f"Could not read archive {path}: {str(e)}")
+        raise HTTPException(status_code=400, detail="The archive could not be read")
+
+    listing["format"] = archive_format
+    with _listing_lock:
+        _listing_cache[key] = listing
+        while len(_listing_cache) > archive_config.get("listing_cache_entries", 128):
+            _listing_cache.popitem(last=False)
+
+    return listing
+
+
+def find_member(path: str, archive_format: str, member_name: str) -> Optional[Dict]:
+    """
+    Get a member's listing entry, or None if the archive has no such regular file.
+    Members past the archives.max_members shown in the listing are looked
+    up in the archive itself.
+    """
+    listing = list_archive(path, archive_format)
+    for member in listing["members"]:
+        if member["name"] == member_name:
+            return member
+    if not listing["truncated"]:
+        return None
+
+    try:
+        if archive_format == "zip":
+            return _find_zip_member(path, member_name)
+        return _find_tar_member(path, member_name)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        logger.warning(f"Could not read archive {path}: {str(e)}")
+        raise HTTPException(status_code=400, detail="The archive could not be read")
+
+
+def iter_member(path: str, archive_format: str, member_name: str,
+                byte_range: Optional[Tuple[int, int]] = None) -> Iterator[bytes]:
+    """
+    Stream one member out of an archive in fixed-size chunks.
+    byte_range (first, last) is only supported for seekable members
+    (stored ZIP entries and members of uncompressed tar files). Look the
+    member up with find_member() first: errors here surface mid-response.
+    """
+    if archive_format == "zip":
+        archive = zipfile.ZipFile(path)
+        member = archive.open(member_name)
+    else:
+        archive = tarfile.open(path, "r:*")
+        # Scan forward to the member, so compressed archives are only read once
+        member = None
+        for info in archive:
+            if info.name == member_name and info.isfile():
+                member = archive.extractfile(info)
+                break
+            archive.members = []
+        if member is None:
+            archive.close()
+            return
+
+    with archive, member:
+        remaining = None
+        if byte_range is not None:
+            member.seek(byte_range[0])
+            remaining = byte_range[1] - byte_range[0] + 1
+
+        while remaining is None or remaining > 0:
+            chunk = member.read(MEMBER_CHUNK_SIZE if remaining is None else min(MEMBER_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def get_member_media_type(member_name: str) -> str:
+    return mimetypes.guess_type(member_name)[0] or "application/octet-stream"
@@ -1,4 +1,6 @@
 import bcrypt
+import functools
+import hmac
 import yaml
 import uuid
 from datetime import datetime, timedelta
@@ -9,7 +11,10 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.security.utils import get_authorization_scheme_param
 
 from app.utils.config import get_config
+from app.utils.ip_utils import IPMatcher
 from app.utils.logging_utils import get_logger
+from app.utils.metrics import registry, BCRYPT_SECONDS
+from app.utils.profiling import timed_phase
 
 logger = get_logger(__name__)
 security = HTTPBasic()
@@ -22,6 +27,8 @@ ROLES = ["admin", "writer", "reader"]
 # In a production environment, consider using a database or Redis
 active_sessions = {}
 
+registry.gauge("active_sessions", "Sessions currently active", callback=lambda: len(active_sessions))
+
 def load_users():
     """Load user data from configuration file."""
     try:
@@ -42,6 +49,7 @@ def get_user_by_username(username: str):
     
     return None
 
+@timed_phase("auth")
 def authenticate_user(username: str, password: str):
     """Verify username and password against stored hashes."""
     user = get_user_by_username(username)
@@ -50,7 +58,10 @@ def authenticate_user(username: str, password: str):
         stored_hash = user["password_hash"]
         
         # Check password
-        if bcrypt.checkpw(password.encode(), stored_hash.encode()):
+        with BCRYPT_SECONDS.time():
+            password_ok = bcrypt.checkpw(password.encode(), stored_hash.encode())
+        
+        if password_ok:
             logger.info(f"Successful authentication for user: {username}")
             return user
     
@@ -104,6 +115,7 @@ def end_session(session_id: str) -> bool:
     
     return False
 
+@timed_phase("auth")
 def get_current_user_from_session(request: Request) -> Optional[Dict]:
     """Get the current user from the session cookie."""
     session_id = request.cookies.get("session_id")
@@ -115,11 +127,11 @@ def get_current_user_from_session(request: Request) -> Optional[Dict]:
     session_data = validate_session(session_id)
     
     if not session_data:
-        logger.debug(f"Invalid or expired session: {session_id}")
+        logger.debug("Invalid or expired session: %s", session_id)
         return None
     
     # Valid session found
-    logger.debug(f"Valid session found: {session_id} for user {session_data.get('username')}")
+    logger.debug("Valid session found: %s for user %s", session_id, session_data.get('username'))
     return session_data
 
 def get_current_user_basic_auth(credentials: HTTPBasicCredentials = Depends(security)) -> Dict:
@@ -188,6 +200,37 @@ def admin_required(user_data: Dict = Depends(get_current_user)):
         )
     return user_data
 
+@functools.lru_cache(maxsize=8)
+def _metrics_ip_matcher(allow_ips):
+    return IPMatcher(True, allow_ips)
+
+def metrics_access_required(request: Request):
+    """
+    Dependency for the metrics endpoint. Scrapers present metrics.token as a
+    bearer token or connect from an address in metrics.allow_ips; anyone
+    else needs an admin session.
+    """
+    metrics_config = config.get("metrics", {})
+    
+    token = metrics_config.get("token")
+    if token:
+        scheme, credentials = get_authorization_scheme_param(request.headers.get("Authorization"))
+        if scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode()):
+            return
+    
+    allow_ips = metrics_config.get("allow_ips")
+    if allow_ips and request.client and _metrics_ip_matcher(tuple(allow_ips)).matches(request.client.host):
+        return
+    
+    user_data = get_current_user_from_session(request)
+    if not user_data:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"} if token else None
+        )
+    admin_required(user_data)
+
 def writer_required(user_data: Dict = Depends(get_current_user)):
     """Dependency to require admin or writer role."""
     if not check_role_permission(["admin", "writer"], user_data):
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Literal, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from app.utils.config import get_config
+from app.utils.events import get_broadcaster, notify_files_removed
+from app.utils.file_utils import resolve_file_path
+from app.utils.jobs import get_job_queue
+from app.utils.logging_utils import get_logger, audit_event
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Criteria that select files; at least one is required so nothing is deleted by accident
+SELECTORS = ("names", "pattern", "owner", "older_than_days", "newer_than_days", "min_size", "max_size")
+
+# Files listed in a dry run's response
+DRY_RUN_SAMPLE = 20
+
+
+class BulkOperationRequest(BaseModel):
+    """Body of POST /api/bulk. Every given criterion must match."""
+    action: Literal["delete", "move"]
+    # Explicit file names
+    names: Optional[List[str]] = None
+    # Glob on the file name, e.g. "2024*_*.log" (case-sensitive)
+    pattern: Optional[str] = None
+    # Uploader
+    owner: Optional[str] = None
+    # Age, from the upload time
+    older_than_days: Optional[float] = Field(None, ge=0)
+    newer_than_days: Optional[float] = Field(None, ge=0)
+    # Size in bytes
+    min_size: Optional[int] = Field(None, ge=0)
+    max_size: Optional[int] = Field(None, ge=0)
+    # For "move": directory under bulk.move_directory the files go to
+    destination: Optional[str] = None
+    # Only count what would be affected
+    dry_run: bool = False
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BulkOperations:
+    """
+    Bulk deletes and moves for admins.
+    An operation selects files from the file index (names, glob, age,
+    uploader, size), then works through them in name order in batches on
+    a worker thread, with a pause between batches to limit disk I/O. The
+    index and usage totals are updated once per batch. Operations and
+    their progress are stored in the file index database, so any worker
+    process can report on or cancel them; each runs in the worker that
+    received it, one at a time.
+    """
+
+    def __init__(self, store, storage, batch_size=500, batch_pause_seconds=0.1,
+                 move_directory=".quarantine", max_names=100000):
+        self.store = store
+        self.storage = storage
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause_seconds
+        self.move_directory = Path(move_directory)
+        self.max_names = max_names
+
+        self._lock = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def lock(self):
+        # Created lazily so the manager can be built before the event loop starts
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _criteria(self, request: BulkOperationRequest) -> Dict:
+        """Validate a request and turn it into index criteria, with ages fixed to timestamps now."""
+        if not any(getattr(request, field) is not None for field in SELECTORS):
+            raise HTTPException(status_code=400, detail=f"At least one of {', '.join(SELECTORS)} is required")
+        if request.names is not None and len(request.names) > self.max_names:
+            raise HTTPException(status_code=400, detail=f"At most {self.max_names} names per request")
+
+        criteria = {
+            "names": request.names,
+            "pattern": request.pattern,
+            "owner": request.owner,
+            "uploaded_before": time.time() - request.older_than_days * 86400 if request.older_than_days is not None else None,
+            "uploaded_after": time.time() - request.newer_than_days * 86400 if request.newer_than_days is not None else None,
+            "min_size": request.min_size,
+            "max_size": request.max_size,
+        }
+
+        if request.action == "move":
+            destination = Path(request.destination or "")
+            if not request.destination or destination.is_absolute() or ".." in destination.parts:
+                raise HTTPException(status_code=400, detail="Moves need a relative destination directory")
+            criteria["destination"] = str(destination)
+
+        return {key: value for key, value in criteria.items() if value is not None}
+
+    async def start(self, request: BulkOperationRequest, username: str) -> Dict:
+        """Count the files a request selects; unless it is a dry run, start the operation in the background."""
+        criteria = self._criteria(request)
+        counts = await asyncio.to_thread(self.store.count_matching, criteria)
+
+        if request.dry_run:
+            sample = await asyncio.to_thread(self.store.find_matching, criteria, None, DRY_RUN_SAMPLE)
+            return {
+                "dry_run": True,
+                "action": request.action,
+                "files": counts["files"],
+                "bytes": counts["bytes"],
+                "sample": [row["name"] for row in sample],
+            }
+
+        operation = await asyncio.to_thread(
+            self.store.create_operation, uuid.uuid4().hex, request.action, criteria, username,
+            counts["files"], counts["bytes"], os.getpid()
+        )
+        logger.info(
+            f"Bulk {request.action} {operation['id']} of {counts['files']} file(s) "
+            f"({counts['bytes']} bytes) started by user '{username}'"
+        )
+        audit_event(f"bulk_{request.action}", user=username, operation=operation["id"],
+                    files=counts["files"], size=counts["bytes"])
+
+        task = asyncio.create_task(self._run(operation))
+        self._tasks[operation["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(operation["id"], None))
+        return operation
+
+    async def cancel(self, operation_id: str) -> bool:
+        """Stop an operation after its current batch (from any worker process)."""
+        return await asyncio.to_thread(self.store.cancel_operation, operation_id)
+
+    def recover(self):
+        """Mark operations whose worker process died as interrupted. Run at startup."""
+        for operation in self.store.get_unfinished_operations():
+            if not _pid_alive(operation["pid"]):
+                self.store.update_operation(operation["id"], status="interrupted", finished_at=time.time())
+                logger.warning(f"Bulk {operation['action']} {operation['id']} was interrupted by a restart")
+
+    def stop(self):
+        """Interrupt the operations of this worker, e.g. at shutdown."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    async def _run(self, operation: Dict):
+        operation_id = operation["id"]
+        status, error = "done", None
+        async with self.lock:
+            current = await asyncio.to_thread(self.store.get_operation, operation_id)
+            if current["cancel_requested"]:
+                await asyncio.to_thread(self.store.update_operation, operation_id,
+                                        status="cancelled", finished_at=time.time())
+                return
+
+            await asyncio.to_thread(self.store.update_operation, operation_id,
+                                    status="running", started_at=time.time())
+            await self._publish_progress(operation_id)
+            after = None
+            try:
+                while True:
+                    rows = await asyncio.to_thread(self.store.find_matching, operation["criteria"], after, self.batch_size)
+                    if not rows:
+                        break
+                    after = rows[-1]["name"]
+
+                    files, size, errors = await asyncio.to_thread(self._apply_batch, operation, rows)
+                    if await asyncio.to_thread(self.store.add_operation_progress, operation_id, files, size, errors):
+                        status = "cancelled"
+                        break
+                    await self._publish_progress(operation_id)
+
+                    if self.batch_pause:
+                        await asyncio.sleep(self.batch_pause)
+            except asyncio.CancelledError:
+                status = "interrupted"
+                raise
+            except Exception as e:
+                status, error = "failed", str(e)
+                logger.error(f"Bulk {operation['action']} {operation_id} failed: {error}")
+            finally:
+                # Recorded even when this task is being cancelled
+                await asyncio.shield(asyncio.to_thread(
+                    self.store.update_operation, operation_id, status=status, error=error, finished_at=time.time()
+                ))
+
+        await self._publish_progress(operation_id)
+        logger.info(f"Bulk {operation['action']} {operation_id} {status}")
+
+    async def _publish_progress(self, operation_id: str):
+        """Show an operation's progress on the admins' live pages."""
+        operation = await asyncio.to_thread(self.store.get_operation, operation_id)
+        get_broadcaster().publish("bulk_progress", operation, roles=("admin",))
+
+    def _apply_batch(self, operation: Dict, rows: List[Dict]) -> Tuple[int, int, int]:
+        """Delete or move one batch of files, then update the index. Runs on a worker thread."""
+        done = []
+        errors = 0
+        for row in rows:
+            try:
+                if operation["action"] == "delete":
+                    self._delete(row)
+                else:
+                    self._move(row, self.move_directory / operation["criteria"]["destination"])
+            except OSError as e:
+                errors += 1
+                logger.error(f"Bulk {operation['action']} {operation['id']} failed for {row['name']}: {str(e)}")
+                continue
+            done.append(row)
+
+        if done:
+            names = [row["name"] for row in done]
+            self.store.remove_files(names)
+            get_job_queue().forget_files(names)
+            for row in done:
+                audit_event(operation["action"], user=operation["created_by"], file=row["name"],
+                            size=row["size"], operation=operation["id"])
+            notify_files_removed(done, "moved" if operation["action"] == "move" else "deleted")
+
+        return len(done), sum(row["size"] for row in done), errors
+
+    def _delete(self, row: Dict):
+        path = resolve_file_path(row["name"], row)
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        # Also removes the copy in the object store, if any
+        self.storage.delete(row["name"], row["path"])
+
+    def _move(self, row: Dict, directory: Path):
+        source = self.storage.ensure_local(row["name"], row)
+        if source is None:
+            raise FileNotFoundError(f"{row['name']} is missing")
+
+        destination = directory / row["name"]
+        if destination.exists():
+            raise FileExistsError(f"{destination} already exists")
+        directory.mkdir(exist_ok=True, parents=True)
+        shutil.move(source, destination)
+        self.storage.delete(row["name"], row["path"])
+
+
+def create_bulk_operations(store, storage) -> BulkOperations:
+    """Create the bulk operations manager from the configuration."""
+    bulk_config = config.get("bulk", {})
+    # Relative to the upload directory: on the same volume, so moves are renames
+    # and moved files persist, and a dot-directory, so the file index skips it
+    move_directory = Path(bulk_config.get("move_directory", ".quarantine"))
+    if not move_directory.is_absolute():
+        move_directory = Path(config["upload"]["directory"]) / move_directory
+    return BulkOperations(
+        store,
+        storage,
+        batch_size=bulk_config.get("batch_size", 500),
+        batch_pause_seconds=bulk_config.get("batch_pause_seconds", 0.1),
+        move_directory=move_directory,
+        max_names=bulk_config.get("max_names", 100000),
+    )
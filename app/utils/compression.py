@@ -0,0 +1,227 @@
+import os
+import zlib
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.utils.config import get_config
+from app.utils.download_utils import get_file_type, get_mime_type
+from app.utils.logging_utils import get_logger
+from app.utils.static_assets import parse_accept_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = get_logger(__name__)
+config = get_config()
+
+# File types that are already compressed; compressing them again only costs CPU
+PRECOMPRESSED_FILE_TYPES = {"archive", "image", "audio", "video"}
+
+DEFAULT_MIME_TYPES = [
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+]
+
+
+class _GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        # Flush each chunk so a streamed response reaches the client as it is produced
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses on the fly.
+    Only responses of an allowed MIME type, at least minimum_size bytes and
+    at most maximum_size bytes (when given) are compressed, with zstd or brotli when the client accepts them and
+    the package is installed, gzip otherwise. Responses that are already
+    encoded, partial, or files of an already-compressed type (archives,
+    images, audio, video) are passed through untouched. Levels default
+    to fast settings: the goal is lower latency, not the best ratio.
+    """
+
+    def __init__(self, app, minimum_size=1024, mime_types: Optional[List[str]] = None,
+                 gzip_level=4, brotli_quality=4, zstd_level=3, maximum_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.maximum_size = maximum_size
+        self.mime_types = tuple(mime_types if mime_types is not None else DEFAULT_MIME_TYPES)
+        self.encoders = {"gzip": lambda: _GzipEncoder(gzip_level)}
+        if brotli is not None:
+            self.encoders["br"] = lambda: _BrotliEncoder(brotli_quality)
+        if zstandard is not None:
+            self.encoders["zstd"] = lambda: _ZstdEncoder(zstd_level)
+
+        logger.info(f"Response compression enabled ({', '.join(sorted(self.encoders))}), minimum size {minimum_size} bytes")
+
+    def choose_encoding(self, scope) -> Optional[str]:
+        request_headers = Headers(scope=scope)
+        if scope["method"] == "HEAD" or "range" in request_headers:
+            return None
+
+        # Files that are compressed already, judged by the requested name
+        if get_file_type(os.path.basename(scope["path"])) in PRECOMPRESSED_FILE_TYPES \
+                and not scope["path"].lower().endswith(".svg"):
+            return None
+
+        accepted = parse_accept_encoding(request_headers.get("accept-encoding", ""))
+        for encoding in ("zstd", "br", "gzip"):
+            if encoding in accepted and encoding in self.encoders:
+                return encoding
+        return None
+
+    def is_compressible(self, message: Dict) -> bool:
+        if message["status"] < 200 or message["status"] in (204, 206, 304):
+            return False
+
+        headers = Headers(raw=message["headers"])
+        if "content-encoding" in headers or "content-range" in headers:
+            return False
+
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if not content_type.startswith(self.mime_types):
+            return False
+
+        content_length = headers.get("content-length")
+        if content_length is not None:
+            if int(content_length) < self.minimum_size:
+                return False
+            # Compressing large downloads would hold the event loop for the whole transfer
+            if self.maximum_size is not None and int(content_length) > self.maximum_size:
+                return False
+
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.choose_encoding(scope)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Compressed bodies have to pass through here, so the app may not use zero-copy
+        # sends for files that will be compressed; everything else keeps them
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions and \
+                get_mime_type(os.path.basename(scope["path"])).startswith(self.mime_types):
+            scope = dict(scope, extensions={k: v for k, v in extensions.items() if k != "http.response.zerocopysend"})
+
+        start_message = None
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough
+
+            if message["type"] == "http.response.start":
+                if self.is_compressible(message):
+                    # Wait for the first body chunk to decide on small streamed responses
+                    start_message = message
+                else:
+                    passthrough = True
+                    await send(message)
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                if not passthrough and encoder is None and start_message is not None:
+                    # A zero-copy body can't be compressed here, so it is sent as it is
+                    passthrough = True
+                    await send(start_message)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if encoder is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                encoder = self.encoders[encoding]()
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["content-length"]
+                # Byte ranges would refer to the compressed stream, which isn't served
+                if "accept-ranges" in headers:
+                    del headers["accept-ranges"]
+                # The representation changed, so a strong validator no longer applies
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                # and digests of the uncompressed file don't describe it any more
+                for name in ("repr-digest", "digest"):
+                    if name in headers:
+                        del headers[name]
+                await send(start_message)
+
+            data = encoder.compress(body) if body else b""
+            if not more_body:
+                data += encoder.finish()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def create_compression_middleware_options() -> Optional[Dict]:
+    """Options for CompressionMiddleware from the configuration, or None when compression is disabled."""
+    compression_config = config.get("compression", {})
+    if not compression_config.get("enabled", True):
+        return None
+
+    max_size_mb = compression_config.get("max_size_mb", 64)
+    return {
+        "minimum_size": compression_config.get("minimum_size", 1024),
+        "mime_types": compression_config.get("mime_types", DEFAULT_MIME_TYPES),
+        "gzip_level": compression_config.get("gzip_level", 4),
+        "brotli_quality": compression_config.get("brotli_quality", 4),
+        "zstd_level": compression_config.get("zstd_level", 3),
+        "maximum_size": int(max_size_mb * 1024 * 1024) if max_size_mb else None,
+    }
@@ -1,77 +1,592 @@
+import asyncio
+import hashlib
 import os
-import yaml
+import string
+import threading
+from collections.abc import Mapping
 from pathlib import Path
+from typing import Callable, List, Literal, Optional, Tuple
+
+import yaml
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator, model_validator
+
+# libyaml's loader when PyYAML was built with it
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Variables available in upload.naming_format
+NAMING_FORMAT_FIELDS = ("original", "basename", "extension", "timestamp", "uuid", "user")
+
+
+class ConfigError(Exception):
+    """The configuration file can't be read or has invalid values."""
+
+
+class _Section(BaseModel):
+    """
+    A validated, read-only configuration section.
+    Also reads like the dicts the configuration used to be, so
+    config["upload"]["max_size"] and .get("key", default) keep working.
+    Keys the models don't know about are kept as they are.
+    """
+    model_config = ConfigDict(frozen=True, extra="allow", defer_build=True)
+
+    def _has(self, key) -> bool:
+        return key in self.model_fields or key in (self.__pydantic_extra__ or {})
+
+    def __getitem__(self, key):
+        if not self._has(key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key) -> bool:
+        return self._has(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if self._has(key) else default
+
+
+class SSLSettings(_Section):
+    enabled: bool = False
+    port: int = 8443
+    cert_path: str = "config/ssl/cert.pem"
+    key_path: str = "config/ssl/key.pem"
+
+
+class DrainSettings(_Section):
+    pre_stop_seconds: float = Field(0, ge=0)
+    timeout_seconds: float = Field(60, ge=0)
+    retry_after_seconds: int = Field(5, ge=0)
+    orphan_age_seconds: float = Field(3600, ge=0)
+
+
+class ServerSettings(_Section):
+    host: str = "0.0.0.0"
+    port: int = 8000
+    ssl: SSLSettings = Field(default_factory=SSLSettings)
+    drain: DrainSettings = Field(default_factory=DrainSettings)
+
+
+class ContentSniffingSettings(_Section):
+    enabled: bool = True
+    reject_blocked: bool = True
+
+
+class LayoutMigrationSettings(_Section):
+    enabled: bool = False
+    files_per_second: float = Field(50, gt=0)
+    batch_size: int = Field(100, gt=0)
+
+
+class ConcurrencySettings(_Section):
+    max_active: int = Field(4, gt=0)
+    max_per_user: int = Field(2, gt=0)
+    max_queue: int = Field(32, ge=0)
+    queue_timeout_seconds: float = Field(30, ge=0)
+    retry_after_seconds: int = Field(5, ge=0)
+
+
+class DurabilitySettings(_Section):
+    mode: Literal["none", "file", "group"] = "none"
+    group_max_files: int = Field(64, gt=0)
+
+
+def _normalize_extensions(extensions) -> Tuple[str, ...]:
+    # ".EXE", "exe" and ".exe" all mean the same extension
+    return tuple(
+        ext if ext.startswith(".") else f".{ext}"
+        for ext in (str(ext).strip().lower() for ext in extensions or ())
+        if ext
+    )
+
+
+class UploadSettings(_Section):
+    max_size: float = Field(100, gt=0)
+    directory: str = "uploads"
+    whitelist_extensions: Tuple[str, ...] = ()
+    blacklist_extensions: Tuple[str, ...] = (".exe", ".bat", ".sh", ".php")
+    content_sniffing: ContentSniffingSettings = Field(default_factory=ContentSniffingSettings)
+    naming_format: str = "{timestamp}_{original}"
+    layout: Literal["flat", "hashed", "date"] = "flat"
+    layout_migration: LayoutMigrationSettings = Field(default_factory=LayoutMigrationSettings)
+    metadata_db: Optional[str] = None
+    concurrency: ConcurrencySettings = Field(default_factory=ConcurrencySettings)
+    durability: DurabilitySettings = Field(default_factory=DurabilitySettings)
+
+    # Built once per loaded configuration for the upload path
+    _allowed: frozenset = PrivateAttr(frozenset())
+    _blocked: frozenset = PrivateAttr(frozenset())
+
+    _check_extensions = field_validator("whitelist_extensions", "blacklist_extensions", mode="before")(
+        _normalize_extensions
+    )
+
+    @field_validator("naming_format")
+    @classmethod
+    def _check_naming_format(cls, value):
+        try:
+            fields = {field for _, field, _, _ in string.Formatter().parse(value) if field is not None}
+        except ValueError as e:
+            raise ValueError(f"invalid naming format: {e}")
+        unknown = fields - set(NAMING_FORMAT_FIELDS)
+        if unknown:
+            raise ValueError(
+                f"unknown naming format variable(s) {sorted(unknown)}, use {list(NAMING_FORMAT_FIELDS)}"
+            )
+        return value
+
+    def model_post_init(self, context):
+        self._allowed = frozenset(self.whitelist_extensions)
+        self._blocked = frozenset(self.blacklist_extensions)
+
+    @property
+    def allowed_extensions(self) -> frozenset:
+        """Whitelisted extensions; empty when every extension that isn't blocked is allowed."""
+        return self._allowed
+
+    @property
+    def blocked_extensions(self) -> frozenset:
+        return self._blocked
+
+    def format_filename(self, variables) -> str:
+        """Apply the naming format; its variables were checked when the configuration was loaded."""
+        return self.naming_format.format_map(variables)
+
+
+class BandwidthSettings(_Section):
+    global_mb_per_second: float = Field(0, ge=0)
+    per_user_mb_per_second: float = Field(0, ge=0)
+    burst_seconds: float = Field(0.5, ge=0)
+    chunk_kb: int = Field(256, gt=0)
+    priority_max_kb: int = Field(1024, ge=0)
+    preview_max_mb: float = Field(20, ge=0)
+
+
+class DownloadSettings(_Section):
+    enabled: bool = True
+    page_size: int = Field(20, gt=0)
+    enable_previews: bool = True
+    text_preview_max_lines: int = Field(500, gt=0)
+    text_preview_max_size_kb: int = Field(1024, gt=0)
+    bandwidth: BandwidthSettings = Field(default_factory=BandwidthSettings)
+
+
+class ShareLinkSettings(_Section):
+    enabled: bool = True
+    secret_key: str = ""
+    default_expire_minutes: int = Field(1440, gt=0)
+    max_expire_minutes: int = Field(10080, gt=0)
+
+
+class ArchiveSettings(_Section):
+    enabled: bool = True
+    max_members: int = Field(10000, gt=0)
+    listing_cache_entries: int = Field(128, ge=0)
+
+
+class LoggingSettings(_Section):
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
+    file: str = "logs/server.log"
+    format: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    json_lines: bool = Field(True, alias="json")
+    rotation: bool = False
+    max_size_mb: float = Field(10, gt=0)
+    backup_count: int = Field(5, ge=0)
+    queue_size: int = Field(10000, gt=0)
+    high_water_percent: float = Field(80, gt=0, le=100)
+    sample_rate: float = Field(0.1, ge=0, le=1)
+    audit_file: str = "logs/audit.log"
+
+    @field_validator("level", mode="before")
+    @classmethod
+    def _upper_level(cls, value):
+        return str(value).upper()
+
+    def __getitem__(self, key):
+        # "json" would shadow BaseModel.json(), so the field has another name
+        return super().__getitem__("json_lines" if key == "json" else key)
+
+    def get(self, key, default=None):
+        return super().get("json_lines" if key == "json" else key, default)
+
+
+class CookieSettings(_Section):
+    secure: bool = False
+    httponly: bool = True
+    samesite: Literal["lax", "strict", "none"] = "lax"
+
+
+class SecuritySettings(_Section):
+    secret_key: str = "insecure_default_key"
+    session_expire_minutes: int = Field(60, gt=0)
+    users_file: str = "config/users.yml"
+    ip_whitelist_file: str = "config/ip_whitelist.yml"
+    enable_csrf: bool = True
+    cookies: CookieSettings = Field(default_factory=CookieSettings)
+
+    # Storage quotas from the users file, read once per loaded configuration
+    _role_quotas: dict = PrivateAttr(default_factory=dict)
+    _user_quotas: dict = PrivateAttr(default_factory=dict)
+
+    @property
+    def role_quotas(self) -> dict:
+        """Role -> quota in MB (role_quotas in the users file)."""
+        return self._role_quotas
+
+    @property
+    def user_quotas(self) -> dict:
+        """Username -> (role, quota_mb or None) for the users in the users file."""
+        return self._user_quotas
+
+    def load_quotas(self):
+        """Read the quotas from the users file; a missing file means no quotas."""
+        try:
+            with open(self.users_file, "r") as f:
+                data = yaml.load(f, Loader=_YamlLoader) or {}
+        except FileNotFoundError:
+            return
+        except yaml.YAMLError as e:
+            raise ConfigError(f"{self.users_file} is not valid YAML: {e}")
+
+        role_quotas = data.get("role_quotas") or {}
+        user_quotas = {}
+        for user in data.get("users") or []:
+            if isinstance(user, dict) and "username" in user:
+                user_quotas[user["username"]] = (user.get("role", "reader"), user.get("quota_mb"))
+
+        for quota_mb in [*role_quotas.values(), *(quota_mb for _, quota_mb in user_quotas.values())]:
+            if quota_mb is not None and (not isinstance(quota_mb, (int, float)) or quota_mb < 0):
+                raise ConfigError(f"Invalid quota in {self.users_file}: {quota_mb!r}")
+
+        self._role_quotas = dict(role_quotas)
+        self._user_quotas = user_quotas
+
+
+class RateLimitSettings(_Section):
+    enabled: bool = True
+    max_uploads: int = Field(10, gt=0)
+    window_minutes: float = Field(5, gt=0)
+
+
+class StaticSettings(_Section):
+    build_dir: str = "build/static"
+    precompress: bool = True
+
+
+class CompressionSettings(_Section):
+    enabled: bool = True
+    minimum_size: int = Field(1024, ge=0)
+    max_size_mb: float = Field(64, ge=0)
+    mime_types: Tuple[str, ...] = (
+        "text/", "application/json", "application/javascript", "application/xml", "image/svg+xml"
+    )
+    gzip_level: int = Field(4, ge=1, le=9)
+    brotli_quality: int = Field(4, ge=0, le=11)
+    zstd_level: int = Field(3, ge=1, le=22)
+
+
+class CacheSettings(_Section):
+    disk_info_seconds: float = Field(10, ge=0)
+    ip_info_seconds: float = Field(3600, ge=0)
+    ip_info_failure_seconds: float = Field(300, ge=0)
+    ip_info_max_entries: int = Field(10000, gt=0)
+    fragment_max_entries: int = Field(256, ge=0)
+
 
-# Global config variable
-_config = None
+class MetricsSettings(_Section):
+    multiprocess_dir: Optional[str] = None
+    token: str = ""
+    allow_ips: Tuple[str, ...] = ()
+    flush_interval_seconds: float = Field(5, gt=0)
+
+
+class RetentionRule(_Section):
+    extension: Optional[str] = None
+    user: Optional[str] = None
+    max_age_days: Optional[float] = Field(None, gt=0)
+
+
+class RetentionSettings(_Section):
+    enabled: bool = False
+    dry_run: bool = False
+    interval_seconds: float = Field(300, gt=0)
+    batch_size: int = Field(100, gt=0)
+    batch_pause_seconds: float = Field(1, ge=0)
+    max_total_mb: float = Field(0, ge=0)
+    max_ttl_days: Optional[float] = Field(365, gt=0)
+    rules: Tuple[RetentionRule, ...] = ()
+
+    @field_validator("rules", mode="before")
+    @classmethod
+    def _empty_rules(cls, value):
+        return value or ()
+
+
+class JobSettings(_Section):
+    enabled: bool = True
+    db: Optional[str] = None
+    workers: int = Field(2, gt=0)
+    mode: Literal["thread", "process"] = "thread"
+    poll_interval_seconds: float = Field(2, gt=0)
+    max_attempts: int = Field(3, gt=0)
+    retry_backoff_seconds: float = Field(10, ge=0)
+    lease_seconds: float = Field(300, gt=0)
+    keep_finished_days: float = Field(7, ge=0)
+
+
+class BulkSettings(_Section):
+    batch_size: int = Field(500, gt=0)
+    batch_pause_seconds: float = Field(0.1, ge=0)
+    move_directory: str = ".quarantine"
+    max_names: int = Field(100000, gt=0)
+
+
+class EventsSettings(_Section):
+    enabled: bool = True
+    queue_size: int = Field(256, gt=0)
+    history_size: int = Field(500, ge=0)
+    heartbeat_seconds: float = Field(15, gt=0)
+    retry_ms: int = Field(3000, gt=0)
+    progress_interval_seconds: float = Field(1, gt=0)
+
+
+class ProfilingSettings(_Section):
+    enabled: bool = False
+    slow_request_ms: float = Field(1000, ge=0)
+    mode: Literal["sample", "cprofile"] = "sample"
+    sample_interval_ms: float = Field(10, gt=0)
+    directory: str = "logs/profiles"
+    max_captures: int = Field(50, gt=0)
+    exclude_paths: Tuple[str, ...] = ("/static", "/health", "/metrics", "/api/events")
+
+
+class S3Settings(_Section):
+    endpoint_url: Optional[str] = None
+    bucket: str = ""
+    prefix: str = ""
+    region: Optional[str] = None
+    access_key_id: Optional[str] = None
+    secret_access_key: Optional[str] = None
+    addressing_style: Literal["auto", "path", "virtual"] = "auto"
+    # S3 requires at least 5 MB for every part but the last
+    part_size_mb: int = Field(8, ge=5)
+    max_concurrency: int = Field(4, gt=0)
+    max_connections: int = Field(16, gt=0)
+
+
+class StorageCacheSettings(_Section):
+    max_mb: float = Field(10240, ge=0)
+    fill_max_mb: float = Field(1024, ge=0)
+
+
+class StorageSettings(_Section):
+    mode: Literal["local", "object", "tiered"] = "local"
+    driver: Literal["s3", "directory"] = "s3"
+    directory: str = "storage"
+    s3: S3Settings = Field(default_factory=S3Settings)
+    cache: StorageCacheSettings = Field(default_factory=StorageCacheSettings)
+    tier_after_days: float = Field(7, ge=0)
+    interval_seconds: float = Field(60, gt=0)
+
+    @model_validator(mode="after")
+    def _check_bucket(self):
+        if self.mode != "local" and self.driver == "s3" and not self.s3.bucket:
+            raise ValueError("storage.s3.bucket is required for the s3 driver")
+        return self
+
+
+class ReloadSettings(_Section):
+    watch_interval_seconds: float = Field(5, ge=0)
+
+
+class Settings(_Section):
+    """The whole configuration, validated and read-only."""
+    server: ServerSettings = Field(default_factory=ServerSettings)
+    upload: UploadSettings = Field(default_factory=UploadSettings)
+    download: DownloadSettings = Field(default_factory=DownloadSettings)
+    share_links: ShareLinkSettings = Field(default_factory=ShareLinkSettings)
+    archives: ArchiveSettings = Field(default_factory=ArchiveSettings)
+    logging: LoggingSettings = Field(default_factory=LoggingSettings)
+    security: SecuritySettings = Field(default_factory=SecuritySettings)
+    rate_limit: RateLimitSettings = Field(default_factory=RateLimitSettings)
+    static: StaticSettings = Field(default_factory=StaticSettings)
+    compression: CompressionSettings = Field(default_factory=CompressionSettings)
+    cache: CacheSettings = Field(default_factory=CacheSettings)
+    metrics: MetricsSettings = Field(default_factory=MetricsSettings)
+    retention: RetentionSettings = Field(default_factory=RetentionSettings)
+    jobs: JobSettings = Field(default_factory=JobSettings)
+    bulk: BulkSettings = Field(default_factory=BulkSettings)
+    events: EventsSettings = Field(default_factory=EventsSettings)
+    profiling: ProfilingSettings = Field(default_factory=ProfilingSettings)
+    storage: StorageSettings = Field(default_factory=StorageSettings)
+    reload: ReloadSettings = Field(default_factory=ReloadSettings)
+
+    _fingerprint: str = PrivateAttr("")
+
+    def model_post_init(self, context):
+        self._fingerprint = hashlib.sha1(self.model_dump_json().encode()).hexdigest()[:16]
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Short hash of the configuration's contents, for cache keys and ETags
+        of output that depends on it. Equal in every worker process that
+        runs the same configuration, and changes when a reload changes it.
+        """
+        return self._fingerprint
+
+
+class _ConfigView(Mapping):
+    """
+    What get_config() returns: the configuration as a mapping that always
+    reads the latest snapshot, so modules can keep a reference to it and
+    still see reloads. Use get_settings() for several values that must
+    come from the same snapshot.
+    """
+
+    def __getitem__(self, key):
+        return get_settings()[key]
+
+    def __iter__(self):
+        return iter(get_settings().model_fields)
+
+    def __len__(self):
+        return len(get_settings().model_fields)
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+
+# Current configuration snapshot, replaced as a whole on reload
+_settings: Optional[Settings] = None
+_view = _ConfigView()
+_load_lock = threading.Lock()
+_reload_callbacks: List[Callable[[Settings], None]] = []
+
+
+def get_config_path() -> str:
+    return os.environ.get("CONFIG_PATH", "config/config.yml")
 
 
 def get_config():
     """
-    Get configuration from config file.
-    Uses singleton pattern to avoid reloading on every call.
+    Get the configuration.
+    The returned mapping reads like the YAML file and follows reloads.
+    """
+    get_settings()
+    return _view
+
+
+def get_settings() -> Settings:
+    """
+    Get the current configuration snapshot.
+    Loaded on first use; reload_config() replaces it.
+    """
+    global _settings
+
+    if _settings is None:
+        with _load_lock:
+            if _settings is None:
+                _settings = _load_initial_settings(get_config_path())
+
+    return _settings
+
+
+def _load_initial_settings(config_path) -> Settings:
+    try:
+        return load_config(config_path)
+    except FileNotFoundError:
+        # Without a configuration file, run with defaults
+        print(f"Config file {config_path} not found, using defaults")
+        return _prepare(Settings())
+
+
+def load_config(config_path) -> Settings:
+    """
+    Load and validate configuration from a YAML file.
+    Raises FileNotFoundError if it doesn't exist and ConfigError if it is invalid.
+    """
+    with open(config_path, "r") as f:
+        try:
+            data = yaml.load(f, Loader=_YamlLoader) or {}
+        except yaml.YAMLError as e:
+            raise ConfigError(f"{config_path} is not valid YAML: {e}")
+
+    try:
+        settings = Settings.model_validate(data)
+    except ValueError as e:
+        raise ConfigError(f"Invalid configuration in {config_path}: {e}")
+
+    return _prepare(settings)
+
+
+def _prepare(settings: Settings) -> Settings:
+    settings.security.load_quotas()
+    # Ensure required directories exist
+    Path(settings.upload.directory).mkdir(exist_ok=True, parents=True)
+    Path(os.path.dirname(settings.logging.file) or ".").mkdir(exist_ok=True, parents=True)
+    return settings
+
+
+def on_config_reload(callback: Callable[[Settings], None]):
+    """Call callback(settings) with the new snapshot after every successful reload."""
+    _reload_callbacks.append(callback)
+
+
+def reload_config() -> bool:
+    """
+    Reload the configuration file.
+    The new snapshot replaces the current one only once it has loaded and
+    validated completely; on errors the running configuration is kept.
+    Settings read per request apply at once; those that size pools, open
+    sockets or place files only apply after a restart.
     """
-    global _config
-    
-    if _config is None:
-        config_path = os.environ.get("CONFIG_PATH", "config/config.yml")
-        _config = load_config(config_path)
-    
-    return _config
+    global _settings
 
+    # Imported here, logging_utils reads the configuration at import
+    from app.utils.logging_utils import get_logger
+    logger = get_logger(__name__)
 
-def load_config(config_path):
-    """Load configuration from YAML file."""
+    with _load_lock:
+        try:
+            settings = load_config(get_config_path())
+        except Exception as e:
+            logger.error(f"Configuration not reloaded, keeping the running one: {str(e)}")
+            return False
+
+        previous = _settings
+        _settings = settings
+
+    changed = [name for name in settings.model_fields if previous is None or settings[name] != previous[name]]
+    logger.info(f"Configuration reloaded, changed sections: {', '.join(changed) or 'none'}")
+
+    for callback in _reload_callbacks:
+        try:
+            callback(settings)
+        except Exception as e:
+            logger.error(f"Error applying reloaded configuration: {str(e)}")
+    return True
+
+
+def _file_signature(path):
     try:
-        with open(config_path, "r") as f:
-            config = yaml.safe_load(f)
-        
-        # Ensure required directories exist
-        upload_dir = Path(config["upload"]["directory"])
-        upload_dir.mkdir(exist_ok=True, parents=True)
-        
-        logs_dir = Path(os.path.dirname(config["logging"]["file"]))
-        logs_dir.mkdir(exist_ok=True, parents=True)
-        
-        return config
-    except Exception as e:
-        # If we can't load config, use defaults
-        print(f"Error loading config: {str(e)}")
-        return {
-            "server": {
-                "host": "0.0.0.0",
-                "port": 8000,
-                "ssl": {
-                    "enabled": False,
-                    "port": 8443,
-                    "cert_path": "config/ssl/cert.pem",
-                    "key_path": "config/ssl/key.pem"
-                }
-            },
-            "upload": {
-                "max_size": 100,
-                "directory": "uploads",
-                "whitelist_extensions": [],
-                "blacklist_extensions": [".exe", ".bat", ".sh", ".php"],
-                "naming_format": "{timestamp}_{original}"
-            },
-            "logging": {
-                "level": "INFO",
-                "file": "logs/server.log",
-                "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-                "rotation": True,
-                "max_size_mb": 10,
-                "backup_count": 5
-            },
-            "security": {
-                "secret_key": "insecure_default_key",
-                "token_expire_minutes": 60,
-                "passwords_file": "config/passwords.yml",
-                "ip_whitelist_file": "config/ip_whitelist.yml"
-            },
-            "rate_limit": {
-                "enabled": True,
-                "max_uploads": 10,
-                "window_minutes": 5
-            }
-        }
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+def _watched_files(settings: Settings):
+    return (get_config_path(), settings.security.ip_whitelist_file, settings.security.users_file)
+
+
+async def watch_config(interval_seconds: float):
+    """Reload the configuration whenever the config file, the IP whitelist or the users file changes."""
+    signatures = [_file_signature(path) for path in _watched_files(get_settings())]
+    while True:
+        await asyncio.sleep(interval_seconds)
+        current = [_file_signature(path) for path in _watched_files(get_settings())]
+        if current != signatures:
+            await asyncio.to_thread(reload_config)
+            # Watch the files of the configuration now running
+            current = [_file_signature(path) for path in _watched_files(get_settings())]
+        signatures = current
@@ -0,0 +1,175 @@
+import struct
+from typing import List, Optional
+
+# Bytes of a file needed to recognise every signature below
+SNIFF_BYTES = 8192
+
+# (offset, signature, MIME type), checked in order
+_SIGNATURES = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"PK\x05\x06", "application/zip"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (257, b"ustar", "application/x-tar"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"\x1a\x45\xdf\xa3", "video/webm"),
+    (4, b"ftyp", "video/mp4"),
+    (0, b"MZ", "application/x-msdownload"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"\xcf\xfa\xed\xfe", "application/x-mach-binary"),
+    (0, b"\xfe\xed\xfa\xcf", "application/x-mach-binary"),
+    (0, b"\xca\xfe\xba\xbe", "application/x-mach-binary"),
+    (0, b"<?php", "application/x-httpd-php"),
+]
+
+# BMP DIB header sizes (BITMAPCOREHEADER to BITMAPV5HEADER)
+_BMP_DIB_SIZES = {12, 40, 52, 56, 64, 108, 124}
+
+# bzip2 block header and end-of-stream (empty file) magics
+_BZIP2_BLOCK_MAGICS = (b"\x31\x41\x59\x26\x53\x59", b"\x17\x72\x45\x38\x50\x90")
+
+
+def _is_pe(head: bytes) -> bool:
+    # e_lfanew, at 0x3C of the DOS header, points to the "PE\0\0" signature
+    if len(head) < 0x40:
+        return False
+    offset = struct.unpack_from("<I", head, 0x3C)[0]
+    if offset + 4 <= len(head):
+        return head[offset:offset + 4] == b"PE\0\0"
+    # Beyond the sample: trust the header unless the data reads as text
+    return _sniff_text(head) is None
+
+
+def _is_bmp(head: bytes) -> bool:
+    if len(head) < 18:
+        return False
+    reserved, pixel_offset, dib_size = struct.unpack_from("<III", head, 6)
+    return reserved == 0 and dib_size in _BMP_DIB_SIZES and pixel_offset >= 14 + dib_size
+
+
+def _is_bzip2(head: bytes) -> bool:
+    return len(head) >= 10 and head[3:4] in (b"1", b"2", b"3", b"4", b"5", b"6", b"7", b"8", b"9") \
+        and head[4:10] in _BZIP2_BLOCK_MAGICS
+
+
+def _is_id3(head: bytes) -> bool:
+    # Major version 2 to 4, then a "syncsafe" size: 4 bytes with the top bit clear
+    return len(head) >= 10 and head[3] in (2, 3, 4) and head[4] != 0xFF \
+        and all(byte < 0x80 for byte in head[6:10])
+
+
+# Signatures of only two or three bytes also start ordinary text ("MZ,Mozambique",
+# "BMW", "ID3 tags"), so these types are only detected when the structure behind
+# the signature checks out
+_VALIDATORS = {
+    "application/x-msdownload": _is_pe,
+    "image/bmp": _is_bmp,
+    "application/x-bzip2": _is_bzip2,
+    "audio/mpeg": _is_id3,
+}
+
+# Extensions of the executable and script types, so the extension blocklist
+# can be applied to detected content. The system MIME database is not used
+# for this: it maps broad types like text/plain to extensions such as .bat.
+_TYPE_EXTENSIONS = {
+    "application/x-msdownload": [".exe", ".dll", ".com", ".scr"],
+    "application/x-executable": [".bin", ".elf", ".so"],
+    "application/x-mach-binary": [".bin", ".dylib"],
+    "text/x-shellscript": [".sh"],
+    "application/x-httpd-php": [".php"],
+}
+
+# Interpreters in a "#!" line that make a file a shell script
+_SHELLS = {"sh", "bash", "dash", "zsh", "ksh", "csh", "tcsh", "ash"}
+
+# RIFF containers carry their format at offset 8
+_RIFF_FORMATS = {
+    b"WEBP": "image/webp",
+    b"WAVE": "audio/wav",
+    b"AVI ": "video/x-msvideo",
+}
+
+# Office Open XML documents are ZIP files; their first entry usually gives them away
+_ZIP_DOCUMENTS = [
+    (b"word/", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    (b"xl/", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    (b"ppt/", "application/vnd.openxmlformats-officedocument.presentationml.presentation"),
+]
+
+
+def sniff_mime_type(head: bytes) -> Optional[str]:
+    """
+    Detect a file's MIME type from its first bytes (up to SNIFF_BYTES).
+    Returns None when the content is not recognised.
+    """
+    if not head:
+        return None
+
+    if head.startswith(b"RIFF") and len(head) >= 12:
+        return _RIFF_FORMATS.get(head[8:12])
+
+    if head.startswith(b"#!"):
+        return _sniff_script(head)
+
+    for offset, signature, mime_type in _SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            validator = _VALIDATORS.get(mime_type)
+            if validator is not None and not validator(head):
+                continue
+            if mime_type == "application/zip":
+                for marker, document_type in _ZIP_DOCUMENTS:
+                    if marker in head[30:30 + 256]:
+                        return document_type
+            return mime_type
+
+    return _sniff_text(head)
+
+
+def _sniff_script(head: bytes) -> str:
+    """Tell shell scripts apart from scripts for other interpreters by their "#!" line."""
+    words = head[2:].split(b"\n", 1)[0].decode("utf-8", "replace").split()
+    if not words:
+        return "text/plain"
+    interpreter = words[0].rsplit("/", 1)[-1]
+    if interpreter == "env" and len(words) > 1:
+        interpreter = words[1]
+    return "text/x-shellscript" if interpreter in _SHELLS else "text/plain"
+
+
+def get_type_extensions(mime_type: str) -> List[str]:
+    """File extensions of an executable or script type (empty for other types)."""
+    return _TYPE_EXTENSIONS.get(mime_type, [])
+
+
+def _sniff_text(head: bytes) -> Optional[str]:
+    """Recognise markup and plain text; binary data (NUL bytes, invalid UTF-8) is not text."""
+    if b"\x00" in head:
+        return None
+
+    try:
+        text = head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # The sample may end in the middle of a multi-byte character
+        if e.start < len(head) - 3:
+            return None
+        text = head[:e.start].decode("utf-8")
+
+    start = text.lstrip("﻿ \t\r\n")[:512].lower()
+    if start.startswith("<!doctype html") or start.startswith("<html"):
+        return "text/html"
+    if start.startswith("<svg") or (start.startswith("<?xml") and "<svg" in start):
+        return "image/svg+xml"
+    if start.startswith("<?xml"):
+        return "application/xml"
+    return "text/plain"
@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import time
+from typing import AsyncIterator, Dict, Iterator
+
+from starlette.concurrency import iterate_in_threadpool
+
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket for bytes per second.
+    Consuming more than is available puts the bucket in debt and the
+    caller sleeps until the debt is paid, so a sender never gets ahead
+    of the rate by more than the burst. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount: int, wait: bool = True):
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens -= amount
+        if wait and self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class _UserShare:
+    """A user's bucket; the lock queues that user's streams in arrival order."""
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = asyncio.Lock()
+        self.streams = 0
+
+
+class DownloadStream:
+    """
+    One download's handle on the scheduler. The response sending the
+    download calls open() when it starts, consume() before sending each
+    chunk and close() when it ends; a response that is never sent
+    leaves nothing registered.
+    """
+
+    def __init__(self, scheduler: "DownloadScheduler", username: str, filename: str, size: int, priority: bool):
+        self.scheduler = scheduler
+        self.id = None
+        self.username = username
+        self.filename = filename
+        self.size = size
+        self.priority = priority
+        self.chunk_size = scheduler.chunk_size
+        self.bytes_sent = 0
+        self.started = None
+        self.closed = False
+        self._share = None
+
+    def open(self):
+        """Register the download with the scheduler, once it is being sent."""
+        if self.id is None:
+            self.started = time.monotonic()
+            self.scheduler._open(self)
+
+    async def consume(self, amount: int):
+        """Wait until amount bytes may be sent on this stream."""
+        if self.priority:
+            # The priority lane never waits, but its bytes still count against
+            # the buckets, so bulk streams make room for it
+            await self._share.bucket.consume(amount, wait=False)
+            await self.scheduler.bucket.consume(amount, wait=False)
+        else:
+            # Waiting in the locks' FIFO queues hands out equal chunks to
+            # each stream in turn, which shares the bandwidth fairly
+            async with self._share.lock:
+                await self._share.bucket.consume(amount)
+            async with self.scheduler.lock:
+                await self.scheduler.bucket.consume(amount)
+        self.bytes_sent += amount
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        if self.id is not None and not self.closed:
+            self.closed = True
+            self.scheduler._close(self)
+
+
+class DownloadScheduler:
+    """
+    Bandwidth scheduling for downloads.
+    Caps the bytes per second sent to all downloads together and to each
+    user, with token buckets, and shares them fairly between concurrent
+    streams. Small files and previews take a priority lane that is never
+    delayed, so page loads stay fast while large downloads run.
+
+    Limits apply per worker process.
+    """
+
+    def __init__(self, global_mb_per_second=0, per_user_mb_per_second=0, burst_seconds=0.5,
+                 chunk_kb=256, priority_max_kb=1024, preview_max_mb=20):
+        self.global_rate = global_mb_per_second * 1024 * 1024
+        self.per_user_rate = per_user_mb_per_second * 1024 * 1024
+        self.chunk_size = chunk_kb * 1024
+        self.priority_max_bytes = priority_max_kb * 1024
+        self.preview_max_bytes = preview_max_mb * 1024 * 1024
+        self.burst_seconds = burst_seconds
+
+        self.bucket = TokenBucket(self.global_rate, self._burst(self.global_rate))
+        self._lock = None
+        self.shares: Dict[str, _UserShare] = {}
+        self.streams: Dict[int, DownloadStream] = {}
+        self._ids = itertools.count(1)
+
+        # Counters exposed through stats()
+        self.started_total = 0
+        self.priority_total = 0
+        self.bytes_total = 0
+
+        logger.info(
+            f"Download scheduler initialized: global limit {global_mb_per_second or 'none'} MB/s, "
+            f"per-user limit {per_user_mb_per_second or 'none'} MB/s"
+        )
+
+    def set_limits(self, global_mb_per_second=0, per_user_mb_per_second=0):
+        """Change the limits, e.g. after a configuration reload; running streams follow at once."""
+        self.global_rate = global_mb_per_second * 1024 * 1024
+        self.per_user_rate = per_user_mb_per_second * 1024 * 1024
+        self.bucket.rate = self.global_rate
+        self.bucket.burst = self._burst(self.global_rate)
+        for share in self.shares.values():
+            share.bucket.rate = self.per_user_rate
+            share.bucket.burst = self._burst(self.per_user_rate)
+        logger.info(
+            f"Download limits changed: global limit {global_mb_per_second or 'none'} MB/s, "
+            f"per-user limit {per_user_mb_per_second or 'none'} MB/s"
+        )
+
+    @property
+    def lock(self):
+        # Created lazily so the scheduler can be built before the event loop starts
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _burst(self, rate: float) -> float:
+        # Enough for at least one chunk, so a single stream can reach the full rate
+        return max(rate * self.burst_seconds, self.chunk_size)
+
+    def is_priority(self, size: int, preview: bool = False) -> bool:
+        """Whether a download takes the priority lane: small files, and previews up to a size."""
+        return size <= self.priority_max_bytes or (preview and size <= self.preview_max_bytes)
+
+    def create_stream(self, username: str, filename: str, size: int, preview: bool = False) -> DownloadStream:
+        """Describe a download for its response, which opens the stream when it starts sending and closes it at the end."""
+        return DownloadStream(self, username, filename, size, self.is_priority(size, preview))
+
+    def _open(self, stream: DownloadStream):
+        share = self.shares.get(stream.username)
+        if share is None:
+            share = self.shares[stream.username] = _UserShare(self.per_user_rate, self._burst(self.per_user_rate))
+        share.streams += 1
+
+        stream.id = next(self._ids)
+        stream._share = share
+        self.streams[stream.id] = stream
+        self.started_total += 1
+        if stream.priority:
+            self.priority_total += 1
+
+    def _close(self, stream: DownloadStream):
+        self.streams.pop(stream.id, None)
+        self.bytes_total += stream.bytes_sent
+        share = self.shares.get(stream.username)
+        if share is not None:
+            share.streams -= 1
+            if share.streams <= 0:
+                del self.shares[stream.username]
+
+    async def throttle(self, iterator: Iterator[bytes], stream: DownloadStream) -> AsyncIterator[bytes]:
+        """
+        Pace a (blocking) iterator of chunks, e.g. for a StreamingResponse.
+        The stream is opened when the response starts reading from it, and closed at the end.
+        """
+        stream.open()
+        try:
+            async for chunk in iterate_in_threadpool(iterator):
+                await stream.consume(len(chunk))
+                yield chunk
+        finally:
+            stream.close()
+
+    def stats(self):
+        """Current streams with their rates, and totals."""
+        return {
+            "global_limit_bytes_per_second": self.global_rate,
+            "per_user_limit_bytes_per_second": self.per_user_rate,
+            "active": len(self.streams),
+            "streams": [
+                {
+                    "id": stream.id,
+                    "user": stream.username,
+                    "file": stream.filename,
+                    "size": stream.size,
+                    "bytes_sent": stream.bytes_sent,
+                    "priority": stream.priority,
+                    "seconds": round(time.monotonic() - stream.started, 3),
+                    "bytes_per_second": round(stream.rate()),
+                }
+                for stream in self.streams.values()
+            ],
+            "started_total": self.started_total,
+            "priority_total": self.priority_total,
+            "bytes_total": self.bytes_total + sum(stream.bytes_sent for stream in self.streams.values()),
+        }
@@ -1,11 +1,24 @@
+import hashlib
 import os
 import mimetypes
+import time
 from datetime import datetime
+from email.utils import formatdate
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from urllib.parse import quote
 
+import anyio
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.utils.archive_utils import get_archive_format
 from app.utils.config import get_config
+from app.utils.file_utils import resolve_file_path
 from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
+from app.utils.metrics import DOWNLOADS, DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, FILE_LIST_SECONDS
+from app.utils.storage import get_storage
 
 logger = get_logger(__name__)
 config = get_config()
@@ -13,9 +26,12 @@ config = get_config()
 # Initialize mimetypes
 mimetypes.init()
 
+@FILE_LIST_SECONDS.timed
 def get_file_list(page: int = 1, per_page: Optional[int] = None) -> Dict:
     """
     Get a paginated list of files in the upload directory.
+    Pages are read from the file index, so listing does not depend on
+    how many files there are or how they are laid out on disk.
     
     Returns:
         Dict with files, total, page, and pages
@@ -24,30 +40,10 @@ def get_file_list(page: int = 1, per_page: Optional[int] = None) -> Dict:
         per_page = config["download"].get("page_size", 20)
         
     upload_dir = Path(config["upload"]["directory"])
-    
-    # Get all files (excluding directories)
-    all_files = []
-    for item in upload_dir.iterdir():
-        if item.is_file() and not item.name.startswith('.'):
-            stats = item.stat()
-            file_info = {
-                "name": item.name,
-                "path": str(item),
-                "size": stats.st_size,
-                "size_formatted": format_file_size(stats.st_size),
-                "modified": datetime.fromtimestamp(stats.st_mtime),
-                "modified_formatted": datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
-                "type": get_file_type(item.name),
-                "icon": get_file_icon(item.name),
-                "previewable": is_file_previewable(item.name)
-            }
-            all_files.append(file_info)
-    
-    # Sort files by modified date (newest first)
-    all_files.sort(key=lambda x: x["modified"], reverse=True)
+    store = get_metadata_store()
     
     # Calculate pagination
-    total_files = len(all_files)
+    total_files = store.count_files()
     total_pages = (total_files + per_page - 1) // per_page
     
     # Adjust page if out of bounds
@@ -56,10 +52,8 @@ def get_file_list(page: int = 1, per_page: Optional[int] = None) -> Dict:
     elif page > total_pages and total_pages > 0:
         page = total_pages
     
-    # Get files for current page
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    files = all_files[start_idx:end_idx]
+    # Get files for current page (newest first)
+    files = [describe_file(record, upload_dir) for record in store.list_files((page - 1) * per_page, per_page)]
     
     return {
         "files": files,
@@ -69,33 +63,191 @@ def get_file_list(page: int = 1, per_page: Optional[int] = None) -> Dict:
         "per_page": per_page
     }
 
+def describe_file(record: Dict, upload_dir: Optional[Path] = None) -> Dict:
+    """Describe a file index record the way the file list shows it."""
+    if upload_dir is None:
+        upload_dir = Path(config["upload"]["directory"])
+    
+    modified = datetime.fromtimestamp(record["uploaded_at"])
+    return {
+        "name": record["name"],
+        "path": str(upload_dir / (record.get("path") or record["name"])),
+        "size": record["size"],
+        "size_formatted": format_file_size(record["size"]),
+        "modified": modified,
+        "modified_formatted": modified.strftime("%Y-%m-%d %H:%M:%S"),
+        "type": get_file_type(record["name"]),
+        "icon": get_file_icon(record["name"]),
+        "previewable": is_file_previewable(record["name"], record.get("content_type"))
+    }
+
 def get_file_info(filename: str) -> Optional[Dict]:
-    """Get detailed information about a specific file."""
-    upload_dir = Path(config["upload"]["directory"])
-    file_path = upload_dir / filename
+    """
+    Get detailed information about a specific file.
+    Files only in the object store are described from the file index,
+    with "path" set to None.
+    """
+    record = get_metadata_store().get_file(filename)
+    file_path = resolve_file_path(filename, record)
     
-    if not file_path.exists() or not file_path.is_file():
+    if file_path is not None:
+        stats = file_path.stat()
+        size, modified, created = stats.st_size, stats.st_mtime, stats.st_ctime
+    elif get_storage().is_remote_only(record):
+        size, modified, created = record["size"], record["uploaded_at"], record["uploaded_at"]
+    else:
         return None
     
-    stats = file_path.stat()
+    # Prefer the type detected from the file's contents at upload
+    content_type = record.get("content_type") if record else None
     
     file_info = {
-        "name": file_path.name,
-        "path": str(file_path),
-        "size": stats.st_size,
-        "size_formatted": format_file_size(stats.st_size),
-        "modified": datetime.fromtimestamp(stats.st_mtime),
-        "modified_formatted": datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
-        "created": datetime.fromtimestamp(stats.st_ctime),
-        "created_formatted": datetime.fromtimestamp(stats.st_ctime).strftime("%Y-%m-%d %H:%M:%S"),
-        "type": get_file_type(file_path.name),
-        "mime_type": get_mime_type(file_path.name),
-        "icon": get_file_icon(file_path.name),
-        "previewable": is_file_previewable(file_path.name)
+        "name": filename,
+        "path": str(file_path) if file_path is not None else None,
+        "size": size,
+        "size_formatted": format_file_size(size),
+        "modified": datetime.fromtimestamp(modified),
+        "modified_formatted": datetime.fromtimestamp(modified).strftime("%Y-%m-%d %H:%M:%S"),
+        "created": datetime.fromtimestamp(created),
+        "created_formatted": datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S"),
+        "type": get_file_type(filename),
+        "mime_type": content_type or get_mime_type(filename),
+        "icon": get_file_icon(filename),
+        "previewable": is_file_previewable(filename, content_type)
     }
     
     return file_info
 
+def _record_download(size: int, elapsed: float):
+    DOWNLOADS.inc()
+    DOWNLOAD_BYTES.inc(size)
+    if elapsed > 0:
+        DOWNLOAD_THROUGHPUT.observe(size / elapsed)
+
+class MeteredFileResponse(FileResponse):
+    """FileResponse that records bytes sent and throughput once the file has been sent."""
+    
+    async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
+        await super().__call__(scope, receive, send)
+        _record_download(int(self.headers.get("content-length", 0)), time.perf_counter() - start)
+
+class RangeFileResponse(MeteredFileResponse):
+    """
+    MeteredFileResponse that answers a single byte range with 206 Partial Content.
+    When the ASGI server offers the zero-copy send extension, the file is
+    handed to it (sendfile) instead of being read through Python. With a
+    download scheduler stream, every chunk waits for its bandwidth share;
+    zero-copy sends are then split into chunk-sized sendfile calls.
+    """
+    
+    def __init__(self, path, stat_result: os.stat_result, byte_range: Optional[Tuple[int, int]] = None,
+                 stream=None, **kwargs):
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        self.byte_range = byte_range
+        self.stream = stream
+        self.headers["Accept-Ranges"] = "bytes"
+        if byte_range is not None:
+            self.status_code = 206
+            self.headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{stat_result.st_size}"
+            self.headers["Content-Length"] = str(byte_range[1] - byte_range[0] + 1)
+    
+    async def __call__(self, scope, receive, send):
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        if self.byte_range is None and not zero_copy and self.stream is None:
+            await super().__call__(scope, receive, send)
+            return
+        
+        if self.stream is not None:
+            self.stream.open()
+        try:
+            await self._send_file(send, zero_copy)
+        finally:
+            if self.stream is not None:
+                self.stream.close()
+        
+        if self.background is not None:
+            await self.background()
+    
+    async def _send_file(self, send, zero_copy: bool):
+        start = time.perf_counter()
+        first, last = self.byte_range or (0, self.stat_result.st_size - 1)
+        size = last - first + 1
+        chunk_size = self.stream.chunk_size if self.stream is not None else self.chunk_size
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        
+        if self.send_header_only or size <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        
+        if zero_copy:
+            with open(self.path, "rb") as f:
+                if self.stream is None:
+                    await send({"type": "http.response.zerocopysend", "file": f, "offset": first, "count": size})
+                else:
+                    offset = first
+                    while offset <= last:
+                        count = min(chunk_size, last - offset + 1)
+                        await self.stream.consume(count)
+                        offset += count
+                        await send({"type": "http.response.zerocopysend", "file": f, "offset": offset - count,
+                                    "count": count, "more_body": offset <= last})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as f:
+                await f.seek(first)
+                remaining = size
+                while remaining > 0:
+                    want = min(chunk_size, remaining)
+                    if self.stream is not None:
+                        await self.stream.consume(want)
+                    chunk = await f.read(want)
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    # The file shrank while it was sent
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        
+        _record_download(size, time.perf_counter() - start)
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header ("bytes=first-last", "bytes=first-" or "bytes=-suffix").
+    Returns the inclusive (first, last) byte positions, or None to send the whole
+    content (no header, multiple ranges or another unit).
+    Raises HTTPException(416) when the range lies outside the content.
+    """
+    if not header:
+        return None
+    
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # The last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            first, last = max(0, size - length), size - 1
+        else:
+            first = int(first)
+            last = int(last) if last else size - 1
+    except ValueError:
+        return None
+    
+    if first >= size or first > last:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    
+    return first, min(last, size - 1)
+
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human-readable format."""
     if size_bytes < 1024:
@@ -151,13 +303,17 @@ def get_file_icon(filename: str) -> str:
     
     return icons.get(file_type, "📁")
 
-def is_file_previewable(filename: str) -> bool:
-    """Check if a file can be previewed in the browser."""
+def is_file_previewable(filename: str, content_type: Optional[str] = None) -> bool:
+    """
+    Check if a file can be previewed in the browser.
+    Uses the content type detected at upload when known, so a renamed
+    binary is not offered as an image or text preview.
+    """
     if not config["download"].get("enable_previews", True):
         return False
         
     file_type = get_file_type(filename)
-    mime_type = get_mime_type(filename)
+    mime_type = content_type or get_mime_type(filename)
     
     # Check if it's an image
     if file_type == "image" and mime_type.startswith("image/"):
@@ -171,4 +327,49 @@ def is_file_previewable(filename: str) -> bool:
     if mime_type == "application/pdf":
         return True
     
-    return False
\ No newline at end of file
+    # ZIP and tar archives are previewed as a list of their members
+    if get_archive_format(filename, content_type):
+        return True
+    
+    return False
+
+
+def content_disposition(filename: str) -> str:
+    """
+    Content-Disposition header for downloading a file under its name, as
+    FileResponse builds it: names that aren't plain ASCII (or contain
+    quotes) are sent percent-encoded in the RFC 5987 filename* form.
+    """
+    if quote(filename) != filename:
+        return f"attachment; filename*=utf-8''{quote(filename)}"
+    return f'attachment; filename="{filename}"'
+
+
+class RemoteFileResponse(StreamingResponse):
+    """
+    Streams a file from the object store with the headers RangeFileResponse
+    sends for local files: length, range, validators and the attachment name.
+    `content` yields the requested bytes, e.g. paced by the download scheduler.
+    """
+    
+    def __init__(self, content, size: int, modified: float, filename: str,
+                 byte_range: Optional[Tuple[int, int]] = None,
+                 media_type: Optional[str] = None, headers: Optional[Dict] = None):
+        super().__init__(content, media_type=media_type or mimetypes.guess_type(filename)[0] or "text/plain",
+                         headers=headers)
+        self.size = size
+        self.headers["Accept-Ranges"] = "bytes"
+        self.headers["Last-Modified"] = formatdate(modified, usegmt=True)
+        self.headers.setdefault("ETag", f'"{hashlib.md5(f"{modified}-{size}".encode()).hexdigest()}"')
+        self.headers["Content-Disposition"] = content_disposition(filename)
+        if byte_range is not None:
+            self.status_code = 206
+            self.headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+            self.headers["Content-Length"] = str(byte_range[1] - byte_range[0] + 1)
+        else:
+            self.headers["Content-Length"] = str(size)
+    
+    async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
+        await super().__call__(scope, receive, send)
+        _record_download(int(self.headers["content-length"]), time.perf_counter() - start)
@@ -0,0 +1,71 @@
+import time
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Global drain state instance
+_state = None
+
+
+def get_drain_config() -> Dict:
+    return config.get("server", {}).get("drain", {})
+
+
+def get_drain_state():
+    """
+    Get the drain state of this worker process.
+    Uses singleton pattern so the server and the app share the same state.
+    """
+    global _state
+
+    if _state is None:
+        _state = DrainState()
+
+    return _state
+
+
+class DrainState:
+    """
+    Whether this worker is shutting down gracefully.
+    Once draining, health checks report it and new uploads are turned
+    away, while transfers already running are allowed to finish.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self.started_at: Optional[float] = None
+        self.active_uploads = 0
+
+    def begin(self):
+        if not self.draining:
+            self.draining = True
+            self.started_at = time.time()
+            logger.info(f"Draining: no new uploads, waiting for {self.active_uploads} upload(s) in progress")
+
+    def check_accepting_uploads(self):
+        """Reject an upload with 503 and Retry-After while draining."""
+        if self.draining:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is restarting. Please retry shortly.",
+                headers={"Retry-After": str(get_drain_config().get("retry_after_seconds", 5))},
+            )
+
+    def upload_started(self):
+        self.active_uploads += 1
+
+    def upload_finished(self):
+        self.active_uploads -= 1
+
+    def status(self) -> Dict:
+        return {
+            "draining": self.draining,
+            "draining_seconds": round(time.time() - self.started_at, 1) if self.started_at else None,
+            "active_uploads": self.active_uploads,
+        }
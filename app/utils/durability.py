@@ -0,0 +1,160 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Global group committer instance
+_committer = None
+
+
+def get_durability_config() -> Dict:
+    return config["upload"].get("durability", {})
+
+
+def _fsync_path(path, directory: bool = False):
+    fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def commit_files(batch: List[Tuple[Path, Path]]) -> List[Optional[BaseException]]:
+    """
+    Durably move finished uploads into place. Blocking.
+    Each file's data is flushed before it is renamed, so a crash can never
+    leave a partial file under its final name; each destination directory
+    is then flushed once for the whole batch, so the new names survive too.
+    Returns one exception (or None) per file.
+    """
+    errors: List[Optional[BaseException]] = [None] * len(batch)
+    for i, (source, _) in enumerate(batch):
+        try:
+            _fsync_path(source)
+        except OSError as e:
+            errors[i] = e
+
+    directories = set()
+    for i, (source, destination) in enumerate(batch):
+        if errors[i] is None:
+            try:
+                os.replace(source, destination)
+                directories.add(destination.parent)
+            except OSError as e:
+                errors[i] = e
+
+    for directory in directories:
+        try:
+            _fsync_path(directory, directory=True)
+        except OSError as e:
+            for i, (_, destination) in enumerate(batch):
+                if errors[i] is None and destination.parent == directory:
+                    errors[i] = e
+
+    return errors
+
+
+def get_group_committer():
+    """
+    Get the group committer of this worker process.
+    Uses singleton pattern so concurrent uploads share its batches.
+    """
+    global _committer
+
+    if _committer is None:
+        _committer = GroupCommitter(max_files=get_durability_config().get("group_max_files", 64))
+
+    return _committer
+
+
+async def publish_upload(source: Path, destination: Path):
+    """
+    Move a finished upload from the incoming directory into place, with
+    the durability upload.durability.mode asks for:
+    - none: just rename; the OS writes the data back when it sees fit
+    - file: flush the file and its directory before the upload is confirmed
+    - group: the same, batched with the uploads finishing meanwhile
+    """
+    mode = get_durability_config().get("mode", "none")
+    if mode == "none":
+        os.replace(source, destination)
+        return
+
+    if mode == "group":
+        await get_group_committer().commit(source, destination)
+        return
+
+    error = (await asyncio.to_thread(commit_files, [(source, destination)]))[0]
+    if error is not None:
+        raise error
+
+
+class GroupCommitter:
+    """
+    Group commit for uploads. The first upload to finish is committed at
+    once; uploads finishing while a commit is running queue up and are
+    committed together as the next batch (up to max_files), sharing its
+    directory flushes and the filesystem journal commits behind them. A
+    lone upload therefore never waits for a batch to fill, and the batches
+    grow with the load.
+    """
+
+    def __init__(self, max_files: int = 64):
+        self.max_files = max_files
+        self._pending: List[Tuple[Path, Path, asyncio.Future]] = []
+        # The running commit loop; the event loop only keeps weak references to tasks
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters exposed through stats()
+        self.batches_total = 0
+        self.files_total = 0
+        self.largest_batch = 0
+
+    async def commit(self, source: Path, destination: Path):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((source, destination, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        # Cancelling one upload doesn't cancel its batch: its file may be renamed into place
+        # regardless, so callers that index the file shield the whole commit (see commit_upload)
+        await asyncio.shield(future)
+
+    async def _run(self):
+        try:
+            while self._pending:
+                batch = self._pending[:self.max_files]
+                del self._pending[:self.max_files]
+                try:
+                    errors = await asyncio.to_thread(commit_files, [(source, destination) for source, destination, _ in batch])
+                except Exception as e:
+                    errors = [e] * len(batch)
+
+                self.batches_total += 1
+                self.files_total += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                for (_, _, future), error in zip(batch, errors):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+        finally:
+            self._task = None
+
+    def stats(self) -> Dict:
+        """Group commit metrics."""
+        return {
+            "mode": get_durability_config().get("mode", "none"),
+            "pending": len(self._pending),
+            "batches_total": self.batches_total,
+            "files_total": self.files_total,
+            "average_batch": round(self.files_total / self.batches_total, 2) if self.batches_total else 0,
+            "largest_batch": self.largest_batch,
+        }
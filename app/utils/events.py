@@ -0,0 +1,331 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from starlette.requests import Request
+
+from app.utils import metrics
+from app.utils.config import get_config
+from app.utils.download_utils import describe_file
+from app.utils.draining import get_drain_state
+from app.utils.logging_utils import get_logger
+from app.utils.quota import get_quota_info
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Global broadcaster instance
+_broadcaster = None
+
+# Roles that see files being added and removed: the ones with the download page
+FILE_VIEWER_ROLES = ("admin", "reader")
+
+# Queued messages sent to a page in one write
+MAX_MESSAGES_PER_WRITE = 64
+
+# Sent instead of the events a page missed when they are no longer available
+RESET_MESSAGE = "event: reset\ndata: {}\n\n"
+
+
+def get_events_config() -> Dict:
+    return config.get("events", {})
+
+
+def get_broadcaster():
+    """
+    Get the live event broadcaster of this worker process.
+    Uses singleton pattern so every part of the app publishes to the same pages.
+    """
+    global _broadcaster
+
+    if _broadcaster is None:
+        events_config = get_events_config()
+        _broadcaster = EventBroadcaster(
+            queue_size=events_config.get("queue_size", 256),
+            history_size=events_config.get("history_size", 500),
+        )
+
+    return _broadcaster
+
+
+def format_message(event_id: Optional[str], event_type: str, data) -> str:
+    """Encode an event in the Server-Sent Events format."""
+    lines = [f"id: {event_id}"] if event_id else []
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'), default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscriber:
+    """A connected page: its user, and a bounded queue of messages still to be sent to it."""
+
+    def __init__(self, username: str, role: str, queue_size: int):
+        self.username = username
+        self.role = role
+        # None marks the end of the stream
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def can_see(self, event: Dict) -> bool:
+        if event["roles"] is None or self.role in event["roles"]:
+            return True
+        return event["user"] is not None and event["user"] == self.username
+
+
+class EventBroadcaster:
+    """
+    Fans events out to the live pages of this worker process.
+    Each event is encoded once and offered to the queue of every page
+    allowed to see it. Publishing never waits for a page: one whose queue
+    is full has fallen behind and is disconnected, and its browser
+    reconnects. The most recent events are kept, so a page reconnecting
+    with Last-Event-ID gets what it missed, or is told to reload when
+    those events are gone.
+
+    publish() may be called from any thread; delivery happens on the
+    event loop the broadcaster was started on. Before start() (e.g. in
+    command-line tools), events are discarded.
+    """
+
+    def __init__(self, queue_size: int = 256, history_size: int = 500):
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        # Connected pages per user, read from other threads to skip work nobody would see
+        self._users: Dict[str, int] = {}
+        self._next_seq = 1
+        # Event IDs are only meaningful within this process
+        self._epoch = uuid.uuid4().hex[:8]
+        self._loop = None
+        self._loop_thread = None
+
+        # Counters exposed through stats()
+        self.published_total = 0
+        self.dropped_total = 0
+
+    def start(self):
+        """Deliver events on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+    def stop(self):
+        """End every stream, e.g. at shutdown."""
+        for subscriber in list(self._subscribers):
+            self._close(subscriber)
+        self._loop = None
+
+    def has_subscribers(self, username: Optional[str] = None) -> bool:
+        if username is not None:
+            return self._users.get(username, 0) > 0
+        return bool(self._users)
+
+    def publish(self, event_type: str, data, roles: Optional[Sequence[str]] = None,
+                user: Optional[str] = None, replay: bool = True):
+        """
+        Send an event to the pages allowed to see it: those of users with
+        one of the roles (everyone if roles is None) and those of `user`.
+        Events published with replay=False (e.g. progress) are not kept for
+        reconnecting pages.
+        """
+        loop = self._loop
+        if loop is None:
+            return
+
+        event = {"type": event_type, "data": data, "roles": roles, "user": user, "replay": replay}
+        if threading.get_ident() == self._loop_thread:
+            self._deliver(event)
+            return
+        try:
+            loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            # The loop closed at shutdown
+            pass
+
+    def _deliver(self, event: Dict):
+        event["seq"] = self._next_seq
+        self._next_seq += 1
+        event["message"] = format_message(f"{self._epoch}-{event['seq']}", event["type"], event["data"])
+        if event["replay"]:
+            self._history.append(event)
+        self.published_total += 1
+        metrics.EVENTS_PUBLISHED.inc()
+
+        for subscriber in list(self._subscribers):
+            if not subscriber.can_see(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event["message"])
+            except asyncio.QueueFull:
+                self.dropped_total += 1
+                metrics.EVENT_SUBSCRIBERS_DROPPED.inc()
+                logger.warning(f"Live events: disconnecting a page of user '{subscriber.username}' that fell behind")
+                self._close(subscriber)
+
+    def subscribe(self, username: str, role: str, last_event_id: Optional[str] = None) -> Subscriber:
+        """Connect a page. With the ID of the last event it received, it first gets the ones it missed."""
+        subscriber = Subscriber(username, role, self.queue_size)
+
+        if last_event_id:
+            missed = self._events_after(last_event_id)
+            messages = [event["message"] for event in missed if subscriber.can_see(event)] if missed is not None else None
+            if messages is None or len(messages) >= self.queue_size:
+                subscriber.queue.put_nowait(RESET_MESSAGE)
+            else:
+                for message in messages:
+                    subscriber.queue.put_nowait(message)
+
+        self._subscribers.add(subscriber)
+        self._users[username] = self._users.get(username, 0) + 1
+        metrics.EVENT_SUBSCRIBERS.set(len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        remaining = self._users.get(subscriber.username, 0) - 1
+        if remaining > 0:
+            self._users[subscriber.username] = remaining
+        else:
+            self._users.pop(subscriber.username, None)
+        metrics.EVENT_SUBSCRIBERS.set(len(self._subscribers))
+
+    def _close(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber)
+        # Discard the backlog to make room for the end-of-stream marker
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    def _events_after(self, last_event_id: str) -> Optional[List[Dict]]:
+        """The kept events after an event ID, or None when some of them are no longer available."""
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self._epoch or not seq.isdigit() or int(seq) >= self._next_seq:
+            return None
+
+        seq = int(seq)
+        # Once the history is full, events older than the oldest kept one may have been dropped
+        oldest = self._history[0]["seq"] if self._history else self._next_seq
+        if len(self._history) == self._history.maxlen and seq + 1 < oldest:
+            return None
+        return [event for event in self._history if event["seq"] > seq]
+
+    async def stream(self, username: str, role: str, last_event_id: Optional[str] = None,
+                     heartbeat_seconds: float = 15, retry_ms: int = 3000):
+        """The Server-Sent Events body for a page, until it disconnects, falls behind or the server drains."""
+        drain_state = get_drain_state()
+        # Subscribed once the response starts, so a response that is never sent leaves nothing behind
+        subscriber = self.subscribe(username, role, last_event_id)
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            while not drain_state.draining:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    break
+
+                # Send whatever else is queued in the same write
+                messages = [message]
+                while len(messages) < MAX_MESSAGES_PER_WRITE and not subscriber.queue.empty():
+                    message = subscriber.queue.get_nowait()
+                    if message is None:
+                        break
+                    messages.append(message)
+                yield "".join(messages)
+                if message is None:
+                    break
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict:
+        """Live event metrics."""
+        return {
+            "subscribers": len(self._subscribers),
+            "users": len(self._users),
+            "history": len(self._history),
+            "published_total": self.published_total,
+            "dropped_total": self.dropped_total,
+        }
+
+
+def notify_file_added(record: Dict):
+    """Publish a new file (a file index record) to the pages that list files, and its owner's new usage."""
+    entry = describe_file(record)
+    del entry["path"], entry["modified"]
+    entry["owner"] = record.get("owner")
+    get_broadcaster().publish("upload", entry, roles=FILE_VIEWER_ROLES, user=entry["owner"])
+    notify_usage(entry["owner"])
+
+
+def notify_files_removed(files: Iterable[Dict], reason: str):
+    """Publish the removal of files (dicts with name, owner and size), and their owners' new usage."""
+    broadcaster = get_broadcaster()
+    by_owner: Dict[Optional[str], List[Dict]] = {}
+    for file in files:
+        by_owner.setdefault(file.get("owner"), []).append({"name": file["name"], "size": file["size"]})
+
+    for owner, owned in by_owner.items():
+        broadcaster.publish("delete", {"files": owned, "owner": owner, "reason": reason},
+                            roles=FILE_VIEWER_ROLES, user=owner)
+        notify_usage(owner)
+
+
+def notify_usage(username: Optional[str]):
+    """Publish a user's storage usage and quota to their own pages, if they have any open."""
+    broadcaster = get_broadcaster()
+    if username and broadcaster.has_subscribers(username):
+        broadcaster.publish("quota", get_quota_info(username), roles=(), user=username, replay=False)
+
+
+class UploadProgress:
+    """
+    Counts the bytes of an upload request as they are received and
+    publishes upload_progress events to admins and the uploader: when the
+    body starts arriving, then at most every interval seconds, and when
+    the upload ends. Read the body through `request`.
+    """
+
+    def __init__(self, request: Request, username: str, interval: Optional[float] = None):
+        self.broadcaster = get_broadcaster()
+        self.id = uuid.uuid4().hex[:12]
+        self.username = username
+        self.total = int(request.headers.get("content-length") or 0) or None
+        self.received = 0
+        self.interval = interval if interval is not None else get_events_config().get("progress_interval_seconds", 1)
+        self._last_published = None
+        self._receive = request.receive
+        self.request = Request(request.scope, self.receive)
+
+    async def receive(self):
+        message = await self._receive()
+        if message["type"] == "http.request":
+            self.received += len(message.get("body", b""))
+            now = time.monotonic()
+            if self._last_published is None or now - self._last_published >= self.interval:
+                self._last_published = now
+                self._publish("receiving")
+        return message
+
+    def _publish(self, status: str):
+        if not self.broadcaster.has_subscribers():
+            return
+        self.broadcaster.publish("upload_progress", {
+            "id": self.id,
+            "user": self.username,
+            "status": status,
+            "received": self.received,
+            "total": self.total,
+        }, roles=("admin",), user=self.username, replay=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._publish("failed" if exc_type is not None else "done")
+        return False
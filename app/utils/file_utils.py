@@ -1,10 +1,14 @@
+import fcntl
+import hashlib
 import os
 import uuid
 from datetime import datetime
 from pathlib import Path
 
 from app.utils.config import get_config
+from app.utils.content_sniff import get_type_extensions
 from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
 
 logger = get_logger(__name__)
 config = get_config()
@@ -16,19 +20,32 @@ def is_file_allowed(filename):
     Returns True if allowed, False otherwise.
     """
     _, ext = os.path.splitext(filename.lower())
+    upload_config = config["upload"]
     
     # Check blacklist (these extensions are always blocked)
-    if ext in config["upload"]["blacklist_extensions"]:
+    if ext in upload_config.blocked_extensions:
         return False
     
     # Check whitelist (if empty, all non-blacklisted extensions are allowed)
-    whitelist = config["upload"]["whitelist_extensions"]
+    whitelist = upload_config.allowed_extensions
     if whitelist and ext not in whitelist:
         return False
     
     return True
 
 
+def is_content_allowed(content_type):
+    """
+    Check content detected from a file's bytes against the extension blacklist.
+    A renamed executable is rejected just like one with its real extension.
+    """
+    if not content_type:
+        return True
+    
+    blacklist = config["upload"].blocked_extensions
+    return not any(ext in blacklist for ext in get_type_extensions(content_type))
+
+
 def get_file_path(original_filename, username):
     """
     Generate a file path for an uploaded file using the configured naming format.
@@ -53,20 +70,143 @@ def get_file_path(original_filename, username):
     }
     
     # Format the filename
-    naming_format = config["upload"]["naming_format"]
-    new_filename = naming_format.format(**format_vars)
+    new_filename = config["upload"].format_filename(format_vars)
     
     # Make sure extension is included
     if not new_filename.endswith(ext):
         new_filename += ext
         
-    # Create full path
+    # Create full path inside the shard directory for the configured layout
     upload_dir = Path(config["upload"]["directory"])
-    file_path = upload_dir / new_filename
+    shard_dir = get_shard_dir(new_filename)
+    if shard_dir:
+        (upload_dir / shard_dir).mkdir(exist_ok=True, parents=True)
+    file_path = upload_dir / shard_dir / new_filename
     
     return file_path
 
 
+def get_layout():
+    """Get the configured on-disk layout: flat, hashed or date."""
+    return config["upload"].get("layout", "flat")
+
+
+def get_shard_dir(filename, layout=None, timestamp=None):
+    """
+    Get the directory (relative to the upload directory) a file belongs in.
+    - flat: everything in the upload directory itself
+    - hashed: two levels named after the hash of the filename, e.g. ab/cd
+    - date: year/month/day of the upload, e.g. 2025/03/14
+    """
+    if layout is None:
+        layout = get_layout()
+    
+    if layout == "hashed":
+        digest = hashlib.sha1(filename.encode()).hexdigest()
+        return os.path.join(digest[:2], digest[2:4])
+    
+    if layout == "date":
+        moment = datetime.fromtimestamp(timestamp) if timestamp is not None else datetime.now()
+        return moment.strftime("%Y/%m/%d")
+    
+    return ""
+
+
+def resolve_file_path(filename, record=None):
+    """
+    Find an uploaded file on disk by its name, whatever layout it is stored in.
+    Checks the path recorded in the file index first, then the hashed, date
+    and flat locations so files keep resolving while a layout migration is
+    running (it moves a file before it records the new path).
+    Returns None if the file does not exist.
+    """
+    # Only plain file names are accepted, never paths
+    if not filename or filename.startswith('.') or os.sep in filename or (os.altsep and os.altsep in filename):
+        return None
+    
+    upload_dir = Path(config["upload"]["directory"])
+    
+    if record is None:
+        record = get_metadata_store().get_file(filename)
+    
+    candidates = []
+    if record and record.get("path"):
+        candidates.append(upload_dir / record["path"])
+    candidates.append(upload_dir / get_shard_dir(filename, "hashed") / filename)
+    if record and record.get("uploaded_at") is not None:
+        # The date layout places files by upload time, as the migration does
+        candidates.append(upload_dir / get_shard_dir(filename, "date", record["uploaded_at"]) / filename)
+    candidates.append(upload_dir / filename)
+    
+    for candidate in candidates:
+        if candidate.is_file():
+            return candidate
+    
+    return None
+
+
+def get_incoming_dir():
+    """
+    Get the directory uploads are written to until they are complete.
+    It is hidden inside the upload directory, so finished files can be
+    moved into place atomically and partial ones are never listed.
+    """
+    incoming_dir = Path(config["upload"]["directory"]) / ".incoming"
+    incoming_dir.mkdir(exist_ok=True, parents=True)
+    return incoming_dir
+
+
+def get_incoming_path():
+    """Get a unique temporary path for an upload in progress."""
+    return get_incoming_dir() / f"{uuid.uuid4().hex}.part"
+
+
+def clean_incoming_dir(max_age_seconds):
+    """
+    Delete uploads left behind in the incoming directory by a crash or a killed process.
+    Only files untouched for max_age_seconds are removed, so uploads still being
+    written by other worker processes survive. Returns the number removed.
+    """
+    removed = 0
+    cutoff = datetime.now().timestamp() - max_age_seconds
+    for entry in os.scandir(get_incoming_dir()):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    
+    if removed:
+        logger.info(f"Removed {removed} orphaned partial upload(s) from {get_incoming_dir()}")
+    return removed
+
+
+def get_relative_path(file_path):
+    """
+    Get a file's location relative to the upload directory, as stored in the
+    file index. Returns None for files stored flat in the upload directory.
+    """
+    relative = Path(file_path).relative_to(config["upload"]["directory"])
+    return str(relative) if relative.parent != Path(".") else None
+
+
+def try_lock(lock_path):
+    """
+    Take a non-blocking exclusive lock on a file, used to elect a single worker
+    process for background tasks. Returns the open lock file (keep it open to
+    hold the lock) or None if another process holds it.
+    """
+    lock_file = open(lock_path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    
+    return lock_file
+
+
 def get_disk_usage(path=None):
     """
     Get disk usage information for a path.
@@ -0,0 +1,99 @@
+import base64
+import binascii
+import hashlib
+from typing import Dict, Mapping, Optional
+
+from fastapi import HTTPException
+
+# Digest algorithms accepted from clients: HTTP names (RFC 9530 / RFC 3230) -> hashlib names
+DIGEST_ALGORITHMS = {"sha-256": "sha256", "sha-512": "sha512", "md5": "md5"}
+
+# File part headers that carry a digest of the uploaded file
+DIGEST_HEADERS = ("Content-Digest", "Repr-Digest", "Digest")
+
+
+def _decode_digest(value: str, name: str, header: str) -> bytes:
+    # RFC 9530 wraps the value in colons (a structured field byte sequence); RFC 3230 doesn't
+    value = value.split(";")[0].strip()
+    if len(value) >= 2 and value[0] == ":" and value[-1] == ":":
+        value = value[1:-1]
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        digest = b""
+    if len(digest) != hashlib.new(name).digest_size:
+        raise HTTPException(status_code=400, detail=f"Malformed {header} header")
+    return digest
+
+
+def parse_expected_digests(*header_sets: Mapping[str, str]) -> Dict[str, bytes]:
+    """
+    Collect the digests a client sent for an uploaded file, from
+    Content-Digest, Repr-Digest, Digest and Content-MD5 headers
+    (case-insensitive header mappings, e.g. starlette's Headers).
+    Later header sets (e.g. the file part's own headers) take precedence.
+    Returns hashlib name -> expected digest; unsupported algorithms are
+    ignored, malformed values are rejected with 400.
+    """
+    expected = {}
+    for headers in header_sets:
+        for header in DIGEST_HEADERS:
+            value = headers.get(header)
+            if not value:
+                continue
+            for member in value.split(","):
+                algorithm, _, encoded = member.strip().partition("=")
+                name = DIGEST_ALGORITHMS.get(algorithm.strip().lower())
+                if name is not None:
+                    expected[name] = _decode_digest(encoded, name, header)
+
+        md5 = headers.get("Content-MD5")
+        if md5:
+            expected["md5"] = _decode_digest(md5, "md5", "Content-MD5")
+
+    return expected
+
+
+class UploadDigest:
+    """
+    Hashes an upload as it streams in: always SHA-256 (stored in the file
+    index), plus every algorithm the client sent a digest for.
+    """
+
+    def __init__(self, expected: Optional[Dict[str, bytes]] = None):
+        self.expected = expected or {}
+        self.hashes = {name: hashlib.new(name) for name in {"sha256", *self.expected}}
+
+    def update(self, data: bytes):
+        for digest in self.hashes.values():
+            digest.update(data)
+
+    @property
+    def sha256(self) -> str:
+        return self.hashes["sha256"].hexdigest()
+
+    def verify(self):
+        """Reject the upload with 400 if it doesn't match a digest the client sent."""
+        for name, digest in self.expected.items():
+            if self.hashes[name].digest() != digest:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Content digest mismatch ({name}): the file was corrupted in transit"
+                )
+
+
+def digest_headers(sha256: Optional[str]) -> Dict[str, str]:
+    """
+    Response headers for a file's stored SHA-256: a strong ETag, and the
+    digest of the whole file as Repr-Digest (RFC 9530) and Digest (RFC 3230).
+    Both describe the full file, so they are also valid on 206 responses.
+    """
+    if not sha256:
+        return {}
+
+    encoded = base64.b64encode(bytes.fromhex(sha256)).decode()
+    return {
+        "ETag": f'"{sha256}"',
+        "Repr-Digest": f"sha-256=:{encoded}:",
+        "Digest": f"SHA-256={encoded}",
+    }
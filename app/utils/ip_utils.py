@@ -1,12 +1,23 @@
 import yaml
 import re
-import requests
-from app.utils.config import get_config
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.config import get_config, get_settings
 from app.utils.logging_utils import get_logger
 
 logger = get_logger(__name__)
 config = get_config()
 
+# Compiled whitelist, with the configuration snapshot it was built for
+_matcher = None
+_matcher_settings = None
+
+# ipinfo.io lookups by IP address: ip -> (expires at, info)
+_ip_info_cache = OrderedDict()
+_ip_info_lock = threading.Lock()
+
 
 def load_ip_whitelist():
     """Load IP whitelist from configuration file."""
@@ -19,28 +30,58 @@ def load_ip_whitelist():
         return {"enabled": False, "whitelist": []}
 
 
+class IPMatcher:
+    """
+    IP whitelist compiled for lookups: exact addresses go in a set and
+    all wildcard patterns into a single regular expression.
+    """
+
+    def __init__(self, enabled, whitelist):
+        self.enabled = bool(enabled)
+        entries = [str(entry) for entry in whitelist or []]
+        self.addresses = frozenset(entry for entry in entries if "*" not in entry)
+        patterns = [
+            entry.replace(".", "\\.").replace("*", ".*")
+            for entry in entries if "*" in entry
+        ]
+        self.pattern = re.compile(f"^(?:{'|'.join(patterns)})$") if patterns else None
+
+    def matches(self, ip_address):
+        if ip_address in self.addresses:
+            return True
+        return self.pattern is not None and self.pattern.match(ip_address) is not None
+
+
+def get_ip_matcher():
+    """
+    Get the compiled IP whitelist.
+    The whitelist file is read once per loaded configuration, and again
+    after each reload, instead of on every request.
+    """
+    global _matcher, _matcher_settings
+
+    settings = get_settings()
+    if _matcher is None or _matcher_settings is not settings:
+        whitelist_config = load_ip_whitelist() or {}
+        _matcher = IPMatcher(whitelist_config.get("enabled", False), whitelist_config.get("whitelist"))
+        _matcher_settings = settings
+
+    return _matcher
+
+
 def is_ip_allowed(ip_address):
     """
     Check if an IP address is allowed based on the whitelist.
     If whitelist is disabled, all IPs are allowed.
     """
-    whitelist_config = load_ip_whitelist()
+    matcher = get_ip_matcher()
     
     # If whitelist is not enabled, all IPs are allowed
-    if not whitelist_config["enabled"]:
+    if not matcher.enabled:
         return True
     
-    # Check if IP is in whitelist
-    for allowed_ip in whitelist_config["whitelist"]:
-        # If it's an exact match
-        if allowed_ip == ip_address:
-            return True
-        
-        # If it's a wildcard pattern
-        if "*" in allowed_ip:
-            pattern = allowed_ip.replace(".", "\\.").replace("*", ".*")
-            if re.match(f"^{pattern}$", ip_address):
-                return True
+    if matcher.matches(ip_address):
+        return True
     
     # IP not found in whitelist
     logger.warning(f"IP address not in whitelist: {ip_address}")
@@ -51,6 +92,7 @@ def get_ip_info(ip_address):
     """
     Get information about an IP address using ipinfo.io.
     Returns a dict with information or None on failure.
+    Results are cached, failed lookups for a shorter time.
     """
     # Don't try to look up local addresses
     if ip_address in ["localhost", "127.0.0.1", "::1"]:
@@ -64,12 +106,36 @@ def get_ip_info(ip_address):
             "org": "Local Network"
         }
     
+    cache_config = config.get("cache", {})
+    now = time.monotonic()
+    with _ip_info_lock:
+        cached = _ip_info_cache.get(ip_address)
+        if cached and cached[0] > now:
+            _ip_info_cache.move_to_end(ip_address)
+            return cached[1]
+    
+    # Only needed for lookups, so it isn't loaded at startup
+    import requests
+
+    info = None
     try:
         response = requests.get(f"https://ipinfo.io/{ip_address}/json", timeout=3)
         if response.status_code == 200:
-            return response.json()
+            info = response.json()
     except Exception as e:
         logger.error(f"Failed to get IP info for {ip_address}: {str(e)}")
     
-    # Return minimal info if lookup fails
-    return {"ip": ip_address}
+    if info is None:
+        # Return minimal info if lookup fails
+        info = {"ip": ip_address}
+        max_age = cache_config.get("ip_info_failure_seconds", 300)
+    else:
+        max_age = cache_config.get("ip_info_seconds", 3600)
+    
+    with _ip_info_lock:
+        _ip_info_cache[ip_address] = (time.monotonic() + max_age, info)
+        _ip_info_cache.move_to_end(ip_address)
+        while len(_ip_info_cache) > cache_config.get("ip_info_max_entries", 10000):
+            _ip_info_cache.popitem(last=False)
+    
+    return info
@@ -0,0 +1,494 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.utils.config import get_config
+from app.utils.content_sniff import SNIFF_BYTES, sniff_mime_type
+from app.utils.file_utils import resolve_file_path
+from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
+from app.utils.storage import get_storage
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Global job queue instance
+_queue = None
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        file TEXT NOT NULL,
+        payload TEXT NOT NULL DEFAULT '{}',
+        priority INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        run_after REAL NOT NULL,
+        locked_until REAL,
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority DESC, run_after, id)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_file ON jobs (file)",
+]
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def get_job_queue():
+    """
+    Get the post-upload job queue.
+    Uses singleton pattern so every module shares the same queue.
+    """
+    global _queue
+
+    if _queue is None:
+        jobs_config = config.get("jobs", {})
+        db_path = jobs_config.get("db") or os.path.join(config["upload"]["directory"], ".jobs.db")
+        _queue = JobQueue(
+            db_path,
+            lease_seconds=jobs_config.get("lease_seconds", 300),
+            retry_backoff_seconds=jobs_config.get("retry_backoff_seconds", 10)
+        )
+
+    return _queue
+
+
+class JobQueue:
+    """
+    Durable job queue in SQLite.
+    Jobs are claimed with a lease: a worker that dies mid-job (or a
+    restart) leaves the job to be picked up again once the lease runs
+    out, so queued work is never lost. Several worker processes can
+    share one queue.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, retry_backoff_seconds=10):
+        self.db_path = str(db_path)
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff_seconds
+        Path(self.db_path).parent.mkdir(exist_ok=True, parents=True)
+        self._local = threading.local()
+
+        with self._transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self):
+        """Get the SQLite connection for the current thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in a single write transaction."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def enqueue(self, kind: str, file: str, payload: Optional[Dict] = None,
+                priority: int = 0, max_attempts: int = 3) -> int:
+        """Add a job; higher priorities run first. Returns the job id."""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, file, payload, priority, max_attempts, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, file, json.dumps(payload or {}), priority, max_attempts, now, now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Take the next runnable job, or one whose lease has expired.
+        A job whose lease expired on its last attempt (e.g. it keeps
+        crashing its worker) is failed instead of being run again.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            abandoned = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, locked_until = NULL, updated_at = ? "
+                "WHERE status = ? AND locked_until < ? AND attempts >= max_attempts",
+                (FAILED, "Lease expired on the last attempt", now, RUNNING, now)
+            ).rowcount
+            if abandoned:
+                logger.warning(f"Failed {abandoned} jobs whose lease expired on their last attempt")
+
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND run_after <= ? "
+                "ORDER BY priority DESC, run_after, id LIMIT 1",
+                (QUEUED, now)
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND locked_until < ? AND attempts < max_attempts "
+                    "ORDER BY priority DESC, id LIMIT 1",
+                    (RUNNING, now)
+                ).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, now + self.lease_seconds, now, row["id"])
+            )
+
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def extend_lease(self, job_id: int):
+        """Keep a running job's lease from expiring while it is still being worked on."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET locked_until = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (now + self.lease_seconds, now, job_id, RUNNING)
+            )
+
+    def complete(self, job_id: int, result: Dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, locked_until = NULL, updated_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job: Dict, error: str, retry: bool = True):
+        """Record a failed attempt; the job is retried with exponential backoff until it runs out of attempts."""
+        now = time.time()
+        if retry and job["attempts"] < job["max_attempts"]:
+            status, run_after = QUEUED, now + self.retry_backoff * 2 ** (job["attempts"] - 1)
+        else:
+            status, run_after = FAILED, job["run_after"]
+
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, run_after = ?, error = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+                (status, run_after, error, now, job["id"])
+            )
+
+    def get_jobs(self, file: str) -> List[Dict]:
+        """Get every job for a file, newest first."""
+        rows = self._connect().execute(
+            "SELECT id, kind, status, priority, attempts, max_attempts, result, error, created_at, updated_at "
+            "FROM jobs WHERE file = ? ORDER BY id DESC",
+            (file,)
+        )
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            jobs.append(job)
+        return jobs
+
+    def get_result(self, file: str, kind: str) -> Optional[Dict]:
+        """Get the result of the latest successful job of a kind for a file."""
+        row = self._connect().execute(
+            "SELECT result FROM jobs WHERE file = ? AND kind = ? AND status = ? ORDER BY id DESC LIMIT 1",
+            (file, kind, DONE)
+        ).fetchone()
+        return json.loads(row["result"]) if row else None
+
+    def forget_file(self, file: str) -> int:
+        """Drop all jobs of a deleted file."""
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM jobs WHERE file = ?", (file,)).rowcount
+
+    def forget_files(self, files: List[str]) -> int:
+        """Drop all jobs of many deleted files in one transaction."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE file IN (SELECT value FROM json_each(?))", (json.dumps(files),)
+            ).rowcount
+
+    def purge_finished(self, older_than_seconds: float) -> int:
+        """Remove finished and failed jobs last updated before the cut-off."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - older_than_seconds)
+            ).rowcount
+
+    def counts(self) -> Dict:
+        """Number of jobs in each state."""
+        rows = self._connect().execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
+
+
+# Job handlers. They only compute from the file on disk and run in the
+# worker pool (possibly in another process); results are applied to the
+# file index by the dispatcher.
+
+def compute_checksum(path: str, payload: Dict) -> Dict:
+    """SHA-256 of the file."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return {"sha256": digest.hexdigest(), "size": size}
+
+
+def compute_content_type(path: str, payload: Dict) -> Dict:
+    """MIME type detected from the file's magic bytes."""
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    return {"content_type": sniff_mime_type(head)}
+
+
+def compute_text_preview(path: str, payload: Dict) -> Dict:
+    """The first lines of a text file, ready for the preview page."""
+    max_lines = payload.get("max_lines", 500)
+    max_bytes = payload.get("max_bytes", 1024 * 1024)
+    lines = []
+    size = 0
+    truncated = False
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for i, line in enumerate(f):
+            if i >= max_lines or size + len(line) > max_bytes:
+                truncated = True
+                break
+            lines.append(line)
+            size += len(line)
+    return {"text": "".join(lines), "truncated": truncated, "max_lines": max_lines}
+
+
+def _apply_checksum(file: str, result: Dict):
+    get_metadata_store().update_file(file, sha256=result["sha256"])
+
+
+def _apply_content_type(file: str, result: Dict):
+    if result["content_type"]:
+        get_metadata_store().update_file(file, content_type=result["content_type"])
+
+
+# kind -> (handler run in the pool, function applying the result in the app process)
+HANDLERS: Dict[str, tuple] = {
+    "checksum": (compute_checksum, _apply_checksum),
+    "sniff": (compute_content_type, _apply_content_type),
+    "preview": (compute_text_preview, None),
+}
+
+# Priorities of the jobs enqueued after an upload; higher runs first.
+# The content type is detected while the upload streams in; "sniff" jobs
+# are only needed for files that arrived some other way.
+POST_UPLOAD_JOBS = [
+    ("checksum", 10),
+    ("preview", 0),
+]
+
+
+def enqueue_post_upload(file: str, previewable_text: bool = False, checksum: bool = True):
+    """Queue the processing every new upload gets; checksum=False when it was computed during the upload."""
+    jobs_config = config.get("jobs", {})
+    if not jobs_config.get("enabled", True):
+        return
+
+    queue = get_job_queue()
+    max_attempts = jobs_config.get("max_attempts", 3)
+    for kind, priority in POST_UPLOAD_JOBS:
+        payload = {}
+        if kind == "checksum" and not checksum:
+            continue
+        if kind == "preview":
+            if not previewable_text:
+                continue
+            payload = {
+                "max_lines": config["download"].get("text_preview_max_lines", 500),
+                "max_bytes": config["download"].get("text_preview_max_size_kb", 1024) * 1024,
+            }
+        queue.enqueue(kind, file, payload, priority=priority, max_attempts=max_attempts)
+
+    if _pool is not None:
+        _pool.wake()
+
+
+def locate_file(file: str) -> Optional[Path]:
+    """Find a job's file on local disk, fetching it from the object store if needed. Blocking."""
+    record = get_metadata_store().get_file(file)
+    path = resolve_file_path(file, record)
+    if path is None and get_storage().is_remote_only(record):
+        path = get_storage().ensure_local(file, record)
+    return path
+
+
+def run_handler(kind: str, path: str, payload: Dict) -> Dict:
+    """Entry point for the worker pool; must stay a module-level function so processes can run it."""
+    return HANDLERS[kind][0](path, payload)
+
+
+# The worker pool of this process, if started
+_pool = None
+
+
+class JobWorkerPool:
+    """
+    Runs queued jobs on a thread or process pool.
+    A dispatcher task on the event loop claims jobs, hands them to the
+    pool and records the outcome; missing files fail without retrying.
+    """
+
+    def __init__(self, queue: JobQueue, workers=2, mode="thread", poll_interval_seconds=2,
+                 keep_finished_days=7):
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.poll_interval = poll_interval_seconds
+        self.keep_finished_seconds = keep_finished_days * 86400
+        self.executor = None
+        self._wake = None
+        self._running = set()
+
+        # Counters exposed through stats()
+        self.completed_total = 0
+        self.failed_total = 0
+        self.retried_total = 0
+
+    def wake(self):
+        """Check the queue now instead of at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self):
+        global _pool
+
+        executor_class = ProcessPoolExecutor if self.mode == "process" else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=self.workers)
+        self._wake = asyncio.Event()
+        _pool = self
+        logger.info(f"Job worker pool started: {self.workers} {self.mode} worker(s)")
+
+        last_purge = 0.0
+        try:
+            while True:
+                while len(self._running) < self.workers:
+                    job = await asyncio.to_thread(self.queue.claim)
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run_job(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._job_finished)
+
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    purged = await asyncio.to_thread(self.queue.purge_finished, self.keep_finished_seconds)
+                    if purged:
+                        logger.info(f"Purged {purged} finished jobs")
+
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        finally:
+            _pool = None
+            for task in self._running:
+                task.cancel()
+            # Running jobs are picked up again after their lease expires
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _job_finished(self, task):
+        self._running.discard(task)
+        self.wake()
+
+    async def _run_job(self, job: Dict):
+        handler, apply = HANDLERS.get(job["kind"], (None, None))
+        if handler is None:
+            await asyncio.to_thread(self.queue.fail, job, f"Unknown job kind: {job['kind']}", False)
+            self.failed_total += 1
+            return
+
+        path = await asyncio.to_thread(locate_file, job["file"])
+        if path is None:
+            await asyncio.to_thread(self.queue.fail, job, "File not found", False)
+            self.failed_total += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            result = await loop.run_in_executor(self.executor, run_handler, job["kind"], str(path), job["payload"])
+            if apply is not None:
+                await asyncio.to_thread(apply, job["file"], result)
+            await asyncio.to_thread(self.queue.complete, job["id"], result)
+            self.completed_total += 1
+        except asyncio.CancelledError:
+            raise
+        except FileNotFoundError:
+            await asyncio.to_thread(self.queue.fail, job, "File not found", False)
+            self.failed_total += 1
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) for {job['file']} failed on attempt {job['attempts']}: {str(e)}")
+            await asyncio.to_thread(self.queue.fail, job, str(e))
+            if job["attempts"] < job["max_attempts"]:
+                self.retried_total += 1
+            else:
+                self.failed_total += 1
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job: Dict):
+        """Extend a job's lease while its handler runs, so long jobs aren't handed to another worker."""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.queue.extend_lease, job["id"])
+            except sqlite3.Error as e:
+                logger.error(f"Failed to extend the lease of job {job['id']}: {str(e)}")
+
+    def stats(self) -> Dict:
+        """Worker pool and queue metrics."""
+        return {
+            "workers": self.workers,
+            "mode": self.mode,
+            "running": len(self._running),
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total,
+            "retried_total": self.retried_total,
+            "jobs": self.queue.counts(),
+        }
+
+
+def create_worker_pool() -> JobWorkerPool:
+    """Build the worker pool from the configuration."""
+    jobs_config = config.get("jobs", {})
+    return JobWorkerPool(
+        get_job_queue(),
+        workers=jobs_config.get("workers", 2),
+        mode=jobs_config.get("mode", "thread"),
+        poll_interval_seconds=jobs_config.get("poll_interval_seconds", 2),
+        keep_finished_days=jobs_config.get("keep_finished_days", 7)
+    )
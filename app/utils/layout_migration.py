@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+from app.utils.config import get_config
+from app.utils.file_utils import get_layout, get_shard_dir, try_lock
+from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
+
+logger = get_logger(__name__)
+config = get_config()
+
+
+class LayoutMigrator:
+    """
+    Moves files from the flat upload directory into the configured sharded layout.
+    Each file is moved with a single atomic rename and its new location is
+    recorded in the file index, so the app keeps serving files while the
+    migration runs. The migration is resumable by construction: whatever is
+    still in the top-level directory is what is left to do. Moves are
+    throttled to a number of files per second.
+    """
+
+    def __init__(self, store, upload_dir, layout=None, files_per_second=50, batch_size=100):
+        self.store = store
+        self.upload_dir = Path(upload_dir)
+        self.layout = layout or get_layout()
+        self.files_per_second = files_per_second
+        self.batch_size = batch_size
+
+        self.running = False
+        self.moved = 0
+        self.skipped = set()
+        self.errors = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def migrate_batch(self) -> int:
+        """
+        Move up to batch_size flat files into their shard directories.
+        Returns the number of files looked at, 0 once nothing is left.
+        """
+        batch = []
+        with os.scandir(self.upload_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name in self.skipped or not entry.is_file():
+                    continue
+                batch.append(entry.name)
+                if len(batch) >= self.batch_size:
+                    break
+
+        moved = 0
+        for name in batch:
+            if self._move(name):
+                moved += 1
+            else:
+                self.skipped.add(name)
+
+        self.moved += moved
+        return len(batch)
+
+    def _move(self, name: str) -> bool:
+        """Move one file into its shard directory."""
+        source = self.upload_dir / name
+        record = self.store.get_file(name)
+
+        try:
+            timestamp = record["uploaded_at"] if record else source.stat().st_mtime
+            shard_dir = get_shard_dir(name, self.layout, timestamp)
+            target = self.upload_dir / shard_dir / name
+
+            if target.exists():
+                logger.warning(f"Layout migration skipped {name}: {target} already exists")
+                return False
+
+            target.parent.mkdir(exist_ok=True, parents=True)
+            os.rename(source, target)
+        except FileNotFoundError:
+            # Deleted while we were looking at it
+            return False
+        except OSError as e:
+            self.errors += 1
+            logger.error(f"Layout migration failed to move {name}: {str(e)}")
+            return False
+
+        self.store.set_path(name, os.path.join(shard_dir, name))
+        return True
+
+    async def run(self):
+        """Migrate the whole directory in throttled batches without blocking the event loop."""
+        self._start()
+        try:
+            while True:
+                batch_started = time.monotonic()
+                processed = await asyncio.to_thread(self.migrate_batch)
+                if not processed:
+                    break
+                await asyncio.sleep(self._throttle_delay(processed, batch_started))
+        finally:
+            self._finish()
+
+    def run_sync(self):
+        """Migrate the whole directory from the command line."""
+        self._start()
+        try:
+            while True:
+                batch_started = time.monotonic()
+                processed = self.migrate_batch()
+                if not processed:
+                    break
+                logger.info(f"Layout migration progress: {self.moved} files moved")
+                time.sleep(self._throttle_delay(processed, batch_started))
+        finally:
+            self._finish()
+
+    def _throttle_delay(self, processed: int, batch_started: float) -> float:
+        """Seconds to wait so the migration stays under files_per_second."""
+        if not self.files_per_second:
+            return 0
+        return max(0.0, processed / self.files_per_second - (time.monotonic() - batch_started))
+
+    def _start(self):
+        self.running = True
+        self.started_at = time.time()
+        self.finished_at = None
+        logger.info(f"Layout migration to '{self.layout}' layout started in {self.upload_dir}")
+
+    def _finish(self):
+        self.running = False
+        self.finished_at = time.time()
+        logger.info(
+            f"Layout migration finished: {self.moved} files moved, "
+            f"{len(self.skipped)} skipped, {self.errors} errors"
+        )
+
+    def stats(self) -> Dict:
+        """Migration progress."""
+        return {
+            "layout": self.layout,
+            "running": self.running,
+            "moved": self.moved,
+            "skipped": len(self.skipped),
+            "errors": self.errors,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def create_migrator() -> LayoutMigrator:
+    """Build a migrator from the configured layout settings."""
+    migration_config = config["upload"].get("layout_migration", {})
+    return LayoutMigrator(
+        get_metadata_store(),
+        config["upload"]["directory"],
+        files_per_second=migration_config.get("files_per_second", 50),
+        batch_size=migration_config.get("batch_size", 100)
+    )
+
+
+def main():
+    """Command line entry point: python -m app.utils.layout_migration"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move flat uploads into the configured sharded layout.")
+    parser.add_argument("--files-per-second", type=float, help="Throttle for file moves (0 = unthrottled)")
+    args = parser.parse_args()
+
+    migrator = create_migrator()
+    if migrator.layout == "flat":
+        parser.error("upload.layout is 'flat', set it to 'hashed' or 'date' first")
+    if args.files_per_second is not None:
+        migrator.files_per_second = args.files_per_second
+
+    lock = try_lock(f"{migrator.store.db_path}.migration.lock")
+    if lock is None:
+        parser.error("another layout migration is already running")
+
+    migrator.run_sync()
+
+
+if __name__ == "__main__":
+    main()
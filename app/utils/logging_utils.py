@@ -1,86 +1,252 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from app.utils.config import get_config
 
 # Store loggers by name to avoid duplicate setup
 _loggers = {}
 
+# The single queue-backed pipeline shared by every logger
+_queue_handler = None
+_listener = None
+
+# The append-only audit stream
+_audit_logger = None
+_audit_listener = None
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects (JSON lines)."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        # Include structured fields passed with `extra`
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class SamplingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+    Once the queue is past its high-water mark, only a sample of records
+    below WARNING is kept; when the queue is full, records are dropped.
+    """
+
+    def __init__(self, log_queue, sample_rate=1.0, high_water=None):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+        self.high_water = high_water
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def enqueue(self, record):
+        if (self.high_water is not None and record.levelno < logging.WARNING
+                and self.queue.qsize() >= self.high_water and random.random() >= self.sample_rate):
+            self.sampled_out += 1
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Render the message and traceback now, but keep `extra` fields for the JSON formatter
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _get_log_config():
+    """Get the logging section of the configuration, or defaults if it can't be loaded."""
+    try:
+        return get_config()["logging"]
+    except Exception as e:
+        print(f"Error loading logging config: {str(e)}")
+        return {
+            "level": "INFO",
+            "file": "logs/server.log",
+            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        }
+
+
+def _create_file_handler(log_config):
+    """Create the one file sink for the application log."""
+    log_file = log_config["file"]
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+
+    if log_config.get("rotation", False):
+        max_bytes = log_config.get("max_size_mb", 10) * 1024 * 1024
+        backup_count = log_config.get("backup_count", 5)
+        return RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+
+    return logging.FileHandler(log_file)
+
+
+def _get_pipeline():
+    """
+    Build the logging pipeline on first use.
+    Loggers only put records on a bounded queue; a single listener thread
+    writes them to the console and one file sink, so request handlers never
+    wait on disk I/O.
+    """
+    global _queue_handler, _listener
+
+    if _queue_handler is not None:
+        return _queue_handler
+
+    log_config = _get_log_config()
+    text_formatter = logging.Formatter(log_config.get("format", "%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(text_formatter)
+
+    handlers = [console_handler]
+    try:
+        file_handler = _create_file_handler(log_config)
+        file_handler.setFormatter(JsonFormatter() if log_config.get("json", True) else text_formatter)
+        handlers.append(file_handler)
+    except Exception as e:
+        print(f"Error setting up log file: {str(e)}")
+
+    queue_size = log_config.get("queue_size", 10000)
+    high_water = int(queue_size * log_config.get("high_water_percent", 80) / 100)
+    _queue_handler = SamplingQueueHandler(
+        queue.Queue(maxsize=queue_size),
+        sample_rate=log_config.get("sample_rate", 0.1),
+        high_water=high_water
+    )
+
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    return _queue_handler
+
 
 def get_logger(name=None):
     """Get a configured logger by name."""
     global _loggers
-    
+
     if name is None:
         name = __name__
-        
+
     if name in _loggers:
         return _loggers[name]
-    
-    # Create new logger
-    logger = logging.getLogger(name)
-    
-    # Avoid adding duplicate handlers
-    if not logger.handlers:
-        setup_logger(logger, name)
-        
+
+    logger = setup_logger(name=name)
+
     _loggers[name] = logger
     return logger
 
 
 def setup_logger(logger=None, name=None):
     """
-    Configure a logger with settings from config.
-    If logger is None, the root logger is configured.
+    Attach a logger to the shared logging pipeline with settings from config.
+    If logger is None, the application logger is configured.
     """
     if logger is None:
         logger = logging.getLogger(name if name else "upload_server")
-        
-    try:
-        config = get_config()
-        log_config = config["logging"]
-        
-        # Set log level
-        level = getattr(logging, log_config["level"])
-        logger.setLevel(level)
-        
-        # Create formatter
-        formatter = logging.Formatter(log_config["format"])
-        
-        # Add console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        
-        # Add file handler
-        log_file = log_config["file"]
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        
-        if log_config.get("rotation", False):
-            max_bytes = log_config.get("max_size_mb", 10) * 1024 * 1024
-            backup_count = log_config.get("backup_count", 5)
-            
-            file_handler = RotatingFileHandler(
-                log_file,
-                maxBytes=max_bytes,
-                backupCount=backup_count
-            )
-        else:
-            file_handler = logging.FileHandler(log_file)
-            
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        
-    except Exception as e:
-        # If we can't load config, set up a basic logger
-        print(f"Error setting up logger: {str(e)}")
-        logger.setLevel(logging.INFO)
-        
-        # Add console handler
-        if not logger.handlers:
-            console_handler = logging.StreamHandler()
-            console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-            logger.addHandler(console_handler)
-            
+
+    log_config = _get_log_config()
+    logger.setLevel(getattr(logging, log_config.get("level", "INFO"), logging.INFO))
+
+    handler = _get_pipeline()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+
+    # Records go through the pipeline exactly once
+    logger.propagate = False
+
     return logger
+
+
+def set_log_level(level):
+    """Change the level of every configured logger, e.g. after a configuration reload."""
+    level = getattr(logging, level, logging.INFO)
+    for logger in [logging.getLogger("upload_server"), *_loggers.values()]:
+        logger.setLevel(level)
+
+
+def get_logging_stats():
+    """Get queue depth and the number of records dropped under load."""
+    handler = _get_pipeline()
+    return {
+        "queue_depth": handler.queue.qsize(),
+        "dropped": handler.dropped,
+        "sampled_out": handler.sampled_out
+    }
+
+
+def get_audit_logger():
+    """
+    Get the audit logger.
+    Audit events go to their own append-only JSON lines file through an
+    unbounded queue, so they are never sampled or dropped.
+    """
+    global _audit_logger, _audit_listener
+
+    if _audit_logger is not None:
+        return _audit_logger
+
+    log_config = _get_log_config()
+    audit_file = log_config.get("audit_file", "logs/audit.log")
+    os.makedirs(os.path.dirname(audit_file) or ".", exist_ok=True)
+
+    file_handler = logging.FileHandler(audit_file, mode="a")
+    file_handler.setFormatter(JsonFormatter())
+
+    audit_queue = queue.Queue()
+    _audit_listener = QueueListener(audit_queue, file_handler)
+    _audit_listener.start()
+    atexit.register(_audit_listener.stop)
+
+    _audit_logger = logging.getLogger("audit")
+    _audit_logger.setLevel(logging.INFO)
+    _audit_logger.addHandler(QueueHandler(audit_queue))
+    _audit_logger.propagate = False
+
+    return _audit_logger
+
+
+def _restart_listeners():
+    # Threads do not survive fork(): a worker forked from a process that
+    # already logged (e.g. a gunicorn master) needs its own writer threads
+    for listener in (_listener, _audit_listener):
+        if listener is not None:
+            listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_listeners)
+
+
+def audit_event(action, **fields):
+    """Record an audit event, e.g. audit_event("upload", user="admin", file="report.pdf")."""
+    get_audit_logger().info(action, extra={"action": action, **fields})
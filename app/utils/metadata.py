@@ -0,0 +1,626 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Global metadata store instance
+_store = None
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL DEFAULT '',
+        size INTEGER NOT NULL DEFAULT 0,
+        uploaded_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_files_owner ON files (owner)",
+    """
+    CREATE TABLE IF NOT EXISTS usage (
+        owner TEXT PRIMARY KEY,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        files INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Bumped whenever the file listing changes, so rendered listings can be cached by version
+    """
+    CREATE TABLE IF NOT EXISTS listing_version (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        version INTEGER NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO listing_version (id, version) VALUES (0, 0)",
+    # Downloads of share links with a download limit, kept until the link expires
+    """
+    CREATE TABLE IF NOT EXISTS share_downloads (
+        link_id TEXT PRIMARY KEY,
+        downloads INTEGER NOT NULL DEFAULT 0,
+        expires_at REAL NOT NULL
+    )
+    """,
+    # Bulk admin operations and their progress, visible to every worker process
+    """
+    CREATE TABLE IF NOT EXISTS bulk_operations (
+        id TEXT PRIMARY KEY,
+        action TEXT NOT NULL,
+        criteria TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_by TEXT NOT NULL DEFAULT '',
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        updated_at REAL NOT NULL,
+        pid INTEGER,
+        total_files INTEGER NOT NULL DEFAULT 0,
+        total_bytes INTEGER NOT NULL DEFAULT 0,
+        processed_files INTEGER NOT NULL DEFAULT 0,
+        processed_bytes INTEGER NOT NULL DEFAULT 0,
+        errors INTEGER NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_bulk_operations_created_at ON bulk_operations (created_at)",
+]
+
+# Largest number of names bound into one IN (...) query
+_NAMES_PER_QUERY = 500
+
+# Columns added after the first release, applied to existing databases on open
+_COLUMNS = {
+    "files": [
+        ("ttl_expires_at", "REAL"),
+        ("expires_at", "REAL"),
+        # Location relative to the upload directory, NULL for the flat layout
+        ("path", "TEXT"),
+        # Filled in by post-upload processing
+        ("sha256", "TEXT"),
+        ("content_type", "TEXT"),
+        # Where the file is stored: a copy in the upload directory and/or in the object store
+        ("local", "INTEGER NOT NULL DEFAULT 1"),
+        ("remote", "INTEGER NOT NULL DEFAULT 0"),
+        # Last download or upload, for evicting local copies least recently used first
+        ("accessed_at", "REAL"),
+    ],
+}
+
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_files_expires_at ON files (expires_at, name) WHERE expires_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_files_uploaded_at ON files (uploaded_at, name)",
+    "CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256) WHERE sha256 IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_files_local_accessed ON files (accessed_at, name) WHERE local = 1",
+]
+
+# Fields that update_file() may set
+_UPDATABLE_FIELDS = {"sha256", "content_type"}
+
+# Keep the listing version current however the files table is changed
+_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS files_insert_listing_version AFTER INSERT ON files
+    BEGIN UPDATE listing_version SET version = version + 1; END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_delete_listing_version AFTER DELETE ON files
+    BEGIN UPDATE listing_version SET version = version + 1; END
+    """,
+    # Recreated so databases from older versions pick up new listed columns
+    "DROP TRIGGER IF EXISTS files_update_listing_version",
+    """
+    CREATE TRIGGER files_update_listing_version AFTER UPDATE OF name, size, uploaded_at, content_type ON files
+    BEGIN UPDATE listing_version SET version = version + 1; END
+    """,
+]
+
+
+def get_metadata_store():
+    """
+    Get the file metadata store.
+    Uses singleton pattern so every module shares the same store.
+    """
+    global _store
+
+    if _store is None:
+        upload_dir = config["upload"]["directory"]
+        db_path = config["upload"].get("metadata_db") or os.path.join(upload_dir, ".metadata.db")
+        _store = FileMetadataStore(db_path)
+
+    return _store
+
+
+class QuotaExceededError(Exception):
+    """Recording a file would take its owner over their storage quota."""
+
+
+class FileMetadataStore:
+    """
+    SQLite-backed index of uploaded files.
+    Tracks who uploaded each file and keeps per-user storage usage up to
+    date incrementally, so nothing has to scan the upload directory to
+    answer "how much does this user store?".
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(exist_ok=True, parents=True)
+        self._local = threading.local()
+
+        with self._transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._ensure_columns(conn)
+            for statement in _INDEXES + _TRIGGERS:
+                conn.execute(statement)
+
+    def _ensure_columns(self, conn):
+        """Add columns introduced by newer versions to an existing database."""
+        for table, columns in _COLUMNS.items():
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def _connect(self):
+        """Get the SQLite connection for the current thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in a single write transaction."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def add_file(self, name: str, owner: str, size: int, uploaded_at: Optional[float] = None,
+                 ttl_expires_at: Optional[float] = None, expires_at: Optional[float] = None,
+                 path: Optional[str] = None, content_type: Optional[str] = None, remote: bool = False,
+                 sha256: Optional[str] = None, quota: Optional[int] = None):
+        """
+        Record a new (or replaced) file and charge its size to the owner.
+        With a quota (bytes), raises QuotaExceededError instead if the
+        owner's usage would exceed it. Checked in the same transaction as
+        the charge, so concurrent uploads can't overshoot it together.
+        """
+        if uploaded_at is None:
+            uploaded_at = time.time()
+
+        with self._transaction() as conn:
+            previous = conn.execute("SELECT owner, size FROM files WHERE name = ?", (name,)).fetchone()
+            if previous:
+                self._charge(conn, previous["owner"], -previous["size"], -1)
+
+            if quota is not None:
+                row = conn.execute("SELECT bytes FROM usage WHERE owner = ?", (owner,)).fetchone()
+                used = row["bytes"] if row else 0
+                if used + size > quota:
+                    raise QuotaExceededError(f"{used} of {quota} bytes used, {size} more requested")
+
+            conn.execute(
+                "INSERT OR REPLACE INTO files (name, owner, size, uploaded_at, ttl_expires_at, expires_at, path, content_type, "
+                "local, remote, accessed_at, sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?)",
+                (name, owner, size, uploaded_at, ttl_expires_at, expires_at, path, content_type, int(remote), uploaded_at,
+                 sha256)
+            )
+            self._charge(conn, owner, size, 1)
+
+    def remove_file(self, name: str) -> Optional[Dict]:
+        """Forget a file and credit its size back to the owner. Returns the removed record."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM files WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+
+            conn.execute("DELETE FROM files WHERE name = ?", (name,))
+            self._charge(conn, row["owner"], -row["size"], -1)
+
+        return dict(row)
+
+    def remove_files(self, names: List[str]) -> List[Dict]:
+        """
+        Forget many files in one transaction, crediting their sizes back to
+        the owners with one usage update per owner. Returns the removed records.
+        """
+        removed = []
+        with self._transaction() as conn:
+            for i in range(0, len(names), _NAMES_PER_QUERY):
+                chunk = names[i:i + _NAMES_PER_QUERY]
+                placeholders = ", ".join("?" * len(chunk))
+                removed.extend(dict(row) for row in conn.execute(
+                    f"SELECT name, owner, size FROM files WHERE name IN ({placeholders})", chunk
+                ))
+                conn.execute(f"DELETE FROM files WHERE name IN ({placeholders})", chunk)
+
+            deltas: Dict[str, List[int]] = {}
+            for row in removed:
+                delta = deltas.setdefault(row["owner"], [0, 0])
+                delta[0] -= row["size"]
+                delta[1] -= 1
+            for owner, (size_delta, files_delta) in deltas.items():
+                self._charge(conn, owner, size_delta, files_delta)
+
+        return removed
+
+    def get_file(self, name: str) -> Optional[Dict]:
+        """Get the metadata record for a file."""
+        row = self._connect().execute("SELECT * FROM files WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def set_path(self, name: str, path: Optional[str]):
+        """Record where a file now lives relative to the upload directory."""
+        with self._transaction() as conn:
+            conn.execute("UPDATE files SET path = ? WHERE name = ?", (path, name))
+
+    def update_file(self, name: str, **fields):
+        """Set processing results on a file record, e.g. update_file(name, sha256=...)."""
+        unknown = set(fields) - _UPDATABLE_FIELDS
+        if unknown:
+            raise ValueError(f"Fields cannot be updated: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE files SET {assignments} WHERE name = ?", (*fields.values(), name))
+
+    def set_storage(self, name: str, local: Optional[bool] = None, remote: Optional[bool] = None,
+                    accessed_at: Optional[float] = None):
+        """Record whether a file has a local copy and/or is in the object store."""
+        assignments, values = [], []
+        for column, value in (("local", local), ("remote", remote)):
+            if value is not None:
+                assignments.append(f"{column} = ?")
+                values.append(int(value))
+        if accessed_at is not None:
+            assignments.append("accessed_at = ?")
+            values.append(accessed_at)
+        if not assignments:
+            return
+
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE files SET {', '.join(assignments)} WHERE name = ?", (*values, name))
+
+    def get_local_bytes(self) -> int:
+        """Get the size of all files with a copy in the upload directory."""
+        row = self._connect().execute("SELECT COALESCE(SUM(size), 0) AS total FROM files WHERE local = 1").fetchone()
+        return row["total"]
+
+    def get_least_recently_used(self, limit: int = 100) -> List[Dict]:
+        """Get files with a local copy, least recently used first."""
+        rows = self._connect().execute(
+            "SELECT name, path, size, remote, accessed_at FROM files WHERE local = 1 "
+            "ORDER BY accessed_at, name LIMIT ?",
+            (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def get_not_remote(self, uploaded_before: float, limit: int = 100) -> List[Dict]:
+        """Get local-only files uploaded before a time, oldest first."""
+        rows = self._connect().execute(
+            "SELECT name, path, size, remote, accessed_at FROM files WHERE remote = 0 AND local = 1 "
+            "AND uploaded_at < ? ORDER BY uploaded_at, name LIMIT ?",
+            (uploaded_before, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def count_files(self) -> int:
+        """Get the number of indexed files."""
+        return self._connect().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def list_files(self, offset: int = 0, limit: int = 20) -> List[Dict]:
+        """Get a page of indexed files, newest first."""
+        rows = self._connect().execute(
+            "SELECT * FROM files ORDER BY uploaded_at DESC, name DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        )
+        return [dict(row) for row in rows]
+
+    def find_by_checksum(self, checksums: List[Tuple[str, int]], owner: Optional[str] = None) -> List[Dict]:
+        """Get the files matching any of the (sha256, size) pairs, optionally only those of one owner."""
+        wanted = set(checksums)
+        found = []
+        conn = self._connect()
+        digests = sorted({sha256 for sha256, _ in wanted})
+        # Stay well below SQLite's limit on bound parameters
+        for i in range(0, len(digests), 500):
+            batch = digests[i:i + 500]
+            rows = conn.execute(
+                f"SELECT name, owner, size, sha256 FROM files WHERE sha256 IN ({', '.join('?' * len(batch))})",
+                batch
+            )
+            found.extend(
+                dict(row) for row in rows
+                if (row["sha256"], row["size"]) in wanted and (owner is None or row["owner"] == owner)
+            )
+        return found
+
+    @staticmethod
+    def _file_filter(criteria: Dict) -> Tuple[str, list]:
+        """
+        WHERE clause for bulk operation criteria: names (explicit list),
+        pattern (glob), owner, uploaded_before/uploaded_after (timestamps)
+        and min_size/max_size (bytes). Every given criterion must match.
+        """
+        conditions, params = [], []
+        if criteria.get("names") is not None:
+            conditions.append("name IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(criteria["names"]))
+        if criteria.get("pattern"):
+            conditions.append("name GLOB ?")
+            params.append(criteria["pattern"])
+        if criteria.get("owner") is not None:
+            conditions.append("owner = ?")
+            params.append(criteria["owner"])
+        for key, condition in (("uploaded_before", "uploaded_at < ?"), ("uploaded_after", "uploaded_at >= ?"),
+                               ("min_size", "size >= ?"), ("max_size", "size <= ?")):
+            if criteria.get(key) is not None:
+                conditions.append(condition)
+                params.append(criteria[key])
+        return " AND ".join(conditions) or "1", params
+
+    def count_matching(self, criteria: Dict) -> Dict:
+        """Count the files matching bulk operation criteria, and their total size."""
+        where, params = self._file_filter(criteria)
+        row = self._connect().execute(
+            f"SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes FROM files WHERE {where}", params
+        ).fetchone()
+        return {"files": row["files"], "bytes": row["bytes"]}
+
+    def find_matching(self, criteria: Dict, after: Optional[str] = None, limit: int = 500) -> List[Dict]:
+        """
+        Get files matching bulk operation criteria in name order.
+        `after` is the name of the last row of the previous page.
+        """
+        where, params = self._file_filter(criteria)
+        if after is not None:
+            where += " AND name > ?"
+            params.append(after)
+        rows = self._connect().execute(
+            f"SELECT name, owner, size, uploaded_at, path, local, remote FROM files WHERE {where} "
+            "ORDER BY name LIMIT ?",
+            (*params, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def create_operation(self, operation_id: str, action: str, criteria: Dict, created_by: str,
+                         total_files: int, total_bytes: int, pid: int) -> Dict:
+        """Record a new bulk operation, queued in the worker process pid."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO bulk_operations (id, action, criteria, status, created_by, created_at, updated_at, "
+                "pid, total_files, total_bytes) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (operation_id, action, json.dumps(criteria), created_by, now, now, pid, total_files, total_bytes)
+            )
+        return self.get_operation(operation_id)
+
+    def update_operation(self, operation_id: str, **fields):
+        """Set status and timing fields of a bulk operation."""
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE bulk_operations SET {assignments} WHERE id = ?", (*fields.values(), operation_id))
+
+    def add_operation_progress(self, operation_id: str, files: int, size: int, errors: int) -> bool:
+        """Add a batch's results to a bulk operation. Returns whether cancellation was requested."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE bulk_operations SET processed_files = processed_files + ?, "
+                "processed_bytes = processed_bytes + ?, errors = errors + ?, updated_at = ? WHERE id = ?",
+                (files, size, errors, time.time(), operation_id)
+            )
+            row = conn.execute("SELECT cancel_requested FROM bulk_operations WHERE id = ?", (operation_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def cancel_operation(self, operation_id: str) -> bool:
+        """Ask a queued or running bulk operation to stop. Returns False if it already finished."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE bulk_operations SET cancel_requested = 1, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), operation_id)
+            ).rowcount > 0
+
+    def get_operation(self, operation_id: str) -> Optional[Dict]:
+        """Get a bulk operation with its progress."""
+        row = self._connect().execute("SELECT * FROM bulk_operations WHERE id = ?", (operation_id,)).fetchone()
+        if row is None:
+            return None
+        operation = dict(row)
+        operation["criteria"] = json.loads(operation["criteria"])
+        operation["cancel_requested"] = bool(operation["cancel_requested"])
+        return operation
+
+    def list_operations(self, limit: int = 50) -> List[Dict]:
+        """Get the most recent bulk operations, newest first."""
+        rows = self._connect().execute(
+            "SELECT id FROM bulk_operations ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self.get_operation(row["id"]) for row in rows]
+
+    def get_unfinished_operations(self) -> List[Dict]:
+        """Get the bulk operations still queued or running."""
+        rows = self._connect().execute(
+            "SELECT id FROM bulk_operations WHERE status IN ('queued', 'running')"
+        ).fetchall()
+        return [self.get_operation(row["id"]) for row in rows]
+
+    def get_listing_version(self) -> int:
+        """Get a number that changes whenever a file is added, removed or changed."""
+        return self._connect().execute("SELECT version FROM listing_version WHERE id = 0").fetchone()[0]
+
+    def count_share_download(self, link_id: str, limit: int, expires_at: float) -> bool:
+        """Count one download of a share link. Returns False, without counting, once the limit is reached."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM share_downloads WHERE expires_at < ?", (time.time(),))
+            row = conn.execute("SELECT downloads FROM share_downloads WHERE link_id = ?", (link_id,)).fetchone()
+            if row is not None and row["downloads"] >= limit:
+                return False
+
+            conn.execute(
+                "INSERT INTO share_downloads (link_id, downloads, expires_at) VALUES (?, 1, ?) "
+                "ON CONFLICT (link_id) DO UPDATE SET downloads = downloads + 1",
+                (link_id, expires_at)
+            )
+        return True
+
+    def get_usage(self, owner: str) -> Dict:
+        """Get the bytes and file count stored by a user."""
+        row = self._connect().execute("SELECT bytes, files FROM usage WHERE owner = ?", (owner,)).fetchone()
+        if row is None:
+            return {"bytes": 0, "files": 0}
+        return {"bytes": row["bytes"], "files": row["files"]}
+
+    def get_total_bytes(self) -> int:
+        """Get the bytes stored by all users together."""
+        row = self._connect().execute("SELECT COALESCE(SUM(bytes), 0) AS total FROM usage").fetchone()
+        return row["total"]
+
+    def get_expired(self, now: float, after: Optional[Tuple[float, str]] = None, limit: int = 100) -> List[Dict]:
+        """
+        Get files whose expiry time has passed, soonest first.
+        `after` is the (expires_at, name) of the last row of the previous page.
+        """
+        if after is None:
+            rows = self._connect().execute(
+                "SELECT name, owner, path, size, expires_at FROM files WHERE expires_at <= ? "
+                "ORDER BY expires_at, name LIMIT ?",
+                (now, limit)
+            )
+        else:
+            rows = self._connect().execute(
+                "SELECT name, owner, path, size, expires_at FROM files WHERE expires_at <= ? AND (expires_at, name) > (?, ?) "
+                "ORDER BY expires_at, name LIMIT ?",
+                (now, after[0], after[1], limit)
+            )
+        return [dict(row) for row in rows]
+
+    def get_oldest(self, after: Optional[Tuple[float, str]] = None, limit: int = 100) -> List[Dict]:
+        """
+        Get files in upload order, oldest first.
+        `after` is the (uploaded_at, name) of the last row of the previous page.
+        """
+        if after is None:
+            rows = self._connect().execute(
+                "SELECT name, owner, path, size, uploaded_at, expires_at FROM files ORDER BY uploaded_at, name LIMIT ?",
+                (limit,)
+            )
+        else:
+            rows = self._connect().execute(
+                "SELECT name, owner, path, size, uploaded_at, expires_at FROM files WHERE (uploaded_at, name) > (?, ?) "
+                "ORDER BY uploaded_at, name LIMIT ?",
+                (after[0], after[1], limit)
+            )
+        return [dict(row) for row in rows]
+
+    def get_expiry_inputs(self) -> List[Dict]:
+        """Get the fields needed to recompute every file's expiry time."""
+        rows = self._connect().execute("SELECT name, owner, uploaded_at, ttl_expires_at, expires_at FROM files")
+        return [dict(row) for row in rows]
+
+    def set_expiry_many(self, updates: List[Tuple[Optional[float], str]]):
+        """Store new expiry times as (expires_at, name) pairs."""
+        with self._transaction() as conn:
+            conn.executemany("UPDATE files SET expires_at = ? WHERE name = ?", updates)
+
+    def _charge(self, conn, owner: str, size_delta: int, files_delta: int):
+        """Apply a usage delta for an owner inside an open transaction."""
+        conn.execute(
+            """
+            INSERT INTO usage (owner, bytes, files) VALUES (?, ?, ?)
+            ON CONFLICT (owner) DO UPDATE SET
+                bytes = MAX(0, bytes + excluded.bytes),
+                files = MAX(0, files + excluded.files)
+            """,
+            (owner, size_delta, files_delta)
+        )
+
+    def reconcile(self, upload_dir) -> Dict:
+        """
+        Bring the index in line with the upload directory.
+        Meant to run once at startup: files missing from disk are dropped
+        (or, if they are in the object store, marked as having no local
+        copy), files added outside the app are recorded without an owner,
+        and the usage totals are rebuilt from the index.
+        """
+        upload_dir = Path(upload_dir)
+        on_disk = {}
+        for root, dirs, files in os.walk(upload_dir):
+            # Skip hidden directories (temporary and internal data)
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            relative_root = os.path.relpath(root, upload_dir)
+
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                if name in on_disk:
+                    logger.warning(f"Duplicate file name found in upload directory, ignoring: {os.path.join(root, name)}")
+                    continue
+
+                stats = os.stat(os.path.join(root, name))
+                path = None if relative_root == "." else os.path.join(relative_root, name)
+                on_disk[name] = (stats.st_size, stats.st_mtime, path)
+
+        added = removed = updated = 0
+        with self._transaction() as conn:
+            indexed = {}
+            in_object_store = set()
+            not_local = set()
+            for row in conn.execute("SELECT name, size, path, local, remote FROM files"):
+                indexed[row["name"]] = (row["size"], row["path"])
+                if row["remote"]:
+                    in_object_store.add(row["name"])
+                if not row["local"]:
+                    not_local.add(row["name"])
+
+            for name in indexed.keys() - on_disk.keys():
+                if name in in_object_store:
+                    if name not in not_local:
+                        conn.execute("UPDATE files SET local = 0 WHERE name = ?", (name,))
+                        updated += 1
+                    continue
+                conn.execute("DELETE FROM files WHERE name = ?", (name,))
+                removed += 1
+
+            for name, (size, mtime, path) in on_disk.items():
+                if name not in indexed:
+                    conn.execute(
+                        "INSERT INTO files (name, owner, size, uploaded_at, path) VALUES (?, '', ?, ?, ?)",
+                        (name, size, mtime, path)
+                    )
+                    added += 1
+                elif indexed[name] != (size, path) or name in not_local:
+                    conn.execute("UPDATE files SET size = ?, path = ?, local = 1 WHERE name = ?", (size, path, name))
+                    updated += 1
+
+            conn.execute("DELETE FROM usage")
+            conn.execute(
+                "INSERT INTO usage (owner, bytes, files) "
+                "SELECT owner, SUM(size), COUNT(*) FROM files GROUP BY owner"
+            )
+
+        summary = {"files": len(on_disk), "added": added, "removed": removed, "updated": updated}
+        logger.info(f"Metadata reconciled with {upload_dir}: {summary}")
+        return summary
@@ -0,0 +1,506 @@
+import asyncio
+import bisect
+import fcntl
+import functools
+import glob
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger, get_logging_stats
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Bucket presets (upper bounds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KB .. 1 GB
+THROUGHPUT_BUCKETS = tuple(1024 * 1024 * 2 ** i for i in range(-4, 11))  # 64 KB/s .. 1 GB/s
+
+# Totals of the workers that have exited, in the multiprocess directory
+EXITED_SNAPSHOT = "exited.json"
+
+
+class Metric:
+    """Base class for metrics: a name, help text and label names."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+        # Metrics without labels are exported from the start, even before their first update
+        if not self.labelnames:
+            self._values[()] = self._initial()
+
+    def _initial(self):
+        return 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            values = [[list(labels), self._export(value)] for labels, value in self._values.items()]
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "values": values,
+        }
+
+    def _export(self, value):
+        return value
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+    Counts kept elsewhere (e.g. by the log handler) are read by a callback
+    at collection time instead.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def snapshot(self) -> Dict:
+        if self.callback is not None:
+            try:
+                value = self.callback()
+                with self._lock:
+                    self._values[()] = value
+            except Exception as e:
+                logger.debug("Counter callback for %s failed: %s", self.name, e)
+        return super().snapshot()
+
+    def inc(self, amount: float = 1, labels: Tuple = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down.
+    Gauges can be set directly or computed by a callback at collection time.
+    `aggregate` decides how values from several worker processes combine:
+    "sum" or "max".
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable] = None, aggregate="sum"):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.aggregate = aggregate
+
+    def set(self, value: float, labels: Tuple = ()):
+        with self._lock:
+            self._values[labels] = value
+
+    def snapshot(self) -> Dict:
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception as e:
+                logger.debug("Gauge callback for %s failed: %s", self.name, e)
+        data = super().snapshot()
+        data["aggregate"] = self.aggregate
+        return data
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _initial(self):
+        # Per-bucket counts (last slot is +Inf), sum, count
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value: float, labels: Tuple = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = self._initial()
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _export(self, value):
+        counts, total, count = value
+        return [list(counts), total, count]
+
+    def time(self, labels: Tuple = ()):
+        """Context manager observing the duration of a block in seconds."""
+        return _Timer(self, labels)
+
+    def timed(self, func):
+        """Decorator observing the duration of every call to a function."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+        return wrapper
+
+    def snapshot(self) -> Dict:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class MetricsRegistry:
+    """
+    In-process registry of metrics.
+    With several worker processes, each process periodically writes a
+    snapshot to a shared directory and /metrics merges all snapshots:
+    counters and histograms are summed (including those of exited
+    workers, so they never go backwards), gauges are combined across
+    live workers only. The snapshots of exited workers are folded into
+    one file of totals and removed.
+    """
+
+    def __init__(self, multiprocess_dir: Optional[str] = None):
+        self.metrics: Dict[str, Metric] = {}
+        self.multiprocess_dir = multiprocess_dir
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+        self._process_id = None
+        self._process_pid = None
+
+    @property
+    def process_id(self) -> str:
+        """
+        ID of this process's snapshot file. Unlike the pid, it is never
+        reused, and a worker forked from a process that already had one
+        gets its own.
+        """
+        if self._process_pid != os.getpid():
+            self._process_id = uuid.uuid4().hex
+            self._process_pid = os.getpid()
+        return self._process_id
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None, aggregate="sum") -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback, aggregate))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def write_snapshot(self, snapshot: Optional[Dict] = None):
+        """Write this process's snapshot for the other workers to read."""
+        if not self.multiprocess_dir:
+            return
+        if snapshot is None:
+            snapshot = self.snapshot()
+        path = os.path.join(self.multiprocess_dir, f"metrics_{self.process_id}.json")
+        _write_json(path, {"pid": os.getpid(), "metrics": snapshot})
+
+    def _read_snapshots(self) -> List[Tuple[str, int, Dict]]:
+        """(path, pid, snapshot) of the other workers' snapshot files."""
+        own_path = os.path.join(self.multiprocess_dir, f"metrics_{self.process_id}.json")
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiprocess_dir, "metrics_*.json")):
+            if path == own_path:
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                snapshots.append((path, int(data["pid"]), data["metrics"]))
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                logger.debug("Skipping metrics snapshot %s: %s", path, e)
+        return snapshots
+
+    def _read_exited(self) -> Dict:
+        try:
+            with open(os.path.join(self.multiprocess_dir, EXITED_SNAPSHOT)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def collect(self) -> List[Tuple[Optional[int], Dict]]:
+        """
+        Get (pid, snapshot) for this process and, in multiprocess mode, every
+        other worker, plus (None, totals) for the workers that have exited.
+        """
+        own = (os.getpid(), self.snapshot())
+        if not self.multiprocess_dir:
+            return [own]
+
+        snapshots = [own] + [(pid, snapshot) for _, pid, snapshot in self._read_snapshots()]
+        try:
+            exited = self._read_exited()
+        except (ValueError, OSError) as e:
+            logger.debug("Skipping exited workers' metrics: %s", e)
+            exited = {}
+        if exited:
+            snapshots.append((None, exited))
+        return snapshots
+
+    def fold_exited(self) -> int:
+        """
+        Add the counters and histograms of exited workers to the totals kept
+        for all exited workers, and remove their snapshot files, so the
+        directory doesn't grow with every worker restart. Blocking.
+        Returns the number of snapshots folded.
+        """
+        if not self.multiprocess_dir:
+            return 0
+        exited = [path for path, pid, _ in self._read_snapshots() if not _pid_alive(pid)]
+        if not exited:
+            return 0
+
+        # Workers fold one at a time, so no snapshot is counted twice
+        with open(os.path.join(self.multiprocess_dir, "exited.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            parts = [(None, self._read_exited())]
+            folded = []
+            for path in exited:
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)["metrics"]
+                except FileNotFoundError:
+                    # Folded by another worker meanwhile
+                    continue
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"Removing unreadable metrics snapshot {path}: {str(e)}")
+                    os.remove(path)
+                    continue
+                # Gauges of exited workers no longer mean anything
+                parts.append((None, {name: data for name, data in snapshot.items() if data["type"] != "gauge"}))
+                folded.append(path)
+
+            if folded:
+                _write_json(os.path.join(self.multiprocess_dir, EXITED_SNAPSHOT), _to_snapshot(_merge(parts)))
+                for path in folded:
+                    os.remove(path)
+
+        return len(folded)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        merged = _merge(self.collect())
+        lines = []
+        for name, data in merged.items():
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['type']}")
+            labelnames = data["labelnames"]
+
+            for labels, value in sorted(data["values"].items()):
+                if data["type"] == "histogram":
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(data["buckets"] + [math.inf], counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == math.inf else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labelnames + ['le'], labels + (le,))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labelnames, labels)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _write_json(path: str, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(snapshots: List[Tuple[Optional[int], Dict]]) -> Dict:
+    """Combine snapshots from several processes (pid None: exited workers) into one set of values."""
+    merged = {}
+    own_pid = os.getpid()
+
+    for pid, snapshot in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, {
+                "type": data["type"],
+                "help": data["help"],
+                "labelnames": data["labelnames"],
+                "buckets": data.get("buckets"),
+                "aggregate": data.get("aggregate"),
+                "values": {},
+            })
+
+            # Gauges of exited workers no longer mean anything
+            if data["type"] == "gauge" and pid != own_pid and (pid is None or not _pid_alive(pid)):
+                continue
+
+            for labels, value in data["values"]:
+                key = tuple(labels)
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = value
+                elif data["type"] == "histogram":
+                    target["values"][key] = [
+                        [a + b for a, b in zip(current[0], value[0])],
+                        current[1] + value[1],
+                        current[2] + value[2],
+                    ]
+                elif data["type"] == "gauge" and target["aggregate"] == "max":
+                    target["values"][key] = max(current, value)
+                else:
+                    target["values"][key] = current + value
+
+    return merged
+
+
+def _to_snapshot(merged: Dict) -> Dict:
+    """Turn merged values back into the snapshot format."""
+    snapshot = {}
+    for name, data in merged.items():
+        snapshot[name] = {
+            "type": data["type"],
+            "help": data["help"],
+            "labelnames": data["labelnames"],
+            "values": [[list(labels), value] for labels, value in data["values"].items()],
+        }
+        if data["buckets"] is not None:
+            snapshot[name]["buckets"] = data["buckets"]
+    return snapshot
+
+
+def _format_labels(labelnames, labels) -> str:
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, labels):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Measure how late the event loop wakes up from a sleep, as a proxy for blocking work."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+
+async def flush_snapshots(interval: float = 5.0):
+    """Periodically publish this worker's metrics for the other workers."""
+    while True:
+        try:
+            # Gauge callbacks need the event loop, so snapshot here and only write in a thread
+            await asyncio.to_thread(registry.write_snapshot, registry.snapshot())
+            await asyncio.to_thread(registry.fold_exited)
+        except Exception as e:
+            logger.error(f"Failed to write metrics snapshot: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+def _thread_pool_queue_depth():
+    """Tasks waiting for a worker thread (anyio pool used by Starlette plus the asyncio default executor)."""
+    import anyio.to_thread
+
+    waiting = anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    work_queue = getattr(executor, "_work_queue", None)
+    if work_queue is not None:
+        waiting += work_queue.qsize()
+
+    return waiting
+
+
+def _thread_pool_busy():
+    import anyio.to_thread
+
+    return anyio.to_thread.current_default_thread_limiter().statistics().borrowed_tokens
+
+
+# The process-wide registry and the application's metrics
+registry = MetricsRegistry(config.get("metrics", {}).get("multiprocess_dir"))
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Time to response headers per route", ["method", "route", "status"])
+UPLOAD_BYTES = registry.counter("upload_bytes_total", "Bytes received in uploads")
+UPLOADS = registry.counter("uploads_total", "Uploads stored")
+UPLOAD_SIZE = registry.histogram("upload_size_bytes", "Size of uploaded files", buckets=SIZE_BUCKETS)
+UPLOAD_THROUGHPUT = registry.histogram(
+    "upload_throughput_bytes_per_second", "Write throughput per upload", buckets=THROUGHPUT_BUCKETS)
+DOWNLOAD_BYTES = registry.counter("download_bytes_total", "Bytes sent in file downloads")
+DOWNLOADS = registry.counter("downloads_total", "File downloads completed")
+DOWNLOAD_THROUGHPUT = registry.histogram(
+    "download_throughput_bytes_per_second", "Send throughput per download", buckets=THROUGHPUT_BUCKETS)
+BCRYPT_SECONDS = registry.histogram("bcrypt_check_seconds", "Time spent verifying passwords with bcrypt")
+FILE_LIST_SECONDS = registry.histogram("file_list_seconds", "Time spent in get_file_list")
+RATE_LIMIT_REJECTIONS = registry.counter("rate_limit_rejections_total", "Requests rejected by the rate limiter")
+EVENT_LOOP_LAG = registry.gauge("event_loop_lag_seconds", "Most recent event loop lag", aggregate="max")
+EVENT_LOOP_LAG_SECONDS = registry.histogram("event_loop_lag_distribution_seconds", "Event loop lag samples")
+THREAD_POOL_QUEUE = registry.gauge(
+    "thread_pool_queue_depth", "Tasks waiting for a worker thread", callback=_thread_pool_queue_depth)
+THREAD_POOL_BUSY = registry.gauge("thread_pool_busy_threads", "Worker threads in use", callback=_thread_pool_busy)
+EVENT_SUBSCRIBERS = registry.gauge("event_subscribers", "Pages connected to the live event feed")
+EVENTS_PUBLISHED = registry.counter("events_published_total", "Live events published")
+EVENT_SUBSCRIBERS_DROPPED = registry.counter(
+    "event_subscribers_dropped_total", "Live event subscribers disconnected for falling behind")
+LOG_RECORDS_DROPPED = registry.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full",
+    callback=lambda: get_logging_stats()["dropped"])
+LOG_RECORDS_SAMPLED = registry.counter(
+    "log_records_sampled_total", "Log records below WARNING left out by sampling under load",
+    callback=lambda: get_logging_stats()["sampled_out"])
+LOG_QUEUE_DEPTH = registry.gauge(
+    "log_queue_depth", "Log records waiting to be written", callback=lambda: get_logging_stats()["queue_depth"])
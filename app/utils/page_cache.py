@@ -0,0 +1,133 @@
+import hashlib
+import json
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+from fastapi import Request
+
+from app.utils.config import get_config, get_settings
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+config = get_config()
+
+APP_VERSION = "2.0.0"
+
+# Template context that only depends on the configuration, with the config it was built from
+_static_context = None
+_static_context_config = None
+
+# Last disk usage reading and when it was taken
+_disk_info = None
+_disk_info_time = 0.0
+_disk_info_lock = threading.Lock()
+
+
+def get_cache_config() -> Dict:
+    return config.get("cache", {})
+
+
+def get_static_context() -> Dict:
+    """
+    Get the parts of the base template context that only change with the configuration.
+    Computed once per loaded configuration (and again after a reload)
+    instead of on every request.
+    """
+    global _static_context, _static_context_config
+
+    current_config = get_settings()
+    if _static_context is None or _static_context_config is not current_config:
+        _static_context = {
+            "max_size": current_config["upload"]["max_size"],
+            "blacklist": list(current_config["upload"]["blacklist_extensions"]),
+            "whitelist": list(current_config["upload"]["whitelist_extensions"]),
+            "app_version": APP_VERSION
+        }
+        _static_context_config = current_config
+
+    return _static_context
+
+
+def get_disk_info(upload_dir) -> Dict:
+    """Get disk usage of the upload directory, refreshed at most every `cache.disk_info_seconds`."""
+    global _disk_info, _disk_info_time
+
+    max_age = get_cache_config().get("disk_info_seconds", 10)
+    now = time.monotonic()
+    if _disk_info is not None and now - _disk_info_time < max_age:
+        return _disk_info
+
+    with _disk_info_lock:
+        if _disk_info is None or now - _disk_info_time >= max_age:
+            total, used, free = shutil.disk_usage(upload_dir)
+            _disk_info = {
+                "total": f"{total // (2**30)} GB",
+                "used": f"{used // (2**30)} GB",
+                "free": f"{free // (2**30)} GB",
+                "percent_used": round((used / total) * 100, 2)
+            }
+            _disk_info_time = time.monotonic()
+
+    return _disk_info
+
+
+class FragmentCache:
+    """
+    Small LRU cache of rendered HTML fragments.
+    Keys include a version number for the data the fragment shows, so
+    entries never have to be invalidated; stale ones just age out.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def set(self, key: Hashable, fragment: str):
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def compute_etag(*parts) -> str:
+    """Build a weak ETag from everything a rendered page depends on."""
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check a request's If-None-Match header against an ETag (weak comparison)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
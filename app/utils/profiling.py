@@ -0,0 +1,323 @@
+import asyncio
+import functools
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fastapi.templating import Jinja2Templates
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+config = get_config()
+
+# The profile of the request being handled in the current context, if any
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+# Capture ids are generated here, and checked before touching the file system
+_CAPTURE_ID = re.compile(r"^\d{17}-[0-9a-f]{8}$")
+
+# Stack entries kept per capture
+MAX_STACKS = 200
+MAX_STACK_DEPTH = 64
+
+
+class RequestProfile:
+    """Timings collected while handling a single request."""
+
+    __slots__ = ("started", "phases")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+
+    def add_phase(self, name, seconds):
+        total, count = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + seconds, count + 1)
+
+
+@contextmanager
+def phase(name):
+    """Time a block as a named phase of the current request, e.g. `with phase("disk"):`."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_phase(name, time.perf_counter() - start)
+
+
+def timed_phase(name):
+    """Decorator timing every call of a function as a named phase of the current request."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _current_profile.get()
+            if profile is None:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.add_phase(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class TimedTemplates(Jinja2Templates):
+    """Jinja2Templates that records template rendering as the "template" phase."""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with phase("template"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+class StackSampler:
+    """
+    Background thread taking a stack sample of every other thread at a fixed interval.
+    Samples are only taken while requests are in flight and are kept in a
+    short in-memory window; a slow request picks out the samples taken
+    between its start and end.
+    """
+
+    def __init__(self, interval_seconds=0.01, window_seconds=120):
+        self.interval = interval_seconds
+        self.samples = deque(maxlen=max(1, int(window_seconds / interval_seconds)))
+        self.active_requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def request_started(self):
+        with self._lock:
+            self.active_requests += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.active_requests -= 1
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            if not self.active_requests:
+                continue
+
+            now = time.monotonic()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples.append((now, ";".join(reversed(stack))))
+
+    def collapsed_stacks(self, start, end) -> Dict[str, int]:
+        """Samples taken between two monotonic times, in collapsed (flame graph) format."""
+        counts = Counter(stack for taken, stack in list(self.samples) if start <= taken <= end)
+        return dict(counts.most_common(MAX_STACKS))
+
+
+class CaptureStore:
+    """Bounded ring buffer of slow-request captures, one JSON file per capture."""
+
+    def __init__(self, directory, max_captures=50):
+        self.directory = directory
+        self.max_captures = max_captures
+        os.makedirs(directory, exist_ok=True)
+
+    def new_id(self):
+        # Sortable by time, so the oldest captures are the first in a directory listing
+        return f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')[:17]}-{uuid.uuid4().hex[:8]}"
+
+    def save(self, capture: Dict):
+        path = os.path.join(self.directory, f"{capture['id']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(capture, f)
+        os.replace(tmp_path, path)
+
+        captures = self._capture_files()
+        for name in captures[:-self.max_captures]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _capture_files(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(".json") and _CAPTURE_ID.match(name[:-5]))
+
+    def list(self) -> List[Dict]:
+        """Summaries of the stored captures, newest first."""
+        summaries = []
+        for name in reversed(self._capture_files()):
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    capture = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summaries.append({key: capture.get(key) for key in
+                              ("id", "time", "method", "path", "status", "duration_ms", "mode", "phases")})
+        return summaries
+
+    def get_path(self, capture_id) -> Optional[str]:
+        if not _CAPTURE_ID.match(capture_id):
+            return None
+        path = os.path.join(self.directory, f"{capture_id}.json")
+        return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware timing every request, including sending the response body.
+    Requests slower than the threshold are written to the capture store
+    together with their phase timings and either the stack samples taken
+    while they ran or, in cprofile mode, a cProfile report.
+
+    cProfile can only profile one request at a time; it runs on the event
+    loop thread, so the report also includes other requests served on the
+    loop in the meantime, and not work done in the thread pool.
+    """
+
+    def __init__(self, app, slow_request_ms=1000, mode="sample", sample_interval_ms=10,
+                 directory="logs/profiles", max_captures=50, exclude_paths=None):
+        self.app = app
+        self.slow_seconds = slow_request_ms / 1000
+        self.mode = mode
+        self.exclude_paths = tuple(exclude_paths or ())
+        self.store = CaptureStore(directory, max_captures)
+        self.sampler = None
+        self._profiler_lock = threading.Lock()
+
+        if mode == "sample":
+            self.sampler = StackSampler(sample_interval_ms / 1000)
+            self.sampler.start()
+
+        logger.info(f"Request profiling enabled ({mode} mode), capturing requests slower than {slow_request_ms}ms")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profiler = None
+        if self.mode == "cprofile" and self._profiler_lock.acquire(blocking=False):
+            # The profilers are only loaded in cprofile mode
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active on this thread
+                self._profiler_lock.release()
+                profiler = None
+        if self.sampler:
+            self.sampler.request_started()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            ended = time.monotonic()
+            if profiler:
+                profiler.disable()
+                self._profiler_lock.release()
+            if self.sampler:
+                self.sampler.request_finished()
+            _current_profile.reset(token)
+
+            duration = ended - profile.started
+            if duration >= self.slow_seconds:
+                capture = self._build_capture(scope, status_code, profile, ended, profiler)
+                try:
+                    await asyncio.to_thread(self.store.save, capture)
+                    logger.warning(f"Slow request captured: {scope['method']} {scope['path']} "
+                                   f"took {duration * 1000:.0f}ms (capture {capture['id']})")
+                except Exception as e:
+                    logger.error(f"Error saving slow request capture: {str(e)}")
+
+    def _build_capture(self, scope, status_code, profile, ended, profiler):
+        capture = {
+            "id": self.store.new_id(),
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "client": scope["client"][0] if scope.get("client") else None,
+            "status": status_code,
+            "duration_ms": round((ended - profile.started) * 1000, 3),
+            "mode": self.mode,
+            "phases": {name: {"ms": round(total * 1000, 3), "calls": count}
+                       for name, (total, count) in profile.phases.items()},
+        }
+
+        if self.sampler:
+            capture["stacks"] = self.sampler.collapsed_stacks(profile.started, ended)
+        elif profiler:
+            import pstats
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(50)
+            capture["profile"] = output.getvalue()
+
+        return capture
+
+
+def get_profiling_config() -> Dict:
+    return config.get("profiling", {})
+
+
+def create_profiling_middleware_options() -> Optional[Dict]:
+    """Options for ProfilingMiddleware from the configuration, or None when profiling is disabled."""
+    profiling_config = get_profiling_config()
+    if not profiling_config.get("enabled", False):
+        return None
+
+    return {
+        "slow_request_ms": profiling_config.get("slow_request_ms", 1000),
+        "mode": profiling_config.get("mode", "sample"),
+        "sample_interval_ms": profiling_config.get("sample_interval_ms", 10),
+        "directory": profiling_config.get("directory", "logs/profiles"),
+        "max_captures": profiling_config.get("max_captures", 50),
+        "exclude_paths": profiling_config.get("exclude_paths", ["/static", "/health", "/metrics", "/api/events"]),
+    }
+
+
+def get_capture_store() -> CaptureStore:
+    """Capture store for the configured directory, used by the admin endpoints."""
+    profiling_config = get_profiling_config()
+    return CaptureStore(profiling_config.get("directory", "logs/profiles"),
+                        profiling_config.get("max_captures", 50))
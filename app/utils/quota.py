@@ -0,0 +1,88 @@
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+
+from app.utils.auth import get_user_by_username
+from app.utils.config import get_config, get_settings
+from app.utils.download_utils import format_file_size
+from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
+
+logger = get_logger(__name__)
+config = get_config()
+
+
+def get_quota_bytes(username: str) -> Optional[int]:
+    """
+    Get the storage quota for a user in bytes.
+    A `quota_mb` on the user wins over the quota for the user's role.
+    Quotas come from the users file as of the last configuration load.
+    Returns None when the user has no quota.
+    """
+    security = get_settings().security
+    if username in security.user_quotas:
+        role, quota_mb = security.user_quotas[username]
+    else:
+        # Added to the users file since the configuration was loaded
+        user = get_user_by_username(username) or {}
+        role, quota_mb = user.get("role", "reader"), user.get("quota_mb")
+
+    if quota_mb is None:
+        quota_mb = security.role_quotas.get(role)
+
+    if quota_mb is None:
+        return None
+
+    return int(quota_mb * 1024 * 1024)
+
+
+def get_remaining_quota(username: str) -> Optional[int]:
+    """Get the bytes a user may still upload, or None when unlimited."""
+    quota = get_quota_bytes(username)
+    if quota is None:
+        return None
+
+    used = get_metadata_store().get_usage(username)["bytes"]
+    return max(0, quota - used)
+
+
+def check_quota(username: str, incoming_bytes: int = 0):
+    """
+    Reject an upload that would not fit in the user's quota.
+    Called with the request Content-Length before the body is read.
+    """
+    remaining = get_remaining_quota(username)
+    if remaining is None:
+        return
+
+    if remaining <= 0 or incoming_bytes > remaining:
+        logger.warning(f"Storage quota exceeded for user '{username}': {incoming_bytes} bytes requested, {remaining} bytes remaining")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Storage quota exceeded. Remaining quota: {format_file_size(remaining)}"
+        )
+
+
+def get_quota_info(username: str) -> Dict:
+    """Get usage and quota information for display."""
+    usage = get_metadata_store().get_usage(username)
+    quota = get_quota_bytes(username)
+
+    info = {
+        "used": usage["bytes"],
+        "used_formatted": format_file_size(usage["bytes"]),
+        "files": usage["files"],
+        "limit": quota,
+        "limit_formatted": format_file_size(quota) if quota is not None else "Unlimited",
+        "remaining": None,
+        "remaining_formatted": "Unlimited",
+        "percent_used": 0
+    }
+
+    if quota is not None:
+        remaining = max(0, quota - usage["bytes"])
+        info["remaining"] = remaining
+        info["remaining_formatted"] = format_file_size(remaining)
+        info["percent_used"] = round(min(100, usage["bytes"] / quota * 100), 2) if quota else 100
+
+    return info
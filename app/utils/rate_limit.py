@@ -1,6 +1,7 @@
 import time
 from collections import defaultdict
 from app.utils.logging_utils import get_logger
+from app.utils.metrics import RATE_LIMIT_REJECTIONS
 
 logger = get_logger(__name__)
 
@@ -30,6 +31,7 @@ class RateLimiter:
         # Check if rate limit is exceeded
         if len(self.upload_history[ip_address]) >= self.max_uploads:
             logger.warning(f"Rate limit exceeded for IP {ip_address}: {len(self.upload_history[ip_address])} uploads in window")
+            RATE_LIMIT_REJECTIONS.inc()
             return False
             
         # Add new upload timestamp
@@ -0,0 +1,311 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.utils.config import get_config, get_settings
+from app.utils.events import notify_files_removed
+from app.utils.file_utils import try_lock
+from app.utils.jobs import get_job_queue
+from app.utils.logging_utils import get_logger, audit_event
+from app.utils.storage import get_storage
+
+logger = get_logger(__name__)
+config = get_config()
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def get_retention_rules() -> List[Dict]:
+    """Get the configured retention rules."""
+    return config.get("retention", {}).get("rules") or []
+
+
+def rule_matches(rule: Dict, name: str, owner: str) -> bool:
+    """Check if a retention rule applies to a file."""
+    extension = rule.get("extension")
+    if extension and not name.lower().endswith(extension.lower()):
+        return False
+
+    user = rule.get("user")
+    if user and user != owner:
+        return False
+
+    return True
+
+
+def compute_expiry(name: str, owner: str, uploaded_at: float, ttl_expires_at: Optional[float] = None) -> Optional[float]:
+    """
+    Work out when a file expires.
+    The strictest matching max_age_days rule and the file's own TTL both
+    apply; the earliest one wins. Returns None for files kept forever.
+    """
+    candidates = []
+
+    ages = [
+        rule["max_age_days"] for rule in get_retention_rules()
+        if rule.get("max_age_days") and rule_matches(rule, name, owner)
+    ]
+    if ages:
+        candidates.append(uploaded_at + min(ages) * SECONDS_PER_DAY)
+
+    if ttl_expires_at is not None:
+        candidates.append(ttl_expires_at)
+
+    return min(candidates) if candidates else None
+
+
+def get_ttl_expiry(ttl_seconds, now: Optional[float] = None) -> Optional[float]:
+    """
+    Turn a TTL sent with an upload into an absolute expiry time.
+    Raises ValueError for TTLs that are invalid or longer than allowed.
+    """
+    if ttl_seconds in (None, ""):
+        return None
+
+    try:
+        ttl_seconds = int(ttl_seconds)
+    except (TypeError, ValueError):
+        raise ValueError("TTL must be a whole number of seconds")
+
+    if ttl_seconds <= 0:
+        raise ValueError("TTL must be a positive number of seconds")
+
+    max_ttl_days = config.get("retention", {}).get("max_ttl_days")
+    if max_ttl_days and ttl_seconds > max_ttl_days * SECONDS_PER_DAY:
+        raise ValueError(f"TTL may not exceed {max_ttl_days} days")
+
+    if now is None:
+        now = time.time()
+
+    return now + ttl_seconds
+
+
+class RetentionEngine:
+    """
+    Background enforcement of retention policies.
+    Works entirely from the expiry-ordered file index: each run pages
+    through files whose expiry time has passed and, if a total size limit
+    is set, through the oldest files until the volume is back under it.
+    Deletions happen in rate-limited batches on a worker thread. With
+    several workers, a file lock makes sure only one of them enforces.
+    """
+
+    def __init__(self, store, upload_dir, interval_seconds=300, batch_size=100,
+                 batch_pause_seconds=1.0, max_total_mb=0, dry_run=False):
+        self.store = store
+        self.upload_dir = Path(upload_dir)
+        self.interval = interval_seconds
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause_seconds
+        self.max_total_bytes = int((max_total_mb or 0) * 1024 * 1024)
+        self.dry_run = dry_run
+
+        self._lock_file = None
+        # Rules the expiry times were last computed from
+        self._rules = get_settings().retention.rules
+        self._run_lock = asyncio.Lock()
+
+        # Metrics exposed through stats()
+        self.runs_total = 0
+        self.deleted_files_total = 0
+        self.deleted_bytes_total = 0
+        self.errors_total = 0
+        self.last_run = None
+
+    def refresh_expiry(self) -> int:
+        """
+        Recompute expiry times for every indexed file from the current rules.
+        Returns the number of files whose expiry time changed.
+        """
+        updates = []
+        for row in self.store.get_expiry_inputs():
+            expires_at = compute_expiry(row["name"], row["owner"], row["uploaded_at"], row["ttl_expires_at"])
+            if expires_at != row["expires_at"]:
+                updates.append((expires_at, row["name"]))
+
+        if updates:
+            self.store.set_expiry_many(updates)
+            logger.info(f"Retention expiry times updated for {len(updates)} files")
+
+        return len(updates)
+
+    def apply_reloaded_config(self, settings):
+        """Recompute expiry times on a background thread when a reload changed the retention rules."""
+        if settings.retention.rules == self._rules:
+            return
+        self._rules = settings.retention.rules
+        threading.Thread(target=self._refresh_expiry_once, name="retention-expiry", daemon=True).start()
+
+    def _refresh_expiry_once(self):
+        """Refresh expiry times, unless another worker is already doing it for the same reload."""
+        lock_file = try_lock(f"{self.store.db_path}.expiry.lock")
+        if lock_file is None:
+            return
+        try:
+            self.refresh_expiry()
+        except Exception as e:
+            logger.error(f"Retention expiry refresh failed: {str(e)}")
+        finally:
+            lock_file.close()
+
+    def is_leader(self) -> bool:
+        """Try to become the single worker that enforces retention."""
+        if self._lock_file is not None:
+            return True
+
+        self._lock_file = try_lock(f"{self.store.db_path}.retention.lock")
+        return self._lock_file is not None
+
+    async def run_forever(self):
+        """Enforce retention every interval until cancelled."""
+        logger.info(f"Retention engine started (interval: {self.interval}s, dry run: {self.dry_run})")
+        while True:
+            try:
+                if self.is_leader():
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors_total += 1
+                logger.error(f"Retention run failed: {str(e)}")
+
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, dry_run: Optional[bool] = None) -> Dict:
+        """Run a single enforcement pass and return what it did (or would do)."""
+        if dry_run is None:
+            dry_run = self.dry_run
+
+        # A manual run waits for a scheduled one in progress, so files aren't deleted twice
+        async with self._run_lock:
+            return await self._run_once(dry_run)
+
+    async def _run_once(self, dry_run: bool) -> Dict:
+
+        started = time.monotonic()
+        now = time.time()
+        result = {
+            "dry_run": dry_run,
+            "expired_files": 0,
+            "expired_bytes": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "errors": 0,
+        }
+
+        # Files past their expiry time, soonest first
+        cursor = None
+        while True:
+            batch = await asyncio.to_thread(self.store.get_expired, now, cursor, self.batch_size)
+            if not batch:
+                break
+            cursor = (batch[-1]["expires_at"], batch[-1]["name"])
+
+            files, size = await self._process_batch(batch, dry_run, result)
+            result["expired_files"] += files
+            result["expired_bytes"] += size
+
+        # Oldest-first eviction while over the total size limit
+        if self.max_total_bytes:
+            total = await asyncio.to_thread(self.store.get_total_bytes)
+            if dry_run:
+                total -= result["expired_bytes"]
+            excess = total - self.max_total_bytes
+
+            cursor = None
+            while excess > 0:
+                batch = await asyncio.to_thread(self.store.get_oldest, cursor, self.batch_size)
+                if not batch:
+                    break
+                cursor = (batch[-1]["uploaded_at"], batch[-1]["name"])
+
+                victims = []
+                selected = 0
+                for row in batch:
+                    # Already counted as expired in a dry run
+                    if dry_run and row["expires_at"] is not None and row["expires_at"] <= now:
+                        continue
+                    if selected >= excess:
+                        break
+                    victims.append(row)
+                    selected += row["size"]
+
+                # Only what was actually deleted counts; failures are made up from the next batch
+                files, size = await self._process_batch(victims, dry_run, result)
+                excess -= size
+                result["evicted_files"] += files
+                result["evicted_bytes"] += size
+
+        result["duration_seconds"] = round(time.monotonic() - started, 3)
+        result["finished_at"] = time.time()
+
+        self.runs_total += 1
+        self.errors_total += result["errors"]
+        if not dry_run:
+            self.deleted_files_total += result["expired_files"] + result["evicted_files"]
+            self.deleted_bytes_total += result["expired_bytes"] + result["evicted_bytes"]
+        self.last_run = result
+
+        if result["expired_files"] or result["evicted_files"]:
+            action = "would delete" if dry_run else "deleted"
+            logger.info(
+                f"Retention run {action} {result['expired_files']} expired and "
+                f"{result['evicted_files']} evicted files in {result['duration_seconds']}s"
+            )
+
+        return result
+
+    async def _process_batch(self, rows: List[Dict], dry_run: bool, result: Dict):
+        """Delete (or just count) a batch of files, then pause to limit the I/O rate."""
+        if not rows:
+            return 0, 0
+
+        if dry_run:
+            return len(rows), sum(row["size"] for row in rows)
+
+        files, size, errors = await asyncio.to_thread(self._delete_batch, rows)
+        result["errors"] += errors
+
+        if self.batch_pause:
+            await asyncio.sleep(self.batch_pause)
+
+        return files, size
+
+    def _delete_batch(self, rows: List[Dict]):
+        """Remove files from disk and the index. Runs on a worker thread."""
+        files = size = errors = 0
+        deleted = []
+        for row in rows:
+            try:
+                # Also removes the file's copy in the object store, if any
+                get_storage().delete(row["name"], row["path"])
+            except OSError as e:
+                errors += 1
+                logger.error(f"Retention failed to delete {row['name']}: {str(e)}")
+                continue
+
+            self.store.remove_file(row["name"])
+            get_job_queue().forget_file(row["name"])
+            audit_event("delete", user="retention", file=row["name"], size=row["size"])
+            deleted.append(row)
+            files += 1
+            size += row["size"]
+
+        notify_files_removed(deleted, "expired")
+        return files, size, errors
+
+    def stats(self) -> Dict:
+        """Retention metrics."""
+        return {
+            "dry_run": self.dry_run,
+            "interval_seconds": self.interval,
+            "max_total_bytes": self.max_total_bytes,
+            "leader": self._lock_file is not None,
+            "runs_total": self.runs_total,
+            "deleted_files_total": self.deleted_files_total,
+            "deleted_bytes_total": self.deleted_bytes_total,
+            "errors_total": self.errors_total,
+            "last_run": self.last_run,
+        }
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Dict, Mapping, Optional
+from urllib.parse import quote, urlencode
+
+from fastapi import HTTPException
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
+
+logger = get_logger(__name__)
+config = get_config()
+
+
+def get_share_config() -> Dict:
+    return config.get("share_links", {})
+
+
+def _get_secret() -> bytes:
+    secret = get_share_config().get("secret_key") or config["security"]["secret_key"]
+    return secret.encode()
+
+
+def _sign(filename: str, expires: int, ip: str, max_downloads: int, link_id: str) -> str:
+    # Every restriction is part of the signed message, so none can be changed or dropped
+    message = f"share\n{filename}\n{expires}\n{ip}\n{max_downloads}\n{link_id}".encode()
+    digest = hmac.new(_get_secret(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def create_share_link(filename: str, expires_minutes: Optional[int] = None, ip: Optional[str] = None,
+                      max_downloads: Optional[int] = None) -> Dict:
+    """
+    Create a signed link to download a file without an account.
+    The link expires after expires_minutes (capped at share_links.max_expire_minutes)
+    and can be restricted to one client IP and a number of downloads.
+    Returns the link's path with query string and its restrictions.
+    """
+    share_config = get_share_config()
+    max_minutes = share_config.get("max_expire_minutes", 10080)
+    if expires_minutes is None:
+        expires_minutes = share_config.get("default_expire_minutes", 1440)
+    if expires_minutes <= 0 or expires_minutes > max_minutes:
+        raise HTTPException(status_code=400, detail=f"Links must expire within 1 to {max_minutes} minutes")
+    if max_downloads is not None and max_downloads <= 0:
+        raise HTTPException(status_code=400, detail="The download limit must be a positive number")
+
+    expires = int(time.time()) + expires_minutes * 60
+    ip = ip or ""
+    max_downloads = max_downloads or 0
+    # Downloads are counted per link, so limited links need an id of their own
+    link_id = secrets.token_urlsafe(9) if max_downloads else ""
+
+    params = {"expires": expires}
+    if ip:
+        params["ip"] = ip
+    if max_downloads:
+        params["max"] = max_downloads
+        params["id"] = link_id
+    params["sig"] = _sign(filename, expires, ip, max_downloads, link_id)
+
+    return {
+        "url": f"/share/{quote(filename)}?{urlencode(params)}",
+        "expires_at": expires,
+        "ip": ip or None,
+        "max_downloads": max_downloads or None,
+    }
+
+
+def verify_share_link(filename: str, params: Mapping[str, str], client_ip: str) -> Dict:
+    """
+    Check a share link's signature and restrictions without touching the session store.
+    Returns the link's restrictions; raises HTTPException(403) for invalid links
+    and HTTPException(410) for expired ones.
+    """
+    try:
+        expires = int(params.get("expires", ""))
+        max_downloads = int(params.get("max") or 0)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid share link")
+    ip = params.get("ip", "")
+    link_id = params.get("id", "")
+
+    expected = _sign(filename, expires, ip, max_downloads, link_id)
+    if not hmac.compare_digest(expected, params.get("sig", "")):
+        logger.warning(f"Invalid share link signature for {filename} from IP: {client_ip}")
+        raise HTTPException(status_code=403, detail="Invalid share link")
+
+    if expires < time.time():
+        raise HTTPException(status_code=410, detail="This share link has expired")
+
+    if ip and ip != client_ip:
+        logger.warning(f"Share link for {filename} restricted to {ip} used from IP: {client_ip}")
+        raise HTTPException(status_code=403, detail="This share link is not valid from your address")
+
+    return {"expires": expires, "ip": ip or None, "max_downloads": max_downloads or None, "link_id": link_id}
+
+
+def count_share_download(link: Dict):
+    """Count a download of a limited link; raises HTTPException(410) once the limit is used up."""
+    if not link["max_downloads"]:
+        return
+    if not get_metadata_store().count_share_download(link["link_id"], link["max_downloads"], link["expires"]):
+        raise HTTPException(status_code=410, detail="This share link has reached its download limit")
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from typing import Dict, Set
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from app.utils.config import get_config
+from app.utils.logging_utils import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Source path (relative to the static directory) -> fingerprinted path
+_manifest: Dict[str, str] = {}
+_fingerprinted: Set[str] = set()
+_assets_version = ""
+
+# Only text assets are worth precompressing
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map", ".ico"}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def parse_accept_encoding(header: str) -> Set[str]:
+    """Get the content codings an Accept-Encoding header allows (q > 0)."""
+    accepted = set()
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def _write_if_missing(path: str, data: bytes):
+    """Write a build output once; outputs are content-addressed, so existing ones are current."""
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_static_assets(source_dir: str, build_dir: str, precompress: bool = True) -> Dict[str, str]:
+    """
+    Fingerprint the static assets and precompress them.
+    Every file under source_dir is copied to build_dir with a content hash
+    in its name (css/style.css -> css/style.1a2b3c4d5e6f.css), next to
+    .gz and, if the brotli package is installed, .br variants. Returns
+    the manifest mapping source paths to fingerprinted paths.
+    """
+    global _manifest, _fingerprinted, _assets_version
+
+    manifest = {}
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith("."):
+                continue
+
+            source_path = os.path.join(root, name)
+            relative_path = os.path.relpath(source_path, source_dir)
+            with open(source_path, "rb") as f:
+                content = f.read()
+
+            stem, ext = os.path.splitext(relative_path)
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            fingerprinted = f"{stem}.{digest}{ext}"
+            target_path = os.path.join(build_dir, fingerprinted)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            _write_if_missing(target_path, content)
+
+            if precompress and ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                # Built once, so use the best compression available
+                compressed = gzip.compress(content, compresslevel=9, mtime=0)
+                if len(compressed) < len(content):
+                    _write_if_missing(f"{target_path}.gz", compressed)
+                if brotli is not None:
+                    compressed = brotli.compress(content, quality=11)
+                    if len(compressed) < len(content):
+                        _write_if_missing(f"{target_path}.br", compressed)
+
+            manifest[relative_path.replace(os.sep, "/")] = fingerprinted.replace(os.sep, "/")
+
+    # Written for deployment tooling; the app itself uses the in-memory copy
+    manifest_path = os.path.join(build_dir, "manifest.json")
+    with open(f"{manifest_path}.{os.getpid()}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.{os.getpid()}.tmp", manifest_path)
+
+    _manifest = manifest
+    _fingerprinted = set(manifest.values())
+    _assets_version = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:12]
+    logger.info(f"Built {len(manifest)} static assets in {build_dir} (brotli: {'yes' if brotli else 'no'})")
+    return manifest
+
+
+def static_url(path: str) -> str:
+    """URL of a static asset, fingerprinted once the assets have been built (template helper)."""
+    path = path.lstrip("/")
+    return f"/static/{_manifest.get(path, path)}"
+
+
+def get_assets_version() -> str:
+    """Short hash of the built assets, for cache keys of pages that link to them."""
+    return _assets_version
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    Serves fingerprinted assets from the build directory, falling back to
+    the source directory for anything else.
+    Fingerprinted assets never change, so they are cached for a year
+    without revalidation, and a .br or .gz variant is sent to clients
+    that accept it. Other files are revalidated on every use.
+    """
+
+    def __init__(self, source_dir: str, build_dir: str):
+        os.makedirs(build_dir, exist_ok=True)
+        super().__init__(directory=build_dir)
+        self.all_directories.append(source_dir)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        if self.get_path(scope).replace(os.sep, "/") in _fingerprinted:
+            request_headers = Headers(scope=scope)
+            accepted = parse_accept_encoding(request_headers.get("accept-encoding", ""))
+
+            for coding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                variant_path = f"{full_path}{suffix}"
+                if coding in accepted and os.path.exists(variant_path):
+                    media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+                    response = FileResponse(variant_path, status_code=status_code, media_type=media_type,
+                                            stat_result=os.stat(variant_path), method=scope["method"])
+                    response.headers["Content-Encoding"] = coding
+                    break
+            else:
+                response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                        method=scope["method"])
+
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            response.headers["Vary"] = "Accept-Encoding"
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,675 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.utils.config import get_config
+from app.utils.file_utils import get_incoming_path, resolve_file_path, try_lock
+from app.utils.logging_utils import get_logger
+from app.utils.metadata import get_metadata_store
+
+logger = get_logger(__name__)
+config = get_config()
+
+# Size of the chunks handed to responses when streaming from the object store
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Global storage instance
+_storage = None
+
+
+class StorageError(OSError):
+    """An object store request failed."""
+
+
+class ObjectWriter(ABC):
+    """
+    Streams one object into the store while it is being produced.
+    Feed it with `await write(data)`, then call complete() (blocking) to
+    publish the object, or abort() to drop what was sent.
+    """
+
+    @abstractmethod
+    async def write(self, data: bytes):
+        ...
+
+    @abstractmethod
+    def complete(self):
+        ...
+
+    @abstractmethod
+    def abort(self):
+        ...
+
+
+class ObjectStore(ABC):
+    """Interface of the object store drivers. Keys are file names."""
+
+    name = "object store"
+
+    @abstractmethod
+    def open_writer(self, key: str) -> ObjectWriter:
+        ...
+
+    @abstractmethod
+    def put_file(self, key: str, path) -> None:
+        ...
+
+    @abstractmethod
+    def iter_range(self, key: str, first: int, last: int) -> Iterator[bytes]:
+        """Yield bytes first..last (inclusive) of an object."""
+
+    @abstractmethod
+    def fetch(self, key: str, dest_path, size: int) -> None:
+        """Copy a whole object of known size to a local file."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[Dict]:
+        """Get an object's size and modification time, or None if it doesn't exist."""
+
+
+class _DirectoryWriter(ObjectWriter):
+    def __init__(self, store: "DirectoryObjectStore", key: str):
+        self.path = store.path(key)
+        self.temp_path = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.part")
+        self.file = open(self.temp_path, "wb")
+
+    async def write(self, data: bytes):
+        # A slow (e.g. network) disk must not stall the event loop
+        await asyncio.to_thread(self.file.write, data)
+
+    def complete(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        self.temp_path.unlink(missing_ok=True)
+
+
+class DirectoryObjectStore(ObjectStore):
+    """
+    Object store driver keeping objects as files in a directory, e.g. a
+    network or bulk disk mounted next to the fast local one. Also a local
+    stand-in for an S3 bucket.
+    """
+
+    name = "directory"
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True, parents=True)
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def open_writer(self, key: str) -> ObjectWriter:
+        return _DirectoryWriter(self, key)
+
+    def put_file(self, key: str, path) -> None:
+        writer = _DirectoryWriter(self, key)
+        try:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, writer.file, STREAM_CHUNK_SIZE)
+            writer.complete()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def iter_range(self, key: str, first: int, last: int) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def fetch(self, key: str, dest_path, size: int) -> None:
+        shutil.copyfile(self.path(key), dest_path)
+
+    def delete(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    def stat(self, key: str) -> Optional[Dict]:
+        try:
+            stats = self.path(key).stat()
+        except FileNotFoundError:
+            return None
+        return {"size": stats.st_size, "modified": stats.st_mtime}
+
+
+class _S3MultipartWriter(ObjectWriter):
+    """
+    Multipart upload fed as data arrives: every full part is uploaded on
+    the store's thread pool while the next one fills, with at most
+    max_concurrency parts of this object in flight. Objects smaller than
+    one part are sent with a single PUT.
+    """
+
+    def __init__(self, store: "S3ObjectStore", key: str):
+        self.store = store
+        self.key = key
+        self.buffer = bytearray()
+        self.upload_id: Optional[Future] = None
+        self.parts: List[Future] = []
+
+    def _create(self) -> str:
+        response = self.store.call("create_multipart_upload", Bucket=self.store.bucket, Key=self.store.object_key(self.key))
+        return response["UploadId"]
+
+    def _upload_part(self, number: int, data: bytes) -> Dict:
+        response = self.store.call(
+            "upload_part", Bucket=self.store.bucket, Key=self.store.object_key(self.key),
+            UploadId=self.upload_id.result(), PartNumber=number, Body=data
+        )
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    def _feed(self, data) -> Optional[Future]:
+        """Queue data; returns a part to wait for once too many are in flight."""
+        self.buffer += data
+        part_size = self.store.part_size
+        while len(self.buffer) >= part_size:
+            part = bytes(self.buffer[:part_size])
+            del self.buffer[:part_size]
+            if self.upload_id is None:
+                self.upload_id = self.store.executor.submit(self._create)
+            self.parts.append(self.store.executor.submit(self._upload_part, len(self.parts) + 1, part))
+
+        pending = [part for part in self.parts if not part.done()]
+        if len(pending) >= self.store.max_concurrency:
+            return pending[0]
+        return None
+
+    async def write(self, data: bytes):
+        waiting = self._feed(data)
+        if waiting is not None:
+            await asyncio.wrap_future(waiting)
+
+    def write_blocking(self, data: bytes):
+        waiting = self._feed(data)
+        if waiting is not None:
+            waiting.result()
+
+    def complete(self):
+        try:
+            if self.upload_id is None:
+                self.store.call("put_object", Bucket=self.store.bucket, Key=self.store.object_key(self.key),
+                                Body=bytes(self.buffer))
+                return
+
+            if self.buffer:
+                self.parts.append(self.store.executor.submit(self._upload_part, len(self.parts) + 1, bytes(self.buffer)))
+                self.buffer = bytearray()
+            parts = [part.result() for part in self.parts]
+            self.store.call(
+                "complete_multipart_upload", Bucket=self.store.bucket, Key=self.store.object_key(self.key),
+                UploadId=self.upload_id.result(), MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+        for part in self.parts:
+            part.cancel()
+        try:
+            upload_id = self.upload_id.result()
+            for part in self.parts:
+                if not part.cancelled():
+                    part.exception()
+            self.store.call("abort_multipart_upload", Bucket=self.store.bucket,
+                            Key=self.store.object_key(self.key), UploadId=upload_id)
+        except Exception as e:
+            # The bucket's lifecycle rules clean up what is left
+            logger.warning(f"Failed to abort multipart upload of {self.key}: {str(e)}")
+        self.upload_id = None
+
+
+class S3ObjectStore(ObjectStore):
+    """
+    Object store driver for S3 and S3-compatible services (MinIO, Ceph,
+    R2, ...). Uploads are multipart with parts sent in parallel, and large
+    reads are split into ranged GETs fetched in parallel. Needs boto3.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, access_key_id: Optional[str] = None,
+                 secret_access_key: Optional[str] = None, addressing_style: str = "auto",
+                 part_size_mb: int = 8, max_concurrency: int = 4, max_connections: int = 16):
+        try:
+            # Loaded only when the S3 driver is configured
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("The s3 storage driver requires boto3 (pip install boto3)")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = part_size_mb * 1024 * 1024
+        self.max_concurrency = max_concurrency
+        # boto3 clients are thread-safe; credentials fall back to the usual AWS_* variables
+        self.client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+            config=Config(
+                max_pool_connections=max_connections,
+                retries={"max_attempts": 5, "mode": "standard"},
+                s3={"addressing_style": addressing_style},
+            ),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="s3")
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def call(self, operation: str, **kwargs):
+        try:
+            return getattr(self.client, operation)(**kwargs)
+        except Exception as e:
+            if _is_not_found(e):
+                raise FileNotFoundError(kwargs.get("Key"))
+            raise StorageError(f"S3 {operation} failed: {str(e)}")
+
+    def open_writer(self, key: str) -> ObjectWriter:
+        return _S3MultipartWriter(self, key)
+
+    def put_file(self, key: str, path) -> None:
+        writer = _S3MultipartWriter(self, key)
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(self.part_size)
+                    if not data:
+                        break
+                    writer.write_blocking(data)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.complete()
+
+    def _get_range(self, key: str, first: int, last: int) -> bytes:
+        response = self.call("get_object", Bucket=self.bucket, Key=self.object_key(key), Range=f"bytes={first}-{last}")
+        return response["Body"].read()
+
+    def _ranges(self, first: int, last: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + self.part_size, last + 1) - 1) for start in range(first, last + 1, self.part_size)]
+
+    def iter_range(self, key: str, first: int, last: int) -> Iterator[bytes]:
+        # Read ahead: the next parts download while the current one is sent
+        ranges = self._ranges(first, last)
+        pending: List[Future] = []
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < self.max_concurrency:
+                    pending.append(self.executor.submit(self._get_range, key, *ranges.pop(0)))
+                data = memoryview(pending.pop(0).result())
+                for offset in range(0, len(data), STREAM_CHUNK_SIZE):
+                    yield bytes(data[offset:offset + STREAM_CHUNK_SIZE])
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def fetch(self, key: str, dest_path, size: int) -> None:
+        with open(dest_path, "wb") as f:
+            f.truncate(size)
+            fd = f.fileno()
+
+            def fetch_range(first, last):
+                data = self._get_range(key, first, last)
+                os.pwrite(fd, data, first)
+
+            # Parts land at their offsets in whatever order they arrive
+            semaphore = threading.BoundedSemaphore(self.max_concurrency)
+            futures = []
+            for first, last in self._ranges(0, size - 1):
+                semaphore.acquire()
+                future = self.executor.submit(fetch_range, first, last)
+                future.add_done_callback(lambda _: semaphore.release())
+                futures.append(future)
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def delete(self, key: str) -> None:
+        self.call("delete_object", Bucket=self.bucket, Key=self.object_key(key))
+
+    def stat(self, key: str) -> Optional[Dict]:
+        try:
+            response = self.call("head_object", Bucket=self.bucket, Key=self.object_key(key))
+        except FileNotFoundError:
+            return None
+        return {"size": response["ContentLength"], "modified": response["LastModified"].timestamp()}
+
+
+def _is_not_found(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    return str(response.get("Error", {}).get("Code")) in ("404", "NoSuchKey", "NotFound")
+
+
+def create_object_store(storage_config) -> ObjectStore:
+    """Create the object store driver from the storage configuration."""
+    if storage_config["driver"] == "directory":
+        return DirectoryObjectStore(storage_config["directory"])
+
+    s3_config = storage_config["s3"]
+    return S3ObjectStore(
+        s3_config["bucket"],
+        prefix=s3_config.get("prefix", ""),
+        endpoint_url=s3_config.get("endpoint_url"),
+        region=s3_config.get("region"),
+        access_key_id=s3_config.get("access_key_id"),
+        secret_access_key=s3_config.get("secret_access_key"),
+        addressing_style=s3_config.get("addressing_style", "auto"),
+        part_size_mb=s3_config.get("part_size_mb", 8),
+        max_concurrency=s3_config.get("max_concurrency", 4),
+        max_connections=s3_config.get("max_connections", 16),
+    )
+
+
+def get_storage():
+    """
+    Get the file storage.
+    Uses singleton pattern so every module shares the same object store client.
+    """
+    global _storage
+
+    if _storage is None:
+        storage_config = config["storage"]
+        mode = storage_config.get("mode", "local")
+        cache_config = storage_config.get("cache", {})
+        _storage = FileStorage(
+            get_metadata_store(),
+            config["upload"]["directory"],
+            mode=mode,
+            remote=create_object_store(storage_config) if mode != "local" else None,
+            cache_max_mb=cache_config.get("max_mb", 10240),
+            fill_max_mb=cache_config.get("fill_max_mb", 1024),
+            tier_after_days=storage_config.get("tier_after_days", 7),
+            interval_seconds=storage_config.get("interval_seconds", 60),
+        )
+
+    return _storage
+
+
+class FileStorage:
+    """
+    Where uploaded files live.
+    - local: only in the upload directory
+    - object: every upload is written through to the object store while it
+      streams in; the upload directory keeps copies of recently used files
+      as a read-through cache
+    - tiered: uploads stay in the upload directory (the hot tier) and move
+      to the object store once they are older than tier_after_days or the
+      hot tier outgrows its size
+    In both object store modes, local copies are evicted least recently
+    used first to keep the upload directory under cache.max_mb, and files
+    without a local copy are streamed from the object store and copied
+    back in the background when read.
+    """
+
+    def __init__(self, store, upload_dir, mode="local", remote: Optional[ObjectStore] = None,
+                 cache_max_mb=10240, fill_max_mb=1024, tier_after_days=7, interval_seconds=60):
+        self.store = store
+        self.upload_dir = Path(upload_dir)
+        self.mode = mode
+        self.remote = remote
+        self.cache_max_bytes = int(cache_max_mb * 1024 * 1024)
+        self.fill_max_bytes = int(fill_max_mb * 1024 * 1024)
+        self.tier_after_seconds = tier_after_days * 24 * 60 * 60
+        self.interval = interval_seconds
+
+        self._filling = set()
+        self._filling_lock = threading.Lock()
+        self._lock_file = None
+
+        # Counters exposed through stats()
+        self.local_hits = 0
+        self.remote_reads = 0
+        self.fills_total = 0
+        self.uploaded_total = 0
+        self.evicted_files_total = 0
+        self.evicted_bytes_total = 0
+        self.errors_total = 0
+
+        if remote is not None:
+            logger.info(
+                f"Storage initialized: {mode} mode with the {remote.name} driver, "
+                f"local copies up to {cache_max_mb} MB"
+            )
+
+    @property
+    def writes_through(self) -> bool:
+        """Whether uploads go to the object store as they are received."""
+        return self.mode == "object"
+
+    def open_writer(self, name: str) -> Optional[ObjectWriter]:
+        """Start streaming an upload to the object store (object mode only)."""
+        return self.remote.open_writer(name) if self.writes_through else None
+
+    def is_remote_only(self, record: Optional[Dict]) -> bool:
+        """Whether a file has to be read from the object store."""
+        return bool(self.remote is not None and record and record.get("remote") and not record.get("local"))
+
+    def local_path(self, name: str, record: Optional[Dict] = None) -> Path:
+        """Where a file's local copy goes."""
+        return self.upload_dir / ((record or {}).get("path") or name)
+
+    def touch(self, name: str):
+        """Note a read of a local copy, for least-recently-used eviction."""
+        self.local_hits += 1
+        if self.remote is not None:
+            self.store.set_storage(name, accessed_at=time.time())
+
+    def iter_remote(self, name: str, byte_range: Optional[Tuple[int, int]], size: int) -> Iterator[bytes]:
+        """Stream a file (or a byte range of it) from the object store."""
+        first, last = byte_range or (0, size - 1)
+        self.remote_reads += 1
+        if size == 0:
+            return iter(())
+        return self.remote.iter_range(name, first, last)
+
+    def ensure_local(self, name: str, record: Optional[Dict] = None) -> Optional[Path]:
+        """
+        Get the path of a file's local copy, copying it from the object store
+        first if needed. Blocking. Returns None if the file does not exist.
+        """
+        if record is None:
+            record = self.store.get_file(name)
+        path = resolve_file_path(name, record)
+        if path is not None or not self.is_remote_only(record):
+            return path
+
+        return self.fill(name, record)
+
+    def fill(self, name: str, record: Dict) -> Optional[Path]:
+        """Copy a file from the object store into the upload directory. Blocking."""
+        destination = self.local_path(name, record)
+        incoming_path = get_incoming_path()
+        started = time.perf_counter()
+        try:
+            self.remote.fetch(name, incoming_path, record["size"])
+            destination.parent.mkdir(exist_ok=True, parents=True)
+            os.replace(incoming_path, destination)
+        except FileNotFoundError:
+            incoming_path.unlink(missing_ok=True)
+            logger.error(f"File {name} is indexed as stored remotely but is missing from the {self.remote.name} store")
+            return None
+        except BaseException:
+            incoming_path.unlink(missing_ok=True)
+            raise
+
+        self.store.set_storage(name, local=True, accessed_at=time.time())
+        self.fills_total += 1
+        logger.info(f"Copied {name} from the {self.remote.name} store in {time.perf_counter() - started:.2f}s")
+        return destination
+
+    def schedule_fill(self, name: str, record: Dict):
+        """Copy a file read from the object store back to local disk in the background."""
+        # Files that would not fit the cache would only be evicted again
+        if record["size"] > min(self.fill_max_bytes, self.cache_max_bytes):
+            return
+        with self._filling_lock:
+            if name in self._filling:
+                return
+            self._filling.add(name)
+
+        def run():
+            try:
+                self.fill(name, record)
+            except Exception as e:
+                self.errors_total += 1
+                logger.error(f"Failed to copy {name} from the {self.remote.name} store: {str(e)}")
+            finally:
+                with self._filling_lock:
+                    self._filling.discard(name)
+
+        asyncio.get_running_loop().run_in_executor(None, run)
+
+    def upload(self, name: str, path) -> None:
+        """Copy a local file to the object store and record that it is there. Blocking."""
+        self.remote.put_file(name, path)
+        self.store.set_storage(name, remote=True)
+        self.uploaded_total += 1
+
+    def delete(self, name: str, relative_path: Optional[str] = None):
+        """Delete a file's local copy and its object. Blocking."""
+        try:
+            os.remove(self.upload_dir / (relative_path or name))
+        except FileNotFoundError:
+            pass
+        if self.remote is not None:
+            try:
+                self.remote.delete(name)
+            except FileNotFoundError:
+                pass
+
+    def _is_leader(self) -> bool:
+        """Try to become the single worker that moves and evicts files."""
+        if self._lock_file is not None:
+            return True
+
+        self._lock_file = try_lock(f"{self.store.db_path}.storage.lock")
+        return self._lock_file is not None
+
+    async def run_forever(self):
+        """Tier and evict files every interval until cancelled."""
+        logger.info(f"Storage maintenance started (interval: {self.interval}s)")
+        while True:
+            try:
+                if self._is_leader():
+                    await asyncio.to_thread(self.run_once)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors_total += 1
+                logger.error(f"Storage maintenance failed: {str(e)}")
+
+            await asyncio.sleep(self.interval)
+
+    def run_once(self) -> Dict:
+        """
+        Move old files to the object store (tiered mode) and evict local
+        copies until the upload directory is within its size. Blocking.
+        """
+        result = {"uploaded": 0, "evicted_files": 0, "evicted_bytes": 0, "errors": 0}
+
+        if self.mode == "tiered" and self.tier_after_seconds:
+            cutoff = time.time() - self.tier_after_seconds
+            while True:
+                batch = self.store.get_not_remote(cutoff)
+                if not batch:
+                    break
+                for row in batch:
+                    if not self._evict(row, result):
+                        return result
+
+        excess = self.store.get_local_bytes() - self.cache_max_bytes
+        while excess > 0:
+            batch = self.store.get_least_recently_used()
+            if not batch:
+                break
+            for row in batch:
+                if excess <= 0:
+                    break
+                if not self._evict(row, result):
+                    return result
+                excess -= row["size"]
+
+        if result["uploaded"] or result["evicted_files"]:
+            logger.info(
+                f"Storage maintenance moved {result['uploaded']} file(s) to the {self.remote.name} store "
+                f"and evicted {result['evicted_files']} local cop(ies), {result['evicted_bytes']} bytes"
+            )
+        return result
+
+    def _evict(self, row: Dict, result: Dict) -> bool:
+        """Drop a file's local copy, uploading it first if the object store doesn't have it yet."""
+        path = self.upload_dir / (row["path"] or row["name"])
+        try:
+            if not row["remote"]:
+                self.upload(row["name"], path)
+                result["uploaded"] += 1
+            self.store.set_storage(row["name"], local=False)
+            path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            # Deleted meanwhile; without a copy in the object store it is gone
+            if row["remote"]:
+                self.store.set_storage(row["name"], local=False)
+            else:
+                self.store.remove_file(row["name"])
+            return True
+        except OSError as e:
+            # Stop for this run rather than retrying the same file over and over
+            self.errors_total += 1
+            result["errors"] += 1
+            logger.error(f"Failed to move {row['name']} to the {self.remote.name} store: {str(e)}")
+            return False
+
+        result["evicted_files"] += 1
+        result["evicted_bytes"] += row["size"]
+        self.evicted_files_total += 1
+        self.evicted_bytes_total += row["size"]
+        return True
+
+    def stats(self) -> Dict:
+        """Storage metrics."""
+        return {
+            "mode": self.mode,
+            "driver": self.remote.name if self.remote is not None else None,
+            "leader": self._lock_file is not None,
+            "local_bytes": self.store.get_local_bytes(),
+            "cache_max_bytes": self.cache_max_bytes if self.remote is not None else None,
+            "local_hits": self.local_hits,
+            "remote_reads": self.remote_reads,
+            "fills_total": self.fills_total,
+            "filling": len(self._filling),
+            "uploaded_total": self.uploaded_total,
+            "evicted_files_total": self.evicted_files_total,
+            "evicted_bytes_total": self.evicted_bytes_total,
+            "errors_total": self.errors_total,
+        }
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+
+from app.utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class UploadScheduler:
+    """
+    Admission control for concurrent uploads.
+    Caps the number of uploads running at once, globally and per user,
+    and parks the overflow in a bounded wait queue. When the queue is
+    full (or a waiter times out) the upload is rejected with a 503 and
+    a Retry-After header instead of slowing every other upload down.
+
+    Limits apply per worker process.
+    """
+
+    def __init__(self, max_active=4, max_per_user=2, max_queue=32,
+                 queue_timeout_seconds=30, retry_after_seconds=5):
+        self.max_active = max_active
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_seconds
+        self.retry_after = retry_after_seconds
+
+        self.active = 0
+        self.active_per_user = defaultdict(int)
+        self.waiting = 0
+
+        # Counters exposed through stats()
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.timed_out_total = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        self._condition = None
+        logger.info(
+            f"Upload scheduler initialized: {max_active} active uploads "
+            f"({max_per_user} per user), queue of {max_queue}"
+        )
+
+    @property
+    def condition(self):
+        # Created lazily so the scheduler can be built before the event loop starts
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _can_start(self, username):
+        if self.max_active and self.active >= self.max_active:
+            return False
+        if self.max_per_user and self.active_per_user.get(username, 0) >= self.max_per_user:
+            return False
+        return True
+
+    def _reject(self, reason):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Server is busy ({reason}). Please retry later.",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def acquire(self, username):
+        """Wait for an upload slot for a user. Returns the time spent queued."""
+        start = time.monotonic()
+
+        async with self.condition:
+            if not self._can_start(username):
+                if self.waiting >= self.max_queue:
+                    self.rejected_total += 1
+                    logger.warning(f"Upload queue full, rejecting upload from user '{username}'")
+                    self._reject("upload queue full")
+
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self.condition.wait_for(lambda: self._can_start(username)),
+                        timeout=self.queue_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.timed_out_total += 1
+                    logger.warning(f"Upload from user '{username}' timed out in the upload queue")
+                    self._reject("timed out waiting for an upload slot")
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.active_per_user[username] += 1
+            self.admitted_total += 1
+
+        waited = time.monotonic() - start
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return waited
+
+    async def release(self, username):
+        """Give an upload slot back and wake up queued uploads."""
+        async with self.condition:
+            self.active -= 1
+            self.active_per_user[username] -= 1
+            if self.active_per_user[username] <= 0:
+                del self.active_per_user[username]
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, username):
+        """Context manager holding an upload slot for the duration of an upload."""
+        await self.acquire(username)
+        try:
+            yield
+        finally:
+            await self.release(username)
+
+    def stats(self):
+        """Current concurrency and queue statistics."""
+        return {
+            "active": self.active,
+            "active_per_user": dict(self.active_per_user),
+            "queued": self.waiting,
+            "max_active": self.max_active,
+            "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "timed_out_total": self.timed_out_total,
+            "avg_wait_seconds": round(self.wait_seconds_total / self.admitted_total, 4) if self.admitted_total else 0.0,
+            "max_wait_seconds": round(self.wait_seconds_max, 4),
+        }
@@ -0,0 +1,247 @@
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import bcrypt
+import httpx
+import yaml
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Accounts created for every benchmark run
+API_USER = ("bench-api", "bench-api-password")
+READER_USER = ("bench-reader", "bench-reader-password")
+WRITER_PASSWORD = "bench-writer-password"
+
+
+def latency_stats(samples: List[float]) -> Dict:
+    """Summarise latency samples (seconds) in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "requests": len(ordered),
+    }
+
+
+class BenchEnvironment:
+    """
+    A throwaway copy of the app's configuration for benchmarking.
+    Uploads, logs and the file index live in a temporary directory; rate
+    limiting is off and log output is reduced so it doesn't skew results.
+    """
+
+    def __init__(self, writers: int = 16, bcrypt_rounds: int = 12, overrides: Optional[Dict] = None):
+        self.root = Path(tempfile.mkdtemp(prefix="upload-bench-"))
+        self.upload_dir = self.root / "uploads"
+        self.config_path = self.root / "config.yml"
+        self.writers = [(f"bench-writer-{i}", WRITER_PASSWORD) for i in range(writers)]
+
+        with open(REPO_ROOT / "config" / "config.yml") as f:
+            config = yaml.safe_load(f)
+
+        config["server"]["ssl"]["enabled"] = False
+        config["upload"]["directory"] = str(self.upload_dir)
+        config["upload"]["metadata_db"] = str(self.upload_dir / ".metadata.db")
+        config["logging"]["level"] = "WARNING"
+        config["logging"]["file"] = str(self.root / "logs" / "server.log")
+        config["logging"]["audit_file"] = str(self.root / "logs" / "audit.log")
+        config.setdefault("static", {})["build_dir"] = str(self.root / "static")
+        config["security"]["users_file"] = str(self.root / "users.yml")
+        config["security"]["ip_whitelist_file"] = str(self.root / "ip_whitelist.yml")
+        config["security"]["cookies"]["secure"] = False
+        config["rate_limit"]["enabled"] = False
+        self.config = config
+        for section, values in (overrides or {}).items():
+            self.set_config(section, values)
+        self.write_config()
+
+        with open(self.root / "ip_whitelist.yml", "w") as f:
+            yaml.safe_dump({"enabled": False, "whitelist": []}, f)
+
+        # The API user gets production-strength hashing; other accounts only log in once
+        users = [
+            self._user(*API_USER, "writer", bcrypt_rounds),
+            self._user(*READER_USER, "reader", 4),
+        ] + [self._user(name, password, "writer", 4) for name, password in self.writers]
+        with open(self.root / "users.yml", "w") as f:
+            yaml.safe_dump({"users": users}, f)
+
+        self.upload_dir.mkdir(parents=True)
+
+    def set_config(self, section: str, values: Dict):
+        """Merge values into a configuration section; call write_config() to save."""
+        def merge(target, source):
+            for key, value in source.items():
+                if isinstance(value, dict) and isinstance(target.get(key), dict):
+                    merge(target[key], value)
+                else:
+                    target[key] = value
+
+        merge(self.config.setdefault(section, {}), values)
+
+    def write_config(self):
+        with open(self.config_path, "w") as f:
+            yaml.safe_dump(self.config, f)
+
+    @staticmethod
+    def _user(username, password, role, rounds):
+        return {
+            "username": username,
+            "password_hash": bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode(),
+            "role": role,
+            "enabled": True,
+        }
+
+    def seed_files(self, count: int, size: int = 1024):
+        """Fill the upload directory with `count` files directly on disk."""
+        existing = len([name for name in os.listdir(self.upload_dir) if not name.startswith(".")])
+        payload = os.urandom(size)
+        for i in range(existing, count):
+            with open(self.upload_dir / f"seed_{i:07d}.dat", "wb") as f:
+                f.write(payload)
+
+    def clear_files(self):
+        """Remove all uploaded files (the file index is rebuilt on the next reconcile)."""
+        for entry in os.scandir(self.upload_dir):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class InProcessTarget:
+    """Runs the app inside the benchmark process through an ASGI transport."""
+
+    name = "inprocess"
+
+    def __init__(self, env: BenchEnvironment):
+        self.env = env
+        os.environ["CONFIG_PATH"] = str(env.config_path)
+        from app.main import app
+        self.app = app
+
+    async def start(self):
+        await self.app.router.startup()
+
+    async def stop(self):
+        await self.app.router.shutdown()
+
+    async def refresh_index(self):
+        """Pick up files seeded directly on disk."""
+        from app.utils.metadata import get_metadata_store
+        await asyncio.to_thread(get_metadata_store().reconcile, self.env.upload_dir)
+
+    async def reload_config(self):
+        """Apply a changed configuration file, as the running app would on SIGHUP."""
+        from app.utils.config import reload_config
+        if not reload_config():
+            raise RuntimeError("The benchmark configuration failed to load")
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app, client=("127.0.0.1", 50000)),
+            base_url="http://bench",
+            timeout=120,
+            **kwargs
+        )
+
+
+class UvicornTarget:
+    """Runs the app in a local uvicorn subprocess and talks to it over HTTP."""
+
+    name = "uvicorn"
+
+    def __init__(self, env: BenchEnvironment, workers: int = 1):
+        self.env = env
+        self.workers = workers
+        self.process = None
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+
+    async def start(self):
+        env = dict(os.environ, CONFIG_PATH=str(self.env.config_path))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=REPO_ROOT, env=env
+        )
+        deadline = time.monotonic() + 60
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                try:
+                    if (await client.get(f"http://127.0.0.1:{self.port}/health")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("uvicorn did not become healthy within 60 seconds")
+
+    async def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+            self.process = None
+
+    async def refresh_index(self):
+        """The file index is reconciled at startup, so restart the server."""
+        await self.stop()
+        await self.start()
+
+    async def reload_config(self):
+        await self.stop()
+        await self.start()
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{self.port}",
+            timeout=120,
+            limits=httpx.Limits(max_connections=256, max_keepalive_connections=256),
+            **kwargs
+        )
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str):
+    """Log a client in with the web form so it carries a session cookie."""
+    response = await client.post("/login", data={"username": username, "password": password})
+    if response.status_code != 303:
+        raise RuntimeError(f"Login failed for {username}: {response.status_code}")
+
+
+async def timed_requests(make_request, count: int, concurrency: int) -> Dict:
+    """Run `count` requests with `concurrency` in flight; returns latencies and wall time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request(i)
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                errors += 1
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return {"latencies": latencies, "wall_seconds": time.perf_counter() - started, "errors": errors}
@@ -0,0 +1,146 @@
+"""
+Benchmark and load-test suite for the upload server.
+
+Usage:
+    python -m benchmarks.run                          # full run, in-process
+    python -m benchmarks.run --profile quick          # smaller, faster run
+    python -m benchmarks.run --target uvicorn         # against a local uvicorn subprocess
+    python -m benchmarks.run --output results.json    # save results
+    python -m benchmarks.run --compare baseline.json  # flag regressions against a baseline
+    python -m benchmarks.run --compare-only baseline.json results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.harness import REPO_ROOT, BenchEnvironment, InProcessTarget, UvicornTarget
+from benchmarks.scenarios import PROFILES, SCENARIOS
+
+# Metrics where a higher value is better; for everything else (latencies) lower is better
+HIGHER_IS_BETTER = ("mb_per_s", "req_per_s")
+# Metrics compared against the baseline
+COMPARED_METRICS = ("mean_ms", "p50_ms", "p95_ms", "mb_per_s", "req_per_s")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_benchmarks(args) -> Dict:
+    profile = PROFILES[args.profile]
+    scenarios = args.scenarios or list(SCENARIOS)
+
+    env = BenchEnvironment(writers=16, bcrypt_rounds=args.bcrypt_rounds)
+    target = InProcessTarget(env) if args.target == "inprocess" else UvicornTarget(env)
+
+    results = {}
+    await target.start()
+    try:
+        for name in scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            started = time.perf_counter()
+            results.update(await SCENARIOS[name](target, env, **profile[name]))
+            print(f"  done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        await target.stop()
+        env.cleanup()
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "target": args.target,
+            "profile": args.profile,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold_percent: float) -> List[Dict]:
+    """List every compared metric that got worse than the baseline by more than the threshold."""
+    regressions = []
+    for key, metrics in current["results"].items():
+        base_metrics = baseline["results"].get(key)
+        if not base_metrics:
+            continue
+
+        for metric in COMPARED_METRICS:
+            if metric not in metrics or not base_metrics.get(metric):
+                continue
+
+            base_value, value = base_metrics[metric], metrics[metric]
+            change = (value - base_value) / base_value * 100
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > threshold_percent:
+                regressions.append({
+                    "benchmark": key,
+                    "metric": metric,
+                    "baseline": base_value,
+                    "current": value,
+                    "change_percent": round(change, 1),
+                })
+
+    return regressions
+
+
+def print_report(results: Dict, regressions: List[Dict]):
+    for key, metrics in results["results"].items():
+        summary = ", ".join(f"{name}={value}" for name, value in metrics.items())
+        print(f"{key}: {summary}", file=sys.stderr)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):", file=sys.stderr)
+        for r in regressions:
+            print(f"  {r['benchmark']} {r['metric']}: {r['baseline']} -> {r['current']} ({r['change_percent']:+}%)",
+                  file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the upload server.")
+    parser.add_argument("--target", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="full")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), help="Only run these scenarios")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="bcrypt cost for the API user")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare results against a stored baseline")
+    parser.add_argument("--compare-only", nargs=2, metavar=("BASELINE", "RESULTS"),
+                        help="Compare two stored result files without running anything")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    args = parser.parse_args()
+
+    if args.compare_only:
+        with open(args.compare_only[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare_only[1]) as f:
+            results = json.load(f)
+        args.compare = args.compare_only[0]
+    else:
+        results = asyncio.run(run_benchmarks(args))
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    elif not args.compare_only:
+        print(json.dumps(results, indent=2))
+
+    regressions = compare(baseline, results, args.threshold) if args.compare else []
+    print_report(results, regressions)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
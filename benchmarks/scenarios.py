@@ -0,0 +1,210 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Dict
+
+import httpx
+
+from benchmarks.harness import API_USER, READER_USER, latency_stats, login, timed_requests
+
+
+async def _timed_uploads(target, env, payload: bytes, concurrency: int, uploads: int) -> Dict:
+    """Upload `uploads` copies of payload with `concurrency` in flight, then clear them away."""
+    # One logged-in writer per concurrent stream so per-user caps don't serialise them
+    clients = []
+    for username, password in env.writers[:concurrency]:
+        client = target.client()
+        await login(client, username, password)
+        clients.append(client)
+
+    async def upload(i):
+        client = clients[i % len(clients)]
+        return await client.post("/upload", files={"file": (f"bench_{i}.dat", payload)})
+
+    try:
+        run = await timed_requests(upload, uploads, concurrency)
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    env.clear_files()
+    await target.refresh_index()
+
+    total_bytes = len(payload) * (uploads - run["errors"])
+    return {
+        **latency_stats(run["latencies"]),
+        "mb_per_s": round(total_bytes / run["wall_seconds"] / (1024 * 1024), 3),
+        "req_per_s": round(uploads / run["wall_seconds"], 3),
+        "errors": run["errors"],
+    }
+
+
+async def upload_throughput(target, env, sizes, concurrency_levels, uploads_per_level) -> Dict:
+    """Upload throughput through /upload for each file size and concurrency level."""
+    results = {}
+
+    for size in sizes:
+        payload = os.urandom(size)
+        for concurrency in concurrency_levels:
+            results[f"upload_{_format_size(size)}_c{concurrency}"] = await _timed_uploads(
+                target, env, payload, concurrency, uploads_per_level
+            )
+
+    return results
+
+
+async def durability(target, env, modes, sizes, concurrency_levels, uploads_per_level) -> Dict:
+    """
+    Upload throughput for each upload.durability mode: no fsync ("none"),
+    an fsync per upload ("file") and group commit ("group"). Only
+    meaningful on the disk the upload directory will live on in production.
+    """
+    results = {}
+
+    try:
+        for mode in modes:
+            env.set_config("upload", {"durability": {"mode": mode}})
+            env.write_config()
+            await target.reload_config()
+            for size in sizes:
+                payload = os.urandom(size)
+                for concurrency in concurrency_levels:
+                    results[f"durability_{mode}_{_format_size(size)}_c{concurrency}"] = await _timed_uploads(
+                        target, env, payload, concurrency, uploads_per_level
+                    )
+    finally:
+        env.set_config("upload", {"durability": {"mode": "none"}})
+        env.write_config()
+        await target.reload_config()
+
+    return results
+
+
+async def download_page(target, env, file_counts, requests_per_level) -> Dict:
+    """Latency of the /download listing page with a growing number of stored files."""
+    results = {}
+
+    for count in file_counts:
+        env.seed_files(count)
+        await target.refresh_index()
+
+        async with target.client() as client:
+            await login(client, *READER_USER)
+            # Warm up caches and connections
+            await client.get("/download")
+            run = await timed_requests(lambda i: client.get("/download", params={"page": 1 + i % 5}), requests_per_level, 1)
+
+        results[f"download_page_{count}_files"] = {**latency_stats(run["latencies"]), "errors": run["errors"]}
+
+    env.clear_files()
+    await target.refresh_index()
+    return results
+
+
+async def api_auth(target, env, requests) -> Dict:
+    """Latency of a minimal Basic Auth API upload, dominated by password verification."""
+    async with target.client(auth=httpx.BasicAuth(*API_USER)) as client:
+        run = await timed_requests(
+            lambda i: client.post("/api/upload", files={"file": (f"api_{i}.txt", b"x")}),
+            requests, 1
+        )
+
+    env.clear_files()
+    await target.refresh_index()
+    return {"api_basic_auth_upload": {**latency_stats(run["latencies"]), "errors": run["errors"]}}
+
+
+async def middleware_overhead(target, env, requests) -> Dict:
+    """
+    Cost of the middleware stack: /health through the full app versus the same
+    endpoint mounted on a bare FastAPI app. Only meaningful in-process.
+    """
+    if target.name != "inprocess":
+        return {}
+
+    from fastapi import FastAPI
+    from app.main import health_check
+
+    bare = FastAPI()
+    bare.get("/health")(health_check)
+
+    async with target.client() as client:
+        full = await timed_requests(lambda i: client.get("/health"), requests, 1)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=bare, client=("127.0.0.1", 50000)),
+                                 base_url="http://bench") as client:
+        baseline = await timed_requests(lambda i: client.get("/health"), requests, 1)
+
+    full_stats = latency_stats(full["latencies"])
+    bare_stats = latency_stats(baseline["latencies"])
+    return {
+        "health_full_stack": full_stats,
+        "health_bare_app": bare_stats,
+        "middleware_overhead": {"mean_ms": round(full_stats["mean_ms"] - bare_stats["mean_ms"], 3)},
+    }
+
+
+async def startup(target, env, runs) -> Dict:
+    """
+    Time to import the app in a fresh interpreter, i.e. what every worker
+    (re)start pays before it can serve, next to a bare interpreter start.
+    """
+    process_env = dict(os.environ, CONFIG_PATH=str(env.config_path))
+
+    async def run_python(code):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(sys.executable, "-c", code, env=process_env)
+            if await process.wait() != 0:
+                raise RuntimeError(f"python -c {code!r} failed")
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    interpreter = latency_stats(await run_python("pass"))
+    app_import = latency_stats(await run_python("import app.main"))
+    return {
+        "startup_interpreter": interpreter,
+        "startup_import_app": app_import,
+        "startup_app_only": {"mean_ms": round(app_import["mean_ms"] - interpreter["mean_ms"], 3)},
+    }
+
+
+def _format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size // (1024 * 1024)}mb"
+    return f"{size // 1024}kb"
+
+
+# Scenario settings for a full run and for a quick smoke run
+PROFILES = {
+    "full": {
+        "upload_throughput": {"sizes": [64 * 1024, 1024 * 1024, 16 * 1024 * 1024],
+                              "concurrency_levels": [1, 4, 16], "uploads_per_level": 64},
+        "download_page": {"file_counts": [1000, 10000, 100000], "requests_per_level": 50},
+        "api_auth": {"requests": 20},
+        "middleware_overhead": {"requests": 500},
+        "startup": {"runs": 10},
+        "durability": {"modes": ["none", "file", "group"], "sizes": [64 * 1024, 1024 * 1024],
+                       "concurrency_levels": [1, 4, 16], "uploads_per_level": 64},
+    },
+    "quick": {
+        "upload_throughput": {"sizes": [64 * 1024, 1024 * 1024], "concurrency_levels": [1, 4], "uploads_per_level": 16},
+        "download_page": {"file_counts": [1000], "requests_per_level": 20},
+        "api_auth": {"requests": 5},
+        "middleware_overhead": {"requests": 200},
+        "startup": {"runs": 3},
+        "durability": {"modes": ["none", "file", "group"], "sizes": [64 * 1024], "concurrency_levels": [1, 4],
+                       "uploads_per_level": 16},
+    },
+}
+
+SCENARIOS = {
+    "upload_throughput": upload_throughput,
+    "download_page": download_page,
+    "api_auth": api_auth,
+    "middleware_overhead": middleware_overhead,
+    "startup": startup,
+    "durability": durability,
+}
@@ -0,0 +1,37 @@
+"""
+gunicorn settings, read from the configuration file like the app itself.
+
+    gunicorn app.main:app
+
+Send SIGHUP to the master process for a rolling restart: new workers
+start with the reloaded configuration while the old ones drain.
+"""
+import math
+import os
+
+from app.utils.config import Settings, get_config_path, load_config
+
+try:
+    _config = load_config(get_config_path())
+except FileNotFoundError:
+    _config = Settings()
+_server = _config["server"]
+_drain = _server.get("drain", {})
+
+_ssl = _server["ssl"]
+if _ssl["enabled"] and os.path.exists(_ssl["key_path"]) and os.path.exists(_ssl["cert_path"]):
+    bind = f"{_server['host']}:{_ssl['port']}"
+    keyfile = _ssl["key_path"]
+    certfile = _ssl["cert_path"]
+else:
+    # Without a certificate, serve plain HTTP as the container always has
+    bind = f"{_server['host']}:{_server['port']}"
+
+worker_class = "app.server.DrainingUvicornWorker"
+# Sessions live in worker memory, so more workers need sticky sessions in front
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# Old workers drain (pre-stop delay plus transfer deadline) before gunicorn kills them
+graceful_timeout = math.ceil(_drain.get("pre_stop_seconds", 0) + _drain.get("timeout_seconds", 60)) + 5
+# Large transfers keep a worker busy without blocking its event loop
+timeout = 120
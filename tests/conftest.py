@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+import pytest
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app reads its configuration at import, so point it at a copy that
+# keeps uploads, logs and builds in a scratch directory first
+_work_dir = tempfile.mkdtemp(prefix="upload-tests-")
+with open(os.path.join(REPO_DIR, "config", "config.yml")) as f:
+    _config = yaml.safe_load(f)
+_config["upload"]["directory"] = os.path.join(_work_dir, "uploads")
+_config["upload"]["metadata_db"] = os.path.join(_work_dir, "uploads", ".metadata.db")
+_config["logging"]["file"] = os.path.join(_work_dir, "logs", "server.log")
+_config["logging"]["audit_file"] = os.path.join(_work_dir, "logs", "audit.log")
+_config["profiling"]["directory"] = os.path.join(_work_dir, "logs", "profiles")
+_config["static"]["build_dir"] = os.path.join(_work_dir, "build", "static")
+_config["storage"]["directory"] = os.path.join(_work_dir, "storage")
+_config["security"]["users_file"] = os.path.join(REPO_DIR, "config", "users.yml")
+_config["security"]["ip_whitelist_file"] = os.path.join(REPO_DIR, "config", "ip_whitelist.yml")
+# The test client talks plain HTTP
+_config["security"]["cookies"]["secure"] = False
+_config["rate_limit"]["enabled"] = False
+_config_path = os.path.join(_work_dir, "config.yml")
+with open(_config_path, "w") as f:
+    yaml.safe_dump(_config, f)
+os.environ["CONFIG_PATH"] = _config_path
+
+
+@pytest.fixture(scope="session")
+def client():
+    """A test client logged in as the default admin user."""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        response = test_client.post("/login", data={"username": "admin", "password": "admin"}, follow_redirects=False)
+        assert response.status_code == 303
+        yield test_client
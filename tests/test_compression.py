@@ -0,0 +1,34 @@
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+
+def make_client(**options):
+    from app.utils.compression import CompressionMiddleware
+
+    async def text(request):
+        size = int(request.query_params["size"])
+        return Response(b"x" * size, media_type="text/plain", headers={"Accept-Ranges": "bytes"})
+
+    app = Starlette(routes=[Route("/notes.txt", text)])
+    return TestClient(CompressionMiddleware(app, **options))
+
+
+def test_compressed_response_drops_accept_ranges():
+    response = make_client().get("/notes.txt?size=100000", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-ranges" not in response.headers
+    assert response.content == b"x" * 100000
+
+
+def test_response_over_maximum_size_is_not_compressed():
+    client = make_client(maximum_size=50000)
+
+    response = client.get("/notes.txt?size=100000", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["accept-ranges"] == "bytes"
+
+    response = client.get("/notes.txt?size=20000", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
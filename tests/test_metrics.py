@@ -0,0 +1,32 @@
+from fastapi.testclient import TestClient
+
+from app.utils import config
+
+
+def test_metrics_require_an_admin_session(client):
+    from app.main import app
+
+    assert client.get("/metrics").status_code == 200
+
+    with TestClient(app) as anonymous:
+        assert anonymous.get("/metrics").status_code == 401
+
+        response = anonymous.post("/login", data={"username": "reader", "password": "reader"}, follow_redirects=False)
+        assert response.status_code == 303
+        assert anonymous.get("/metrics").status_code == 403
+
+
+def test_metrics_accept_the_scraper_token(monkeypatch):
+    from app.main import app
+
+    settings = config.get_settings()
+    monkeypatch.setattr(config, "_settings", settings.model_copy(
+        update={"metrics": settings.metrics.model_copy(update={"token": "scrape-me"})}))
+    with TestClient(app) as scraper:
+        response = scraper.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+        assert response.status_code == 200
+        assert "log_records_dropped_total" in response.text
+
+        response = scraper.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        assert response.status_code == 401
+        assert response.headers["www-authenticate"] == "Bearer"
@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+
+def call_app(client, method, path, extensions):
+    """Call the app directly with ASGI extensions, which the test client can't offer. Returns the messages sent."""
+    from app.main import app
+
+    cookie = "; ".join(f"{name}={value}" for name, value in client.cookies.items())
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 50000),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"accept-encoding", b"gzip, deflate, br"),
+            (b"cookie", cookie.encode()),
+        ],
+        "extensions": extensions,
+    }
+    messages = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Like a server, only report the disconnect once the response is done
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            # What the server would do with the file handed to it
+            message = dict(message, data=os.pread(message["file"].fileno(), message["count"], message["offset"]))
+        messages.append(message)
+
+    async def run():
+        await app(scope, receive, send)
+
+    client.portal.call(run)
+    return messages
+
+
+def upload(client, name, data):
+    response = client.post("/upload", files={"file": (name, data)})
+    assert response.status_code == 200
+    return response.json()["filename"]
+
+
+def test_download_uses_zero_copy_send(client):
+    data = os.urandom(1024 * 1024)
+    filename = upload(client, "data.dat", data)
+
+    messages = call_app(client, "GET", f"/files/{filename}", {"http.response.zerocopysend": {}})
+
+    assert messages[0]["type"] == "http.response.start"
+    assert messages[0]["status"] == 200
+    sends = [message for message in messages[1:] if message["type"] == "http.response.zerocopysend"]
+    assert sends
+    assert b"".join(message["data"] for message in sends) == data
+
+
+def test_compressed_download_does_not_use_zero_copy(client):
+    data = b"line of text\n" * 10000
+    filename = upload(client, "notes.txt", data)
+
+    messages = call_app(client, "GET", f"/files/{filename}", {"http.response.zerocopysend": {}})
+
+    headers = dict(messages[0]["headers"])
+    assert headers[b"content-encoding"] in (b"gzip", b"br", b"zstd")
+    assert all(message["type"] == "http.response.body" for message in messages[1:])